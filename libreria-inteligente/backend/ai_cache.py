@@ -0,0 +1,110 @@
+"""Caché persistente de respuestas de la IA.
+
+Dos niveles: un LRU en memoria y una tabla SQLite en disco con expulsión por tamaño
+(se eliminan primero las entradas usadas hace más tiempo). Vive en su propio fichero,
+separado de library.db, para sobrevivir a un borrado de la biblioteca.
+
+Los accesos a disco son bloqueantes: desde código asíncrono se llama a get y set en el pool de I/O.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Las lecturas desde disco no escriben: last_used se actualiza en lotes de este tamaño (o al guardar)
+TOUCH_BATCH_SIZE = 64
+
+def make_key(model_name: str, prompt: str) -> str:
+    """Clave de caché: hash del modelo y del prompt completo."""
+    return hashlib.sha256(f"{model_name}\0{prompt}".encode("utf-8")).hexdigest()
+
+class ResultCache:
+    def __init__(self, db_path: str, max_disk_bytes: int, max_memory_items: int = 1024):
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_items = max_memory_items
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        self._touched: dict[str, float] = {} # clave -> last_used pendiente de escribir
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_last_used ON cache (last_used)")
+        self._conn.commit()
+        self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def get(self, key: str) -> dict | None:
+        """Devuelve el valor guardado para la clave, o None si no está en ningún nivel."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_BATCH_SIZE:
+                self._flush_touched()
+                self._conn.commit()
+            value = json.loads(row[0])
+            self._remember(key, value)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: dict):
+        """Guarda el valor en ambos niveles y aplica el límite de tamaño en disco."""
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        with self._lock:
+            self._remember(key, value)
+            old = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, data, size, time.time()),
+            )
+            self._disk_bytes += size - (old[0] if old else 0)
+            self._touched.pop(key, None)
+            self._flush_touched() # La expulsión ordena por last_used
+            self._evict()
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def _remember(self, key: str, value: dict):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE cache SET last_used = ? WHERE key = ?",
+                                   [(used, key) for key, used in self._touched.items()])
+            self._touched.clear()
+
+    def _evict(self):
+        while self._disk_bytes > self.max_disk_bytes:
+            rows = self._conn.execute("SELECT key, size FROM cache ORDER BY last_used LIMIT 100").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._memory.pop(key, None)
+                self._disk_bytes -= size
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
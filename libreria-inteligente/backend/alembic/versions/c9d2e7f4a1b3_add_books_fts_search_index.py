@@ -0,0 +1,65 @@
+"""Add books_fts full-text search index
+
+Revision ID: c9d2e7f4a1b3
+Revises: b4f1c8e2d9a7
+Create Date: 2026-10-18 12:41:09.318245
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9d2e7f4a1b3'
+down_revision = 'b4f1c8e2d9a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # El índice incluye language, que ninguna migración anterior añadía (las bases creadas con create_all ya la tienen)
+    columns = [c['name'] for c in sa.inspect(op.get_bind()).get_columns('books')]
+    if 'language' not in columns:
+        op.add_column('books', sa.Column('language', sa.String(), nullable=True))
+        op.create_index(op.f('ix_books_language'), 'books', ['language'], unique=False)
+
+    # Tabla virtual FTS5 (sin distinguir mayúsculas ni acentos) sincronizada con books mediante triggers.
+    # El servidor la crea al arrancar (search_index.ensure_search_index) si aún no existe, así que
+    # puede estar ya creada e indexada: todo es IF NOT EXISTS y los libros solo se indexan con una tabla nueva
+    fts_exists = sa.inspect(op.get_bind()).has_table('books_fts')
+    op.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, category, language, description, body,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts(rowid, title, author, category, language, description)
+            VALUES (new.id, new.title, new.author, new.category, new.language, new.description);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            DELETE FROM books_fts WHERE rowid = old.id;
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, category, language, description ON books BEGIN
+            UPDATE books_fts SET title = new.title, author = new.author, category = new.category,
+                language = new.language, description = new.description
+            WHERE rowid = old.id;
+        END
+    """)
+    if not fts_exists:
+        op.execute("""
+            INSERT INTO books_fts(rowid, title, author, category, language, description)
+            SELECT id, title, author, category, language, description FROM books
+        """)
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS books_fts_update")
+    op.execute("DROP TRIGGER IF EXISTS books_fts_delete")
+    op.execute("DROP TRIGGER IF EXISTS books_fts_insert")
+    op.execute("DROP TABLE IF EXISTS books_fts")
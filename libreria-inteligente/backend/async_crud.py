@@ -0,0 +1,36 @@
+"""Versiones asíncronas de las funciones de crud, para usar con database.AsyncSessionLocal
+o database.AsyncReadSessionLocal.
+
+Cada función ejecuta la de crud con AsyncSession.run_sync: las consultas son exactamente las mismas
+y la espera a SQLite la hace aiosqlite (un hilo por conexión del pool, no uno del threadpool por
+petición). La función de crud corre en el bucle de eventos, así que aquí solo van las que no tocan
+archivos: crud.delete_book y crud.delete_books_by_category borran archivos y miniaturas, y las rutas
+usan delete_books con la limpieza en segundo plano.
+"""
+import functools
+from sqlalchemy.ext.asyncio import AsyncSession
+import crud
+
+def _run_sync(func):
+    @functools.wraps(func)
+    async def wrapper(db: AsyncSession, *args, **kwargs):
+        return await db.run_sync(func, *args, **kwargs)
+    return wrapper
+
+get_book_by_path = _run_sync(crud.get_book_by_path)
+get_book_by_hash = _run_sync(crud.get_book_by_hash)
+get_book = _run_sync(crud.get_book)
+get_book_by_title = _run_sync(crud.get_book_by_title)
+get_books_by_partial_title = _run_sync(crud.get_books_by_partial_title)
+get_books = _run_sync(crud.get_books)
+get_books_page = _run_sync(crud.get_books_page)
+count_books = _run_sync(crud.count_books)
+get_facets = _run_sync(crud.get_facets)
+get_categories = _run_sync(crud.get_categories)
+get_languages = _run_sync(crud.get_languages)
+get_books_count = _run_sync(crud.get_books_count)
+create_book = _run_sync(crud.create_book)
+update_book = _run_sync(crud.update_book)
+set_cover_hash = _run_sync(crud.set_cover_hash)
+delete_books = _run_sync(crud.delete_books)
+update_books = _run_sync(crud.update_books)
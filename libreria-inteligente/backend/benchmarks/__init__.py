@@ -0,0 +1 @@
+"""Benchmarks de rendimiento del backend. Se ejecutan desde la carpeta backend con python -m benchmarks.<nombre>."""
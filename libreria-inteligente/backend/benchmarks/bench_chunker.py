@@ -0,0 +1,75 @@
+"""Micro-benchmark del troceado de texto para RAG: rag.chunk_text frente a la implementación anterior.
+
+Uso (desde la carpeta backend):
+    python -m benchmarks.bench_chunker --mb 5
+"""
+import argparse
+import os
+import random
+import time
+import tracemalloc
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark") # rag.py exige una clave al importarse
+import rag
+
+WORDS = ("el libro de la biblioteca contiene capítulos sobre historia ciencia arte y filosofía "
+         "que el lector recorre con calma mientras anota ideas en su cuaderno").split()
+
+def legacy_chunk_text(text: str, max_tokens: int = 1000) -> list[str]:
+    """Implementación original de rag.chunk_text, para comparar."""
+    import tiktoken
+    if not text.strip():
+        return []
+    tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")
+    tokens = tokenizer.encode(text)
+    chunks = []
+    current_chunk_tokens = []
+    for token in tokens:
+        current_chunk_tokens.append(token)
+        if len(current_chunk_tokens) >= max_tokens:
+            chunks.append(tokenizer.decode(current_chunk_tokens))
+            current_chunk_tokens = []
+    if current_chunk_tokens:
+        chunks.append(tokenizer.decode(current_chunk_tokens))
+    return chunks
+
+def make_text(size_mb: float, seed: int = 0) -> str:
+    """Genera texto sintético con frases y párrafos hasta alcanzar size_mb."""
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    parts, size = [], 0
+    while size < target:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 30))).capitalize()
+        sentence += rng.choice([". ", ". ", "? ", "! ", ".\n\n"])
+        parts.append(sentence)
+        size += len(sentence.encode("utf-8"))
+    return "".join(parts)
+
+def measure(name: str, func, text: str):
+    size_mb = len(text.encode("utf-8")) / (1024 * 1024)
+    start = time.perf_counter()
+    chunks = func(text)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<10} {len(chunks):>7} chunks  {elapsed:8.3f} s  {size_mb / elapsed:8.2f} MB/s  pico {peak / (1024 * 1024):8.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=float, default=5, help="Tamaño del texto sintético en MB")
+    parser.add_argument("--max-tokens", type=int, default=rag.CHUNK_MAX_TOKENS)
+    parser.add_argument("--overlap", type=int, default=rag.CHUNK_OVERLAP_TOKENS)
+    args = parser.parse_args()
+
+    text = make_text(args.mb)
+    rag.get_tokenizer() # Cargar el tokenizador fuera de la medición
+    print(f"Texto sintético de {args.mb} MB, max_tokens={args.max_tokens}, overlap={args.overlap}")
+    measure("anterior", lambda t: legacy_chunk_text(t, args.max_tokens), text)
+    measure("actual", lambda t: rag.chunk_text(t, args.max_tokens, args.overlap), text)
+
+if __name__ == "__main__":
+    main()
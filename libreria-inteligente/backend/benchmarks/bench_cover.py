@@ -0,0 +1,105 @@
+"""Benchmark de la detección de portada en process_pdf sobre PDFs sintéticos.
+
+Compara processing.process_pdf con la implementación anterior, que decodificaba cada imagen
+de cada página hasta encontrar una mayor de 300x300.
+
+Uso (desde la carpeta backend):
+    python -m benchmarks.bench_cover --pages 200
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import fitz
+
+import processing
+
+def legacy_process_pdf(file_path: str, static_dir: str) -> dict:
+    """Implementación original de process_pdf, para comparar."""
+    doc = fitz.open(file_path)
+    text = ""
+    for i in range(min(len(doc), 5)): text += doc.load_page(i).get_text("text", sort=True)
+    cover_path = None
+    for i in range(len(doc)):
+        for img in doc.get_page_images(i):
+            xref = img[0]
+            pix = fitz.Pixmap(doc, xref)
+            if pix.width > 300 and pix.height > 300:
+                cover_filename = f"cover_{os.path.basename(file_path)}.png"
+                cover_full_path = os.path.join(static_dir, cover_filename)
+                pix.save(cover_full_path)
+                cover_path = f"{static_dir}/{cover_filename}"
+                break
+        if cover_path: break
+    return {"text": text, "cover_image_url": cover_path}
+
+def make_image(width: int, height: int, seed: int, jpeg: bool = False) -> bytes:
+    """Imagen RGB con un patrón simple, codificada como PNG o JPEG."""
+    color = bytes((seed * 37 % 256, seed * 91 % 256, seed * 53 % 256))
+    banded_row = b"\xff\xff\xff" * (width // 2) + color * (width - width // 2)
+    plain_row = color * width
+    samples = banded_row * (height // 3) + plain_row * (height - height // 3)
+    pix = fitz.Pixmap(fitz.csRGB, width, height, samples, False)
+    return pix.tobytes("jpeg" if jpeg else "png")
+
+def make_pdf(path: str, pages: int, images_per_page: int, cover: str | None, jpeg_cover: bool = False):
+    """Crea un PDF sintético.
+
+    cover: "first" pone una imagen grande en la página 1, "last" en la última página, None ninguna.
+    """
+    small_images = [make_image(200, 200, seed) for seed in range(1, 9)]
+    cover_image = make_image(800, 1200, 7, jpeg=jpeg_cover)
+    small_xrefs = {}
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Página {i + 1}. " + "Texto de relleno para el benchmark. " * 10)
+        for j in range(images_per_page):
+            x = 72 + (j % 4) * 110
+            y = 150 + (j // 4) * 110
+            # Las imágenes pequeñas se insertan una vez y se reutilizan por xref para generar rápido
+            k = (i + j) % len(small_images)
+            if k in small_xrefs:
+                page.insert_image(fitz.Rect(x, y, x + 100, y + 100), xref=small_xrefs[k])
+            else:
+                small_xrefs[k] = page.insert_image(fitz.Rect(x, y, x + 100, y + 100), stream=small_images[k])
+        if (cover == "first" and i == 0) or (cover == "last" and i == pages - 1):
+            page.insert_image(fitz.Rect(72, 400, 372, 800), stream=cover_image)
+    doc.save(path)
+
+def timed(func, *args, repeat: int = 5) -> tuple[float, dict]:
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200, help="Páginas de los PDFs con muchas imágenes")
+    parser.add_argument("--images-per-page", type=int, default=4)
+    args = parser.parse_args()
+
+    scenarios = {
+        "portada PNG en la página 1": dict(pages=args.pages, images_per_page=args.images_per_page, cover="first"),
+        "portada JPEG en la página 1": dict(pages=args.pages, images_per_page=args.images_per_page, cover="first", jpeg_cover=True),
+        "muchas imágenes pequeñas, portada al final": dict(pages=args.pages, images_per_page=args.images_per_page, cover="last"),
+        "muchas imágenes pequeñas, sin portada": dict(pages=args.pages, images_per_page=args.images_per_page, cover=None),
+        "solo texto": dict(pages=args.pages, images_per_page=0, cover=None),
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        covers_dir = os.path.join(temp_dir, "covers")
+        os.makedirs(covers_dir)
+        print(f"{'escenario':<45} {'anterior':>10} {'actual':>10}  portada actual")
+        for i, (name, params) in enumerate(scenarios.items()):
+            pdf_path = os.path.join(temp_dir, f"bench_{i}.pdf")
+            make_pdf(pdf_path, **params)
+            legacy_time, _ = timed(legacy_process_pdf, pdf_path, covers_dir)
+            new_time, result = timed(processing.process_pdf, pdf_path, covers_dir)
+            cover = os.path.basename(result["cover_image_url"] or "-")
+            print(f"{name:<45} {legacy_time * 1000:>8.1f}ms {new_time * 1000:>8.1f}ms  {cover}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Benchmark de lecturas y escrituras concurrentes sobre SQLite.
+
+Compara la configuración anterior (motor síncrono, journal por defecto, lecturas en el threadpool
+como las rutas síncronas de FastAPI) con WAL + busy_timeout y lecturas de solo lectura, síncronas
+y con el motor asíncrono. Mientras los lectores piden páginas de /books/, un escritor inserta
+y borra por categoría lotes de libros, que es la escritura larga típica.
+
+Uso (desde la carpeta backend):
+    python -m benchmarks.bench_db_concurrency --books 20000 --readers 32 --seconds 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import async_crud
+import crud
+import database
+import models
+import search_index
+
+WORDS = ["historia", "sombra", "viento", "mar", "noche", "ciudad", "jardín", "tiempo", "fuego", "río"]
+THREADPOOL_SIZE = 40 # El límite por defecto de hilos de AnyIO para rutas síncronas
+
+def seed(engine, books: int):
+    """Crea el esquema y llena la tabla con libros sintéticos."""
+    models.Base.metadata.create_all(bind=engine)
+    search_index.ensure_search_index(engine)
+    rng = random.Random(0)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add_all(
+            models.Book(
+                title=" ".join(rng.sample(WORDS, 3)).capitalize(),
+                author=f"Autor {i % 500}",
+                category=f"Categoría {i % 40}",
+                language=rng.choice(["es", "en", "fr"]),
+                file_path=f"/biblioteca/libro_{i}.pdf",
+            )
+            for i in range(books)
+        )
+        db.commit()
+
+def write_batch(Session, batch: int, tag: int):
+    """Escritura larga: inserta un lote en una transacción y lo borra con delete_books_by_category."""
+    category = f"temporal {tag}"
+    with Session() as db:
+        db.add_all(
+            models.Book(title=f"Temporal {i}", author="Escritor", category=category, language="es",
+                        file_path=f"/temporal/{tag}_{i}.pdf")
+            for i in range(batch)
+        )
+        db.commit()
+        crud.delete_books_by_category(db, category)
+
+def pick_search(rng: random.Random, search_ratio: float) -> str | None:
+    return rng.choice(WORDS) if rng.random() < search_ratio else None
+
+def read_page(db_session, search: str | None):
+    crud.get_books_page(db_session, limit=60, search=search)
+    crud.count_books(db_session, search=search)
+
+async def run_scenario(name: str, read, write, args) -> dict:
+    """Lanza los lectores y un escritor que repite una escritura larga cada `write_interval` segundos."""
+    latencies, write_latencies, errors = [], [], 0
+    stop = time.perf_counter() + args.seconds
+
+    async def reader(seed_value: int):
+        nonlocal errors
+        rng = random.Random(seed_value)
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                await read(rng)
+                latencies.append(time.perf_counter() - start)
+            except OperationalError:
+                errors += 1
+
+    def writer():
+        nonlocal errors
+        tag = 0
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                write(tag)
+                write_latencies.append(time.perf_counter() - start)
+            except OperationalError:
+                errors += 1
+            tag += 1
+            time.sleep(args.write_interval)
+
+    writer_thread = threading.Thread(target=writer)
+    writer_thread.start()
+    await asyncio.gather(*(reader(i) for i in range(args.readers)))
+    writer_thread.join()
+
+    latencies.sort()
+    return {
+        "escenario": name,
+        "lecturas/s": len(latencies) / args.seconds,
+        "p50 ms": statistics.median(latencies) * 1000 if latencies else float("nan"),
+        "p95 ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else float("nan"),
+        "máx ms": latencies[-1] * 1000 if latencies else float("nan"),
+        "escrituras": len(write_latencies),
+        "ms/escritura": statistics.mean(write_latencies) * 1000 if write_latencies else float("nan"),
+        "errores": errors,
+    }
+
+async def sync_scenario(name: str, path: str, args, wal: bool) -> dict:
+    """Lecturas síncronas en un threadpool, como las rutas `def` de FastAPI.
+
+    Sin WAL es la configuración anterior: un único motor con el journal por defecto.
+    """
+    if wal:
+        engine = database.make_engine(f"sqlite:///{path}")
+        read_engine = database.make_engine(f"sqlite:///{path}", read_only=True)
+    else:
+        engine = read_engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    seed(engine, args.books)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    ReadSession = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+    executor = ThreadPoolExecutor(max_workers=THREADPOOL_SIZE)
+    loop = asyncio.get_running_loop()
+
+    def read_sync(search):
+        with ReadSession() as db:
+            read_page(db, search)
+
+    async def read(rng):
+        await loop.run_in_executor(executor, read_sync, pick_search(rng, args.search_ratio))
+
+    try:
+        return await run_scenario(name, read, lambda tag: write_batch(Session, args.batch, tag), args)
+    finally:
+        executor.shutdown()
+        read_engine.dispose()
+        engine.dispose()
+
+async def async_scenario(name: str, path: str, args) -> dict:
+    """WAL + busy_timeout, escrituras con el motor síncrono y lecturas con el asíncrono de solo lectura."""
+    engine = database.make_engine(f"sqlite:///{path}")
+    seed(engine, args.books)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    read_engine = database.make_async_engine(f"sqlite+aiosqlite:///{path}", read_only=True)
+    ReadSession = async_sessionmaker(read_engine, autoflush=False, expire_on_commit=False)
+
+    async def read(rng):
+        search = pick_search(rng, args.search_ratio)
+        async with ReadSession() as db:
+            await async_crud.get_books_page(db, limit=60, search=search)
+            await async_crud.count_books(db, search=search)
+
+    try:
+        return await run_scenario(name, read, lambda tag: write_batch(Session, args.batch, tag), args)
+    finally:
+        await read_engine.dispose()
+        engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=20000, help="Libros en la base de datos")
+    parser.add_argument("--readers", type=int, default=32, help="Lectores concurrentes")
+    parser.add_argument("--batch", type=int, default=2000, help="Libros por escritura larga")
+    parser.add_argument("--search-ratio", type=float, default=0.5, help="Fracción de lecturas que son búsquedas")
+    parser.add_argument("--write-interval", type=float, default=1.0, help="Pausa entre escrituras largas (s)")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Duración de cada escenario")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results = [
+            asyncio.run(sync_scenario("antes (journal, sync)", os.path.join(temp_dir, "antes.db"), args, wal=False)),
+            asyncio.run(sync_scenario("WAL, sync", os.path.join(temp_dir, "wal_sync.db"), args, wal=True)),
+            asyncio.run(async_scenario("WAL, async", os.path.join(temp_dir, "wal_async.db"), args)),
+        ]
+    columns = list(results[0])
+    print("  ".join(f"{c:>22}" if i == 0 else f"{c:>11}" for i, c in enumerate(columns)))
+    for result in results:
+        print("  ".join(f"{v:>22}" if i == 0 else (f"{v:>11.1f}" if isinstance(v, float) else f"{v:>11}") for i, v in enumerate(result.values())))
+
+if __name__ == "__main__":
+    main()
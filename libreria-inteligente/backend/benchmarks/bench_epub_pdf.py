@@ -0,0 +1,167 @@
+"""Benchmark de la conversión EPUB -> PDF sobre un EPUB sintético de muchos capítulos.
+
+Compara processing.render_epub_to_pdf (capítulos en paralelo en el pool de procesos y unión
+con PyMuPDF) con la implementación anterior, que renderizaba todo en un proceso y unía las
+páginas maquetadas en memoria. Cada variante se ejecuta en un proceso nuevo para medir su
+pico de memoria (RSS) por separado: el del proceso principal y el mayor de sus procesos hijos.
+
+Uso (desde la carpeta backend):
+    python -m benchmarks.bench_epub_pdf --chapters 200 --workers 4
+"""
+import argparse
+import asyncio
+import io
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import fitz
+from ebooklib import epub
+
+import processing
+import workers
+
+PARAGRAPH = ("Érase una vez una biblioteca en la que cada libro tenía su propio índice, sus notas al margen "
+             "y un buen puñado de ilustraciones que nadie había catalogado todavía. ")
+
+BOOK_CSS = """
+body { font-family: serif; line-height: 1.5; margin: 1em; }
+h1 { font-size: 1.8em; page-break-before: always; }
+p { text-align: justify; text-indent: 1.5em; }
+"""
+
+def legacy_render_epub_to_pdf(epub_path: str, output_path: str):
+    """Implementación original de render_epub_to_pdf, para comparar."""
+    import zipfile
+    import pathlib
+    from bs4 import BeautifulSoup
+    from weasyprint import HTML, CSS
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with zipfile.ZipFile(epub_path, 'r') as zip_ref:
+            zip_ref.extractall(temp_dir)
+        opf_path = next(pathlib.Path(temp_dir).rglob('*.opf'), None)
+        content_root = opf_path.parent
+        with open(opf_path, 'rb') as f:
+            opf_soup = BeautifulSoup(f, 'lxml-xml')
+
+        html_docs = []
+        cover_meta = opf_soup.find('meta', {'name': 'cover'})
+        if cover_meta:
+            cover_item = opf_soup.find('item', {'id': cover_meta.get('content')})
+            if cover_item:
+                cover_path = content_root / cover_item.get('href')
+                if cover_path.exists():
+                    html_docs.append(HTML(string=f"<html><body style='text-align: center; margin: 0; padding: 0;'><img src='{cover_path.as_uri()}' style='width: 100%; height: 100%; object-fit: contain;'/></body></html>"))
+
+        stylesheets = []
+        for css_item in opf_soup.find_all('item', {'media-type': 'text/css'}):
+            css_path = content_root / css_item.get('href')
+            if css_path.exists():
+                stylesheets.append(CSS(filename=css_path))
+
+        spine_ids = [item.get('idref') for item in opf_soup.find('spine').find_all('itemref')]
+        html_paths_map = {item['id']: item['href'] for item in opf_soup.find_all('item', {'media-type': 'application/xhtml+xml'})}
+        for chapter_id in spine_ids:
+            href = html_paths_map.get(chapter_id)
+            if href and (content_root / href).exists():
+                html_docs.append(HTML(filename=content_root / href, encoding='utf-8'))
+
+        first_doc = html_docs[0].render(stylesheets=stylesheets)
+        all_pages = [p for doc in html_docs[1:] for p in doc.render(stylesheets=stylesheets).pages]
+        pdf_bytes_io = io.BytesIO()
+        first_doc.copy(all_pages).write_pdf(target=pdf_bytes_io)
+
+    with open(output_path, "wb") as f:
+        f.write(pdf_bytes_io.getvalue())
+
+def make_cover() -> bytes:
+    pix = fitz.Pixmap(fitz.csRGB, 600, 900, bytes((40, 70, 120)) * (600 * 900), False)
+    return pix.tobytes("png")
+
+def make_epub(path: str, chapters: int, paragraphs: int):
+    """Crea un EPUB con portada, una hoja de estilos y `chapters` capítulos de `paragraphs` párrafos."""
+    book = epub.EpubBook()
+    book.set_identifier("benchmark-epub-pdf")
+    book.set_title("Libro sintético")
+    book.set_language("es")
+    book.add_author("Autor de prueba")
+    book.set_cover("cover.png", make_cover())
+    style = epub.EpubItem(uid="style", file_name="style/book.css", media_type="text/css", content=BOOK_CSS)
+    book.add_item(style)
+
+    items = []
+    for i in range(chapters):
+        chapter = epub.EpubHtml(title=f"Capítulo {i + 1}", file_name=f"chap_{i:04d}.xhtml", lang="es")
+        chapter.content = f"<h1>Capítulo {i + 1}</h1>" + "".join(
+            f"<p>{PARAGRAPH * (1 + (i + j) % 4)}</p>" for j in range(paragraphs)
+        )
+        chapter.add_item(style)
+        book.add_item(chapter)
+        items.append(chapter)
+
+    book.toc = items
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = items
+    epub.write_epub(path, book)
+
+def max_rss_mb(who) -> float:
+    # En Linux ru_maxrss viene en KiB
+    return resource.getrusage(who).ru_maxrss / 1024
+
+def run_variant(variant: str, epub_path: str, output_path: str, cpu_workers: int, results):
+    """Se ejecuta en un proceso nuevo: convierte el EPUB y devuelve tiempos y memoria."""
+    workers.CPU_WORKERS = cpu_workers
+    processing.EPUB_PDF_MAX_CONCURRENT_CHAPTERS = cpu_workers
+    start = time.perf_counter()
+    if variant == "antes":
+        legacy_render_epub_to_pdf(epub_path, output_path)
+    else:
+        asyncio.run(processing.render_epub_to_pdf(epub_path, output_path))
+        workers.shutdown() # Espera a los hijos para que cuenten en RUSAGE_CHILDREN
+    elapsed = time.perf_counter() - start
+    with fitz.open(output_path) as doc:
+        pages = len(doc)
+    results.put({
+        "variante": variant,
+        "segundos": elapsed,
+        "páginas": pages,
+        "MB PDF": os.path.getsize(output_path) / 1024 / 1024,
+        "RSS MB": max_rss_mb(resource.RUSAGE_SELF),
+        "RSS hijo MB": max_rss_mb(resource.RUSAGE_CHILDREN),
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chapters", type=int, default=200, help="Capítulos del EPUB sintético")
+    parser.add_argument("--paragraphs", type=int, default=30, help="Párrafos por capítulo")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos del pool (CPU_WORKERS)")
+    parser.add_argument("--skip-legacy", action="store_true", help="No ejecutar la implementación anterior")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        epub_path = os.path.join(temp_dir, "libro.epub")
+        make_epub(epub_path, args.chapters, args.paragraphs)
+        print(f"EPUB de {args.chapters} capítulos: {os.path.getsize(epub_path) / 1024:.0f} KiB, {args.workers} procesos")
+
+        rows = []
+        for variant in ([] if args.skip_legacy else ["antes"]) + ["paralelo"]:
+            results = context.Queue()
+            process = context.Process(target=run_variant, args=(variant, epub_path, os.path.join(temp_dir, f"{variant}.pdf"), args.workers, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise SystemExit(f"La variante '{variant}' terminó con código {process.exitcode}")
+            rows.append(results.get())
+
+    columns = list(rows[0])
+    print("  ".join(f"{c:>12}" for c in columns))
+    for row in rows:
+        print("  ".join(f"{v:>12.1f}" if isinstance(v, float) else f"{v:>12}" for v in row.values()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Benchmark del envío a Kindle contra un servidor SMTP local de prueba.
+
+Compara el envío anterior (una conexión y un login por libro, dentro de la petición) con
+mail_queue.MailQueue, que reutiliza una conexión autenticada y agrupa libros en un mensaje.
+El servidor de prueba es un SMTP mínimo en asyncio (al estilo de aiosmtpd) que acepta
+cualquier credencial y simula la latencia de un servidor real por comando.
+
+Uso (desde la carpeta backend):
+    python -m benchmarks.bench_mail_queue --books 10 --latency 0.2
+
+Con --serve solo arranca el servidor de prueba, para probar la aplicación a mano con
+SMTP_SERVER=127.0.0.1, SMTP_PORT=<puerto> y SMTP_SECURITY=none.
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import tempfile
+import time
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+import mail_queue
+
+class StandInSmtpServer:
+    """Servidor SMTP en memoria: guarda los mensajes recibidos y cuenta conexiones y logins."""
+    def __init__(self, latency: float = 0.0, fail_first: int = 0):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.messages: list[bytes] = []
+        self.connections = 0
+        self.logins = 0
+        self.port = None
+        self._server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        async def reply(line: str):
+            await asyncio.sleep(self.latency)
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+        await reply("220 stand-in ESMTP")
+        try:
+            while line := await reader.readline():
+                command = line.decode(errors="replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    writer.write(b"250-stand-in\r\n250-AUTH PLAIN LOGIN\r\n")
+                    await reply("250 SIZE 104857600")
+                elif verb == "AUTH":
+                    if command.upper().startswith("AUTH LOGIN"):
+                        await reply("334 VXNlcm5hbWU6")
+                        await reader.readline()
+                        await reply("334 UGFzc3dvcmQ6")
+                        await reader.readline()
+                    self.logins += 1
+                    await reply("235 Authentication successful")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = bytearray()
+                    while (chunk := await reader.readline()) not in (b".\r\n", b""):
+                        data += chunk
+                    if self.fail_first > 0:
+                        self.fail_first -= 1
+                        await reply("451 Temporary failure, try again later")
+                    else:
+                        self.messages.append(bytes(data))
+                        await reply("250 OK")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else: # HELO, MAIL, RCPT, RSET, NOOP
+                    await reply("250 OK")
+        except asyncio.CancelledError:
+            pass # El servidor se detuvo con la conexión abierta
+        finally:
+            writer.close()
+
+def legacy_send(settings: dict, title: str, file_path: str):
+    """Envío original: conexión, login y mensaje por libro (con SMTP sin TLS para el servidor local)."""
+    msg = MIMEMultipart()
+    msg['From'] = settings["sender"]
+    msg['To'] = settings["recipient"]
+    msg['Subject'] = f"Conversión de libro: {title}"
+    msg.attach(MIMEText(f"Adjunto encontrarás el libro '{title}'.", 'plain'))
+    with open(file_path, "rb") as attachment:
+        part = MIMEBase('application', 'octet-stream')
+        part.set_payload(attachment.read())
+    encoders.encode_base64(part)
+    part.add_header('Content-Disposition', f"attachment; filename= {os.path.basename(file_path)}")
+    msg.attach(part)
+    server = smtplib.SMTP(settings["host"], settings["port"])
+    server.login(settings["sender"], settings["password"])
+    server.send_message(msg)
+    server.quit()
+
+async def run(args) -> list[dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths = []
+        for i in range(args.books):
+            path = os.path.join(temp_dir, f"libro_{i}.epub")
+            with open(path, "wb") as f:
+                f.write(os.urandom(args.size_kb * 1024))
+            paths.append(path)
+
+        # Antes: cada petición espera a su propio envío completo
+        server = StandInSmtpServer(args.latency)
+        await server.start()
+        settings = {"recipient": "kindle@example.com", "sender": "biblioteca@example.com", "password": "x",
+                    "host": "127.0.0.1", "port": server.port, "security": "none", "timeout": 30}
+        start = time.perf_counter()
+        request_times = []
+        for i, path in enumerate(paths):
+            request_start = time.perf_counter()
+            await asyncio.to_thread(legacy_send, settings, f"Libro {i}", path)
+            request_times.append(time.perf_counter() - request_start)
+        results.append({"variante": "antes", "segundos": time.perf_counter() - start,
+                        "ms/petición": 1000 * sum(request_times) / len(request_times),
+                        "conexiones": server.connections, "logins": server.logins, "mensajes": len(server.messages)})
+        await server.stop()
+
+        # Cola: la petición solo encola; un worker envía con una conexión reutilizada
+        server = StandInSmtpServer(args.latency, fail_first=args.fail_first)
+        await server.start()
+        settings["port"] = server.port
+        mail_queue.RETRY_BASE_SECONDS = 0.1
+        queue = mail_queue.MailQueue(os.path.join(temp_dir, "mail_queue.db"), settings_loader=lambda: settings)
+        queue.start()
+        start = time.perf_counter()
+        request_times, job_ids = [], []
+        for i, path in enumerate(paths):
+            request_start = time.perf_counter()
+            job_ids.append((await queue.submit(i, f"Libro {i}", path))["job_id"])
+            request_times.append(time.perf_counter() - request_start)
+        async def job_statuses():
+            return [(await queue.get(job_id))["status"] for job_id in job_ids]
+        while any(status not in ("sent", "failed") for status in await job_statuses()):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        statuses = await job_statuses()
+        results.append({"variante": "cola", "segundos": elapsed,
+                        "ms/petición": 1000 * sum(request_times) / len(request_times),
+                        "conexiones": server.connections, "logins": server.logins, "mensajes": len(server.messages),
+                        "enviados": statuses.count("sent"), "reintentos": queue.retried})
+        await queue.stop()
+        await server.stop()
+    return results
+
+async def serve(args):
+    server = StandInSmtpServer(args.latency)
+    await server.start(port=args.port)
+    print(f"Servidor SMTP de prueba en 127.0.0.1:{server.port} (Ctrl+C para salir)")
+    while True:
+        await asyncio.sleep(5)
+        print(f"conexiones={server.connections} logins={server.logins} mensajes={len(server.messages)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=10, help="Libros a enviar")
+    parser.add_argument("--size-kb", type=int, default=512, help="Tamaño de cada libro (KiB)")
+    parser.add_argument("--latency", type=float, default=0.1, help="Latencia del servidor por respuesta (s)")
+    parser.add_argument("--fail-first", type=int, default=1, help="Mensajes que el servidor rechaza con 451 antes de aceptar")
+    parser.add_argument("--serve", action="store_true", help="Solo arrancar el servidor de prueba")
+    parser.add_argument("--port", type=int, default=8025, help="Puerto del servidor con --serve")
+    args = parser.parse_args()
+
+    if args.serve:
+        asyncio.run(serve(args))
+        return
+    for result in asyncio.run(run(args)):
+        print("  ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in result.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Corpus sintético y reproducible para los benchmarks: texto, PDFs, EPUBs y filas de la tabla books.
+
+Todo se genera a partir de una semilla, sin red ni archivos externos: con los mismos
+parámetros se obtienen los mismos libros en cualquier máquina.
+"""
+import random
+
+import fitz
+from ebooklib import epub
+from sqlalchemy import insert
+from sqlalchemy.engine import Engine
+
+import models
+import search_index
+
+WORDS = ("el libro de la biblioteca contiene capítulos sobre historia ciencia arte y filosofía "
+         "que el lector recorre con calma mientras anota ideas en su cuaderno junto al río "
+         "una noche de viento en la ciudad del mar donde el tiempo y la sombra del jardín arden").split()
+TITLE_WORDS = ["historia", "sombra", "viento", "mar", "noche", "ciudad", "jardín", "tiempo", "fuego", "río"]
+LANGUAGES = ["Español", "Inglés", "Francés"]
+
+def make_paragraphs(n: int, rng: random.Random, sentences: tuple[int, int] = (3, 8)) -> list[str]:
+    """n párrafos de frases aleatorias con el vocabulario de WORDS."""
+    paragraphs = []
+    for _ in range(n):
+        sentence_list = []
+        for _ in range(rng.randint(*sentences)):
+            sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 24))).capitalize()
+            sentence_list.append(sentence + rng.choice([".", ".", ".", "?", "!"]))
+        paragraphs.append(" ".join(sentence_list))
+    return paragraphs
+
+def wrap_lines(paragraph: str, width: int = 80) -> str:
+    """Parte un párrafo en líneas de unos width caracteres, como el texto extraído de un PDF."""
+    lines, line = [], ""
+    for word in paragraph.split(" "):
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    lines.append(line)
+    return "\n".join(lines)
+
+def make_text(size_mb: float, seed: int = 0, blank_lines: bool = True) -> str:
+    """Texto de unos size_mb megabytes, en párrafos separados por líneas en blanco.
+
+    Con blank_lines=False imita el texto de un PDF: líneas cortas y ninguna línea en blanco.
+    """
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    parts, size = [], 0
+    while size < target:
+        paragraph = make_paragraphs(1, rng)[0]
+        paragraph = paragraph + "\n\n" if blank_lines else wrap_lines(paragraph) + "\n"
+        parts.append(paragraph)
+        size += len(paragraph.encode("utf-8"))
+    return "".join(parts)
+
+def make_image(width: int, height: int, seed: int, image_format: str = "png") -> bytes:
+    """Imagen RGB con un patrón de bandas, codificada como PNG o JPEG."""
+    color = bytes((seed * 37 % 256, seed * 91 % 256, seed * 53 % 256))
+    banded_row = b"\xff\xff\xff" * (width // 2) + color * (width - width // 2)
+    plain_row = color * width
+    samples = banded_row * (height // 3) + plain_row * (height - height // 3)
+    return fitz.Pixmap(fitz.csRGB, width, height, samples, False).tobytes(image_format)
+
+def make_pdf(path: str, pages: int, paragraphs_per_page: int = 4, images_per_page: float = 0.0,
+             image_size: int = 200, cover: bool = True, seed: int = 0):
+    """Crea un PDF sintético.
+
+    images_per_page es la densidad de imágenes: 0.25 pone una imagen cada cuatro páginas, 3 pone
+    tres en cada página. Con cover=True la primera página lleva una portada de 600x900.
+    """
+    rng = random.Random(seed)
+    images = [make_image(image_size, image_size, k + seed) for k in range(8)]
+    image_xrefs = {}
+    placed = 0.0
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        text = f"Página {i + 1}\n\n" + "\n\n".join(make_paragraphs(paragraphs_per_page, rng))
+        page.insert_textbox(fitz.Rect(54, 54, page.rect.width - 54, page.rect.height - 54), text, fontsize=9)
+        if cover and i == 0:
+            page.insert_image(fitz.Rect(150, 300, 450, 750), stream=make_image(600, 900, seed + 99, "jpeg"))
+        placed += images_per_page
+        for j in range(int(placed)):
+            x, y = 54 + (j % 4) * 120, 500 + (j // 4 % 2) * 120
+            k = (i + j) % len(images)
+            # Cada imagen se inserta una vez y se reutiliza por xref, como en un libro real con viñetas repetidas
+            if k in image_xrefs:
+                page.insert_image(fitz.Rect(x, y, x + 100, y + 100), xref=image_xrefs[k])
+            else:
+                image_xrefs[k] = page.insert_image(fitz.Rect(x, y, x + 100, y + 100), stream=images[k])
+        placed -= int(placed)
+    doc.save(path, garbage=1, deflate=True)
+    doc.close()
+
+BOOK_CSS = """
+body { font-family: serif; line-height: 1.5; margin: 1em; }
+h1 { font-size: 1.8em; page-break-before: always; }
+p { text-align: justify; text-indent: 1.5em; }
+img { max-width: 100%; }
+"""
+
+def make_epub(path: str, chapters: int, paragraphs_per_chapter: int = 30, images_per_chapter: float = 0.0,
+              image_size: int = 400, cover: bool = True, seed: int = 0):
+    """Crea un EPUB 3 sintético con índice, hoja de estilos, portada e imágenes.
+
+    images_per_chapter es la densidad de imágenes, como images_per_page en make_pdf.
+    """
+    rng = random.Random(seed)
+    book = epub.EpubBook()
+    book.set_identifier(f"benchmark-{seed}-{chapters}")
+    book.set_title(f"Libro sintético {seed}")
+    book.set_language("es")
+    book.add_author("Autor Sintético")
+    if cover:
+        book.set_cover("cover.jpg", make_image(600, 900, seed + 99, "jpeg"))
+    style = epub.EpubItem(uid="style", file_name="style/book.css", media_type="text/css", content=BOOK_CSS)
+    book.add_item(style)
+
+    images = []
+    for k in range(8):
+        image = epub.EpubItem(uid=f"img{k}", file_name=f"images/img{k}.png", media_type="image/png",
+                              content=make_image(image_size, image_size, k + seed))
+        book.add_item(image)
+        images.append(image)
+
+    items = []
+    placed = 0.0
+    for i in range(chapters):
+        chapter = epub.EpubHtml(title=f"Capítulo {i + 1}", file_name=f"chap_{i:04d}.xhtml", lang="es")
+        body = [f"<h1>Capítulo {i + 1}</h1>"] + [f"<p>{p}</p>" for p in make_paragraphs(paragraphs_per_chapter, rng)]
+        placed += images_per_chapter
+        for j in range(int(placed)):
+            position = rng.randint(1, len(body))
+            body.insert(position, f'<p><img src="images/img{(i + j) % len(images)}.png" alt=""/></p>')
+        placed -= int(placed)
+        chapter.content = "".join(body)
+        chapter.add_item(style)
+        book.add_item(chapter)
+        items.append(chapter)
+
+    book.toc = items
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = ["nav", *items]
+    epub.write_epub(path, book)
+
+def seed_books(engine: Engine, rows: int, seed: int = 0, batch_size: int = 5000):
+    """Crea el esquema con el índice de búsqueda y llena books con `rows` libros sintéticos."""
+    models.Base.metadata.create_all(bind=engine)
+    search_index.ensure_search_index(engine)
+    rng = random.Random(seed)
+    with engine.begin() as conn:
+        for start in range(0, rows, batch_size):
+            conn.execute(insert(models.Book), [
+                {
+                    "title": " ".join(rng.sample(TITLE_WORDS, 3)).capitalize(),
+                    "author": f"Autor {i % 500}",
+                    "category": f"Categoría {i % 40}",
+                    "language": rng.choice(LANGUAGES),
+                    "file_path": f"/biblioteca/libro_{i}.pdf",
+                    "is_read": False,
+                }
+                for i in range(start, min(rows, start + batch_size))
+            ])
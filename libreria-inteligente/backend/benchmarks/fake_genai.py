@@ -0,0 +1,114 @@
+"""Sustituto local y determinista de google.generativeai para los benchmarks.
+
+Reemplaza en el módulo genai las funciones que usa el backend (GenerativeModel, embed_content,
+embed_content_async y configure). Las respuestas dependen solo de la entrada: los embeddings se
+derivan del SHA-256 del texto y el análisis de metadatos devuelve un JSON fijo con un título
+tomado del prompt. La latencia de cada llamada (y la de cada elemento de un lote de embeddings)
+es configurable, para medir el pipeline con un modelo lento sin salir de la máquina.
+"""
+import asyncio
+import hashlib
+import json
+import struct
+import time
+
+import google.generativeai as genai
+
+EMBEDDING_DIMENSIONS = 768 # Las de text-embedding-004
+
+def fake_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> list[float]:
+    """Vector unitario determinista para el texto."""
+    values, counter = [], 0
+    while len(values) < dimensions:
+        digest = hashlib.sha256(f"{counter}\0{text}".encode("utf-8")).digest()
+        values.extend(v / 2**31 - 1.0 for v in struct.unpack("<8I", digest))
+        counter += 1
+    values = values[:dimensions]
+    norm = sum(v * v for v in values) ** 0.5 or 1.0
+    return [v / norm for v in values]
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        # Respuesta en streaming: se devuelve por palabras
+        for word in self.text.split(" "):
+            yield FakeResponse(word + " ")
+
+class FakeGenAI:
+    def __init__(self, latency: float = 0.0, per_item_latency: float = 0.0, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.dimensions = dimensions
+        self.calls: dict[str, int] = {"generate": 0, "embed": 0, "embedded_texts": 0}
+        self._originals: dict[str, object] = {}
+
+    def _delay(self, items: int = 1) -> float:
+        return self.latency + self.per_item_latency * items
+
+    def _answer(self, prompt: str) -> str:
+        if "JSON" in prompt and '"title"' in prompt:
+            # Prompt de metadatos de main.analyze_with_gemini: un título estable por texto
+            digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+            return json.dumps({"title": f"Libro {digest}", "author": "Autor Sintético",
+                               "category": "Benchmark", "language": "Español"})
+        return "Respuesta sintética del modelo para la pregunta."
+
+    def _embed(self, content) -> dict:
+        texts = [content] if isinstance(content, str) else list(content)
+        self.calls["embed"] += 1
+        self.calls["embedded_texts"] += len(texts)
+        embeddings = [fake_embedding(text, self.dimensions) for text in texts]
+        return {"embedding": embeddings[0] if isinstance(content, str) else embeddings}
+
+    def embed_content(self, model: str, content, task_type: str | None = None, **kwargs) -> dict:
+        time.sleep(self._delay(1 if isinstance(content, str) else len(content)))
+        return self._embed(content)
+
+    async def embed_content_async(self, model: str, content, task_type: str | None = None, **kwargs) -> dict:
+        await asyncio.sleep(self._delay(1 if isinstance(content, str) else len(content)))
+        return self._embed(content)
+
+    def model_class(self):
+        fake = self
+
+        class GenerativeModel:
+            def __init__(self, model_name: str, **kwargs):
+                self.model_name = model_name
+
+            def generate_content(self, prompt: str, **kwargs) -> FakeResponse:
+                time.sleep(fake.latency)
+                fake.calls["generate"] += 1
+                return FakeResponse(fake._answer(prompt))
+
+            async def generate_content_async(self, prompt: str, stream: bool = False, **kwargs) -> FakeResponse:
+                await asyncio.sleep(fake.latency)
+                fake.calls["generate"] += 1
+                return FakeResponse(fake._answer(prompt))
+
+        return GenerativeModel
+
+    def install(self) -> "FakeGenAI":
+        """Sustituye las funciones de genai en el proceso actual (y en los módulos que ya lo importaron)."""
+        replacements = {
+            "GenerativeModel": self.model_class(),
+            "embed_content": self.embed_content,
+            "embed_content_async": self.embed_content_async,
+            "configure": lambda *args, **kwargs: None,
+        }
+        for name, value in replacements.items():
+            self._originals.setdefault(name, getattr(genai, name))
+            setattr(genai, name, value)
+        return self
+
+    def uninstall(self):
+        for name, value in self._originals.items():
+            setattr(genai, name, value)
+        self._originals.clear()
+
+def install(latency: float = 0.0, per_item_latency: float = 0.0) -> FakeGenAI:
+    return FakeGenAI(latency, per_item_latency).install()
@@ -0,0 +1,321 @@
+"""Suite de benchmarks reproducible del backend, con resultados en JSON para comparar ejecuciones.
+
+Genera un corpus sintético (benchmarks.corpus) y sustituye la API de Gemini por un modelo local
+determinista con latencia configurable (benchmarks.fake_genai), así que funciona sin red:
+    process_pdf / process_epub   extracción de texto y portada de libros de distinto tamaño y densidad de imágenes
+    chunk_text                   troceado de texto para RAG, por páginas, con y sin líneas en blanco
+    process_book_for_rag         troceado, embeddings y guardado en ChromaDB (en una carpeta temporal), con el
+                                 proveedor de EMBEDDING_PROVIDER: el modelo falso para gemini o el modelo local
+    crud_search                  crud.get_books con búsqueda sobre 1k, 10k y 100k libros
+    epub_to_pdf                  processing.render_epub_to_pdf (se omite si WeasyPrint no está disponible)
+
+El tokenizador de tiktoken debe estar en su caché local (TIKTOKEN_CACHE_DIR); si no lo está,
+los benchmarks que lo usan se marcan como omitidos en lugar de intentar descargarlo.
+
+Uso (desde la carpeta backend):
+    python -m benchmarks.suite --output resultados.json
+    python -m benchmarks.suite --quick --only pdf,epub,chunk
+    python -m benchmarks.suite --output nueva.json --compare resultados.json --fail-on-regression
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark") # main.py y rag.py exigen una clave al importarse
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False") # ChromaDB no debe intentar enviar telemetría
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import embeddings
+import processing
+import rag
+import workers
+from benchmarks import corpus, fake_genai
+
+RESULTS_FORMAT_VERSION = 1
+SEARCH_TERMS = {"una palabra": "historia", "dos palabras": "sombra viento", "prefijo": "jar", "sin resultados": "zzzz"}
+
+def measure(func, repeat: int, warmup: int = 1) -> dict:
+    """Ejecuta func warmup + repeat veces y resume los tiempos de las repeticiones medidas."""
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        "runs": repeat,
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.fmean(times),
+        "max_s": max(times),
+    }
+
+class Skipped(Exception):
+    """El benchmark no se puede ejecutar en esta máquina (falta una dependencia del sistema)."""
+
+def require_tokenizer():
+    try:
+        rag.get_tokenizer()
+    except Exception as e:
+        raise Skipped(f"El tokenizador de tiktoken no está en la caché local: {e}")
+
+# --- Benchmarks ---
+def pdf_cases(quick: bool) -> dict:
+    scale = 0.2 if quick else 1
+    cases = [
+        ("texto", dict(pages=20, images_per_page=0)),
+        ("texto", dict(pages=int(300 * scale), images_per_page=0)),
+        ("ilustrado", dict(pages=int(100 * scale), images_per_page=2)),
+        ("muchas imágenes", dict(pages=int(100 * scale), images_per_page=8)),
+    ]
+    return {f"{kind}, {params['pages']} páginas": params for kind, params in cases}
+
+def epub_cases(quick: bool) -> dict:
+    scale = 0.2 if quick else 1
+    cases = [
+        ("texto", dict(chapters=10, paragraphs_per_chapter=30)),
+        ("texto", dict(chapters=int(100 * scale), paragraphs_per_chapter=30)),
+        ("ilustrado", dict(chapters=int(50 * scale), paragraphs_per_chapter=30, images_per_chapter=4)),
+    ]
+    return {f"{kind}, {params['chapters']} capítulos": params for kind, params in cases}
+
+def bench_process_pdf(args, work_dir: str) -> list[dict]:
+    covers_dir = os.path.join(work_dir, "covers")
+    os.makedirs(covers_dir, exist_ok=True)
+    results = []
+    for i, (case, params) in enumerate(pdf_cases(args.quick).items()):
+        path = os.path.join(work_dir, f"pdf_{i}.pdf")
+        corpus.make_pdf(path, seed=args.seed + i, **params)
+        timing = measure(lambda: processing.process_pdf(path, covers_dir), args.repeat)
+        results.append({"case": case, "params": params, "file_mb": os.path.getsize(path) / 2**20, **timing})
+    return results
+
+def bench_process_epub(args, work_dir: str) -> list[dict]:
+    covers_dir = os.path.join(work_dir, "covers")
+    os.makedirs(covers_dir, exist_ok=True)
+    results = []
+    for i, (case, params) in enumerate(epub_cases(args.quick).items()):
+        path = os.path.join(work_dir, f"epub_{i}.epub")
+        corpus.make_epub(path, seed=args.seed + i, **params)
+        timing = measure(lambda: processing.process_epub(path, covers_dir), args.repeat)
+        results.append({"case": case, "params": params, "file_mb": os.path.getsize(path) / 2**20, **timing})
+    return results
+
+def peak_memory_mb(func) -> float:
+    """Pico de memoria reservada por Python durante una llamada a func."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+PAGE_CHARS = 3000 # Caracteres por página al trocear un texto como si viniera de un PDF
+
+def bench_chunk_text(args, work_dir: str) -> list[dict]:
+    require_tokenizer()
+    results = []
+    for blank_lines in (True, False):
+        for size_mb in ([0.5, 2] if args.quick else [1, 5]):
+            text = corpus.make_text(size_mb, seed=args.seed, blank_lines=blank_lines)
+            # Por páginas, como llega de iter_text_from_pdf a chunk_book
+            pages = [text[i:i + PAGE_CHARS] for i in range(0, len(text), PAGE_CHARS)]
+            chunk_pages = lambda: [chunk for chunk in rag.iter_chunks(pages) if chunk.strip()]
+            chunks = chunk_pages()
+            timing = measure(chunk_pages, args.repeat)
+            kind = "párrafos" if blank_lines else "sin líneas en blanco"
+            results.append({"case": f"{kind}, {size_mb} MB",
+                            "params": {"size_mb": size_mb, "blank_lines": blank_lines, "page_chars": PAGE_CHARS,
+                                       "max_tokens": rag.CHUNK_MAX_TOKENS, "overlap_tokens": rag.CHUNK_OVERLAP_TOKENS},
+                            "chunks": len(chunks), "peak_mb": peak_memory_mb(chunk_pages),
+                            "mb_per_s": size_mb / timing["median_s"], **timing})
+    return results
+
+def bench_process_book_for_rag(args, work_dir: str) -> list[dict]:
+    require_tokenizer()
+    fake = fake_genai.install(latency=args.model_latency, per_item_latency=args.model_item_latency)
+    pages, chapters = (20, 10) if args.quick else (100, 50)
+    books = {
+        f"PDF, {pages} páginas": ("rag.pdf", lambda path: corpus.make_pdf(path, pages=pages, seed=args.seed)),
+        f"EPUB, {chapters} capítulos": ("rag.epub", lambda path: corpus.make_epub(path, chapters=chapters, seed=args.seed)),
+    }
+    results = []
+    try:
+        for case, (filename, make) in books.items():
+            path = os.path.join(work_dir, filename)
+            make(path)
+            runs = iter(range(args.repeat + 1))
+
+            def index_book():
+                # Almacén vacío y un id nuevo en cada repetición: siempre se generan los embeddings
+                chroma_dir = os.path.join(work_dir, f"chroma_{filename}_{next(runs)}")
+                rag.CHROMA_DB_PATH, rag.CHROMA_HOST, rag.client, rag.collection = chroma_dir, None, None, None
+                asyncio.run(rag.process_book_for_rag(path, os.path.basename(chroma_dir)))
+
+            calls_before = dict(fake.calls)
+            timing = measure(index_book, args.repeat)
+            runs_total = args.repeat + 1
+            results.append({
+                "case": case,
+                "params": {"embedding_model": embeddings.get_provider().key,
+                           "model_latency_s": args.model_latency, "model_item_latency_s": args.model_item_latency,
+                           "batch_size": rag.EMBEDDING_BATCH_SIZE, "max_concurrency": rag.EMBEDDING_MAX_CONCURRENCY},
+                "embed_requests": (fake.calls["embed"] - calls_before["embed"]) // runs_total,
+                "chunks": (fake.calls["embedded_texts"] - calls_before["embedded_texts"]) // runs_total,
+                **timing,
+            })
+    finally:
+        fake.uninstall()
+        rag.client = rag.collection = None
+    return results
+
+def bench_crud_search(args, work_dir: str) -> list[dict]:
+    results = []
+    for rows in ([1000, 10000] if args.quick else [1000, 10000, 100000]):
+        engine = create_engine(f"sqlite:///{os.path.join(work_dir, f'books_{rows}.db')}")
+        start = time.perf_counter()
+        corpus.seed_books(engine, rows, seed=args.seed)
+        seed_seconds = time.perf_counter() - start
+        Session = sessionmaker(bind=engine)
+        with Session() as db:
+            for case, term in SEARCH_TERMS.items():
+                matches = len(crud.get_books(db, search=term))
+                timing = measure(lambda: (crud.get_books(db, search=term), db.expunge_all()), args.repeat)
+                results.append({"case": f"{rows} libros, {case}", "params": {"rows": rows, "search": term},
+                                "matches": matches, "seed_s": seed_seconds, **timing})
+            timing = measure(lambda: crud.get_books_page(db, limit=60, search=SEARCH_TERMS["una palabra"]), args.repeat)
+            results.append({"case": f"{rows} libros, primera página de 60", "params": {"rows": rows, "search": SEARCH_TERMS["una palabra"]},
+                            "seed_s": seed_seconds, **timing})
+        engine.dispose()
+    return results
+
+def bench_epub_to_pdf(args, work_dir: str) -> list[dict]:
+    try:
+        import weasyprint # noqa: F401
+    except (ImportError, OSError) as e:
+        raise Skipped(f"WeasyPrint no está disponible: {e}")
+    chapters = 10 if args.quick else 60
+    epub_path = os.path.join(work_dir, "convert.epub")
+    corpus.make_epub(epub_path, chapters=chapters, paragraphs_per_chapter=20, seed=args.seed)
+    output_path = os.path.join(work_dir, "convert.pdf")
+    timing = measure(lambda: asyncio.run(processing.render_epub_to_pdf(epub_path, output_path)), args.repeat)
+    return [{"case": f"{chapters} capítulos", "params": {"chapters": chapters, "cpu_workers": workers.CPU_WORKERS,
+             "max_concurrent_chapters": processing.EPUB_PDF_MAX_CONCURRENT_CHAPTERS}, **timing}]
+
+BENCHMARKS = {
+    "pdf": ("process_pdf", bench_process_pdf),
+    "epub": ("process_epub", bench_process_epub),
+    "chunk": ("chunk_text", bench_chunk_text),
+    "rag": ("process_book_for_rag", bench_process_book_for_rag),
+    "search": ("crud_search", bench_crud_search),
+    "convert": ("epub_to_pdf", bench_epub_to_pdf),
+}
+
+# --- Resultados ---
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "cpu_workers": workers.CPU_WORKERS,
+    }
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Imprime la mediana de cada caso frente a la de baseline; devuelve los casos que empeoran más de threshold."""
+    regressions = []
+    print(f"\nComparación con {baseline.get('git_commit') or 'la ejecución anterior'} ({baseline.get('created')}):")
+    for bench, cases in current["results"].items():
+        previous = {case["case"]: case for case in baseline.get("results", {}).get(bench, [])}
+        for case in cases:
+            old = previous.get(case["case"])
+            if not old:
+                continue
+            change = case["median_s"] / old["median_s"] - 1 if old["median_s"] else 0.0
+            flag = ""
+            if change > threshold:
+                flag = "  <-- más lento"
+                regressions.append(f"{bench} / {case['case']}")
+            print(f"  {bench:<22} {case['case']:<40} {old['median_s'] * 1000:>10.1f} ms -> {case['median_s'] * 1000:>10.1f} ms  {change:+7.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="benchmark_results.json", help="Archivo JSON de resultados")
+    parser.add_argument("--only", help=f"Benchmarks a ejecutar, separados por comas ({', '.join(BENCHMARKS)})")
+    parser.add_argument("--quick", action="store_true", help="Corpus más pequeño y menos repeticiones")
+    parser.add_argument("--repeat", type=int, help="Repeticiones medidas por caso (5 por defecto, 2 con --quick)")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla del corpus sintético")
+    parser.add_argument("--model-latency", type=float, default=0.05, help="Latencia por llamada del modelo falso (s)")
+    parser.add_argument("--model-item-latency", type=float, default=0.001, help="Latencia añadida por texto en un lote de embeddings (s)")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Empeoramiento relativo de la mediana que cuenta como regresión")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Salir con código 1 si hay regresiones frente a --compare")
+    args = parser.parse_args()
+    if args.repeat is None:
+        args.repeat = 2 if args.quick else 5
+
+    selected = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Benchmarks desconocidos: {', '.join(sorted(unknown))}")
+
+    report = {
+        "format_version": RESULTS_FORMAT_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "environment": environment(),
+        "config": vars(args),
+        "results": {},
+        "skipped": {},
+    }
+    work_dir = tempfile.mkdtemp(prefix="libreria_bench_")
+    try:
+        for key in selected:
+            name, bench = BENCHMARKS[key]
+            print(f"{name}...", flush=True)
+            try:
+                report["results"][name] = bench(args, work_dir)
+            except Skipped as e:
+                report["skipped"][name] = str(e)
+                print(f"  omitido: {e}")
+                continue
+            for case in report["results"][name]:
+                print(f"  {case['case']:<40} mediana {case['median_s'] * 1000:>10.1f} ms  mín {case['min_s'] * 1000:>10.1f} ms")
+    finally:
+        workers.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions and args.fail_on_regression:
+            print(f"\n{len(regressions)} regresiones por encima del {args.threshold:.0%}.")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
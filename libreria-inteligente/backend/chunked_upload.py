@@ -0,0 +1,167 @@
+"""Subidas por partes reanudables.
+
+Protocolo: init (nombre y tamaño) -> append de cada parte indicando su offset -> finalize con el
+SHA-256 del archivo, que el servidor comprueba. Cada parte se escribe directamente al final de un
+fichero .part con un búfer de tamaño fijo, así que la memoria por subida no depende del tamaño del
+archivo. El offset actual es el tamaño del .part: si se corta la conexión, el cliente consulta el
+estado y continúa desde ahí, incluso tras reiniciar el servidor.
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from typing import AsyncIterator
+
+import workers
+
+UPLOADS_DIR = os.getenv("CHUNKED_UPLOAD_DIR", "uploads")
+UPLOAD_BUFFER_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("CHUNKED_UPLOAD_MAX_MB", "2048")) * 1024 * 1024
+MAX_CHUNK_BYTES = int(os.getenv("CHUNKED_UPLOAD_MAX_CHUNK_MB", "16")) * 1024 * 1024
+UPLOAD_TTL_SECONDS = int(os.getenv("CHUNKED_UPLOAD_TTL_HOURS", "24")) * 3600
+
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+class UploadNotFound(KeyError):
+    pass
+
+class OffsetMismatch(ValueError):
+    """El offset de la parte no coincide con lo ya recibido; `offset` es desde dónde hay que seguir."""
+    def __init__(self, offset: int):
+        super().__init__(f"Se esperaba el offset {offset}.")
+        self.offset = offset
+
+_locks: dict[str, asyncio.Lock] = {}
+
+def _meta_path(upload_id: str) -> str:
+    return os.path.join(UPLOADS_DIR, f"{upload_id}.json")
+
+def _part_path(upload_id: str) -> str:
+    return os.path.join(UPLOADS_DIR, f"{upload_id}.part")
+
+def _read_meta(upload_id: str) -> dict:
+    if not UPLOAD_ID_PATTERN.match(upload_id) or not os.path.exists(_meta_path(upload_id)):
+        raise UploadNotFound(upload_id)
+    with open(_meta_path(upload_id)) as f:
+        return json.load(f)
+
+def _write_meta(upload_id: str, meta: dict):
+    temp_path = f"{_meta_path(upload_id)}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(temp_path, _meta_path(upload_id))
+
+def status(upload_id: str) -> dict:
+    """Estado de una subida: nombre, tamaño declarado, bytes recibidos y hash si ya se finalizó."""
+    meta = _read_meta(upload_id)
+    offset = os.path.getsize(_part_path(upload_id)) if os.path.exists(_part_path(upload_id)) else 0
+    return {"upload_id": upload_id, "offset": offset, **meta}
+
+def remove(upload_id: str):
+    for path in (_part_path(upload_id), _meta_path(upload_id)):
+        if os.path.exists(path):
+            os.remove(path)
+    _locks.pop(upload_id, None)
+
+def remove_expired():
+    """Elimina las subidas abandonadas (sin actividad durante UPLOAD_TTL_SECONDS)."""
+    if not os.path.isdir(UPLOADS_DIR):
+        return
+    cutoff = time.time() - UPLOAD_TTL_SECONDS
+    for name in os.listdir(UPLOADS_DIR):
+        upload_id, ext = os.path.splitext(name)
+        if ext == ".json" and os.path.getmtime(os.path.join(UPLOADS_DIR, name)) < cutoff:
+            part = _part_path(upload_id)
+            if not os.path.exists(part) or os.path.getmtime(part) < cutoff:
+                remove(upload_id)
+
+def init(filename: str, size: int) -> dict:
+    """Registra una subida nueva y devuelve su estado inicial."""
+    if size < 0 or size > MAX_UPLOAD_BYTES:
+        raise ValueError(f"El tamaño debe estar entre 0 y {MAX_UPLOAD_BYTES} bytes.")
+    remove_expired()
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    _write_meta(upload_id, {"filename": os.path.basename(filename), "size": size, "sha256": None})
+    open(_part_path(upload_id), "wb").close()
+    return status(upload_id)
+
+async def append(upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> dict:
+    """Añade una parte que empieza en `offset`, leyendo `chunks` y escribiendo con un búfer fijo.
+
+    Si la conexión se corta a mitad de la parte, lo ya escrito cuenta: el cliente retoma desde status().
+    """
+    lock = _locks.setdefault(upload_id, asyncio.Lock())
+    async with lock:
+        current = status(upload_id)
+        if current["sha256"]:
+            raise ValueError("La subida ya está finalizada.")
+        if offset != current["offset"]:
+            raise OffsetMismatch(current["offset"])
+
+        received = 0
+        buffer = bytearray()
+        with open(_part_path(upload_id), "ab") as part:
+            async def flush():
+                await workers.run_io_bound(part.write, bytes(buffer))
+                buffer.clear()
+            try:
+                async for data in chunks:
+                    received += len(data)
+                    if received > MAX_CHUNK_BYTES or offset + received > current["size"]:
+                        raise ValueError("La parte supera el tamaño máximo o el tamaño declarado del archivo.")
+                    buffer += data
+                    if len(buffer) >= UPLOAD_BUFFER_SIZE:
+                        await flush()
+            finally:
+                if buffer:
+                    await flush()
+                part.flush()
+        return status(upload_id)
+
+def copy_with_hash(source, dest_path: str | None = None) -> str:
+    """Lee un fichero abierto en binario por bloques y devuelve su SHA-256; con dest_path, además lo copia allí."""
+    sha256 = hashlib.sha256()
+    with open(dest_path, "wb") if dest_path else contextlib.nullcontext() as dest:
+        while chunk := source.read(UPLOAD_BUFFER_SIZE):
+            sha256.update(chunk)
+            if dest:
+                dest.write(chunk)
+    return sha256.hexdigest()
+
+def hash_file(path: str) -> str:
+    """Calcula el SHA-256 de un fichero leyéndolo por bloques."""
+    with open(path, "rb") as f:
+        return copy_with_hash(f)
+
+async def finalize(upload_id: str, sha256: str | None = None) -> dict:
+    """Comprueba que el archivo está completo y calcula su SHA-256.
+
+    Si el cliente envía su checksum y no coincide, la subida se descarta.
+    """
+    lock = _locks.setdefault(upload_id, asyncio.Lock())
+    async with lock:
+        current = status(upload_id)
+        if current["sha256"]:
+            return current
+        if current["offset"] != current["size"]:
+            raise OffsetMismatch(current["offset"])
+        actual = await workers.run_io_bound(hash_file, _part_path(upload_id))
+        if sha256 and actual != sha256.lower():
+            remove(upload_id)
+            raise ValueError("El checksum no coincide: el archivo se ha descartado y hay que subirlo de nuevo.")
+        _write_meta(upload_id, {"filename": current["filename"], "size": current["size"], "sha256": actual})
+        return status(upload_id)
+
+def consume(upload_id: str, dest_path: str) -> tuple[str, str]:
+    """Mueve una subida finalizada a dest_path y devuelve (nombre original, sha256)."""
+    meta = _read_meta(upload_id)
+    if not meta["sha256"]:
+        raise ValueError("La subida no está finalizada.")
+    os.replace(_part_path(upload_id), dest_path)
+    remove(upload_id)
+    return meta["filename"], meta["sha256"]
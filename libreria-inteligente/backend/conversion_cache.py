@@ -0,0 +1,108 @@
+"""Caché de conversiones EPUB -> PDF direccionada por contenido, y ciclo de vida de temp_books/.
+
+El PDF de una conversión se guarda como {clave}.pdf, donde la clave es el hash del EPUB y de los
+ajustes del conversor: volver a convertir el mismo libro devuelve el PDF existente al instante.
+La carpeta se limita por antigüedad (TTL) y por tamaño total, expulsando primero lo usado hace más tiempo.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable
+
+class ConversionCache:
+    def __init__(self, directory: str, settings: str, max_bytes: int, ttl_seconds: float, min_age_seconds: float = 600):
+        """`settings` identifica la versión y configuración del conversor: si cambia, las claves cambian.
+
+        Los archivos modificados hace menos de `min_age_seconds` no se expulsan por tamaño
+        (son subidas o conversiones en curso).
+        """
+        self.directory = directory
+        self.settings = settings
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.min_age_seconds = min_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._pending: dict[str, asyncio.Task] = {}
+        self._evict_lock = threading.Lock()
+
+    def key(self, epub_hash: str) -> str:
+        return hashlib.sha256(f"{epub_hash}\0{self.settings}".encode("utf-8")).hexdigest()[:32]
+
+    def pdf_filename(self, key: str) -> str:
+        return f"{key}.pdf"
+
+    async def get_or_convert(self, epub_hash: str, convert: Callable[[str], Awaitable[None]]) -> tuple[str, bool]:
+        """Devuelve (nombre del PDF en el directorio, si venía de la caché).
+
+        `convert(output_path)` genera el PDF; solo se llama si no existe ya. Dos peticiones
+        simultáneas del mismo libro comparten una única conversión.
+        """
+        key = self.key(epub_hash)
+        filename = self.pdf_filename(key)
+        path = os.path.join(self.directory, filename)
+        if os.path.exists(path):
+            self.hits += 1
+            os.utime(path) # Marca el uso para la expulsión por antigüedad
+            return filename, True
+        if key in self._pending:
+            self.hits += 1
+            await asyncio.shield(self._pending[key])
+            return filename, True
+
+        self.misses += 1
+        # La conversión sigue aunque el cliente que la pidió se desconecte: otros pueden estar esperándola
+        task = asyncio.ensure_future(self._convert(path, convert))
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+        await asyncio.shield(task)
+        return filename, False
+
+    async def _convert(self, path: str, convert: Callable[[str], Awaitable[None]]):
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            await convert(temp_path)
+            os.replace(temp_path, path) # Nunca se sirve un PDF a medio escribir
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def evict(self) -> int:
+        """Aplica el TTL y el límite de tamaño a todo el directorio; devuelve los archivos borrados."""
+        with self._evict_lock:
+            now = time.time()
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            entries.sort() # Más antiguos primero
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for mtime, size, path in entries:
+                expired = now - mtime > self.ttl_seconds
+                over_budget = total > self.max_bytes and now - mtime > self.min_age_seconds
+                if not (expired or over_budget):
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self.evictions += removed
+            return removed
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "in_progress": len(self._pending),
+        }
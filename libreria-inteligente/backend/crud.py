@@ -1,13 +1,31 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, or_
+from sqlalchemy import and_, delete, desc, false, func, or_, update
+from collections import Counter
+import hashlib
+import threading
 import models
 import schemas # Added for BookUpdate schema
+import search_index
+import thumbnails
 import os
 
 def get_book_by_path(db: Session, file_path: str):
     """Obtiene un libro por su ruta de archivo."""
     return db.query(models.Book).filter(models.Book.file_path == file_path).first()
 
+def get_book_by_hash(db: Session, file_hash: str):
+    """Obtiene un libro por el hash SHA-256 de su contenido."""
+    return db.query(models.Book).filter(models.Book.file_hash == file_hash).first()
+
+def get_books_without_hash(db: Session):
+    """Libros añadidos antes de que se guardara el hash de su contenido."""
+    return db.query(models.Book).filter(models.Book.file_hash.is_(None)).all()
+
+def set_file_hash(db: Session, book_id: int, file_hash: str):
+    """Guarda el hash SHA-256 del contenido de un libro."""
+    db.query(models.Book).filter(models.Book.id == book_id).update({models.Book.file_hash: file_hash})
+    db.commit()
+
 def get_book(db: Session, book_id: int):
     """Obtiene un libro por su ID."""
     return db.query(models.Book).filter(models.Book.id == book_id).first()
@@ -17,35 +35,151 @@ def get_book_by_title(db: Session, title: str):
     return db.query(models.Book).filter(models.Book.title == title).first()
 
 def get_books_by_partial_title(db: Session, title: str, skip: int = 0, limit: int = 100):
-    """Busca libros por un título parcial (case-insensitive)."""
-    return db.query(models.Book).filter(models.Book.title.ilike(f"%{title}%")).offset(skip).limit(limit).all()
+    """Busca libros por palabras del título (sin distinguir mayúsculas ni acentos), los más relevantes primero."""
+    expression = search_index.match_expression(title, columns=("title",))
+    if not expression:
+        return []
+    ranked = search_index.ranked_matches(expression)
+    return (
+        db.query(models.Book)
+        .join(ranked, ranked.c.book_id == models.Book.id)
+        .order_by(ranked.c.rank, desc(models.Book.id))
+        .offset(skip).limit(limit).all()
+    )
 
-def get_books(db: Session, category: str | None = None, search: str | None = None, author: str | None = None, language: str | None = None):
-    """Obtiene una lista de libros, con opciones de filtrado por categoría, búsqueda general, autor e idioma."""
-    query = db.query(models.Book)
+# Campos que admite la proyección de GET /books/ (cover_thumbnails se deriva de cover_hash)
+BOOK_FIELDS = ("id", "title", "author", "category", "language", "cover_image_url", "file_path",
+               "description", "rating", "is_read", "cover_thumbnails")
+
+def _filtered_books_query(db: Session, columns: list, category: str | None, search: str | None, author: str | None, language: str | None):
+    """Consulta de libros con los filtros aplicados; devuelve también la subconsulta de relevancia si hay búsqueda."""
+    query = db.query(*columns)
     if category:
         query = query.filter(models.Book.category == category)
     if author:
         query = query.filter(models.Book.author.ilike(f"%{author}%"))
     if language:
         query = query.filter(models.Book.language == language)
+    ranked = None
     if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            or_(
-                models.Book.title.ilike(search_term),
-                models.Book.author.ilike(search_term),
-                models.Book.category.ilike(search_term),
-                models.Book.language.ilike(search_term)
-            )
-        )
+        # Búsqueda en el índice FTS5 (título, autor, categoría, idioma, descripción y, si se indexa, el texto)
+        expression = search_index.match_expression(search)
+        if not expression:
+            query = query.filter(false())
+        else:
+            ranked = search_index.ranked_matches(expression)
+            query = query.join(ranked, ranked.c.book_id == models.Book.id)
+    return query, ranked
+
+def get_books(db: Session, category: str | None = None, search: str | None = None, author: str | None = None, language: str | None = None):
+    """Obtiene una lista de libros, con opciones de filtrado por categoría, búsqueda general, autor e idioma."""
+    query, ranked = _filtered_books_query(db, [models.Book], category, search, author, language)
+    if ranked is not None:
+        return query.order_by(ranked.c.rank, desc(models.Book.id)).all()
     return query.order_by(desc(models.Book.id)).all()
 
+def get_books_page(db: Session, limit: int, cursor: str | None = None, fields: list[str] | None = None,
+                   category: str | None = None, search: str | None = None, author: str | None = None, language: str | None = None):
+    """Una página de libros con paginación por cursor (keyset), para que el coste no dependa de la página.
+
+    Sin búsqueda se ordena por id descendente y el cursor es el último id devuelto; con búsqueda
+    se ordena por relevancia y el cursor es "rank:id". Con `fields` solo se leen esas columnas.
+    Devuelve (filas, cursor_siguiente); el cursor es None en la última página.
+    Lanza ValueError si el cursor o algún campo no son válidos.
+    """
+    if fields:
+        unknown = set(fields) - set(BOOK_FIELDS)
+        if unknown:
+            raise ValueError(f"Campos no válidos: {', '.join(sorted(unknown))}")
+        names = ["id"] + [f for f in dict.fromkeys(fields) if f != "id"]
+        columns = [models.Book.cover_hash if f == "cover_thumbnails" else getattr(models.Book, f) for f in names]
+    else:
+        columns = [models.Book]
+    query, ranked = _filtered_books_query(db, columns, category, search, author, language)
+
+    if ranked is not None:
+        query = query.add_columns(ranked.c.rank)
+        if cursor:
+            try:
+                rank, last_id = cursor.split(":")
+                rank, last_id = float(rank), int(last_id)
+            except ValueError:
+                raise ValueError("cursor no válido")
+            query = query.filter(or_(ranked.c.rank > rank, and_(ranked.c.rank == rank, models.Book.id < last_id)))
+        query = query.order_by(ranked.c.rank, desc(models.Book.id))
+    else:
+        if cursor:
+            if not cursor.isdigit():
+                raise ValueError("cursor no válido")
+            query = query.filter(models.Book.id < int(cursor))
+        query = query.order_by(desc(models.Book.id))
+
+    rows = query.limit(limit + 1).all() # Una fila de más indica si hay otra página
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    full_ranked = ranked is not None and not fields # Filas (Book, rank)
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        last_id = last[0].id if full_ranked else last.id
+        next_cursor = f"{last.rank!r}:{last_id}" if ranked is not None else str(last_id)
+    if full_ranked:
+        rows = [row[0] for row in rows]
+    return rows, next_cursor
+
+def count_books(db: Session, category: str | None = None, search: str | None = None, author: str | None = None, language: str | None = None) -> int:
+    """Cuenta los libros que cumplen los mismos filtros que get_books."""
+    query, _ = _filtered_books_query(db, [models.Book.id], category, search, author, language)
+    return query.count()
+
+# --- Facetas (categorías, idiomas y total) ---
+# Se calculan con una sola consulta agregada y se guardan en memoria hasta que una función
+# de escritura de este módulo (o la importación masiva) llama a invalidate_facets().
+_facets_lock = threading.Lock()
+_facets_cache: tuple[schemas.Facets, str] | None = None
+_facets_version = 0
+
+def invalidate_facets():
+    """Descarta las facetas en caché; se llama tras cualquier escritura en books."""
+    global _facets_cache, _facets_version
+    with _facets_lock:
+        _facets_cache = None
+        _facets_version += 1
+
+def get_facets(db: Session) -> tuple[schemas.Facets, str]:
+    """Devuelve las facetas de la biblioteca y su ETag (hash del contenido)."""
+    global _facets_cache
+    with _facets_lock:
+        if _facets_cache is not None:
+            return _facets_cache
+        version = _facets_version
+
+    categories, languages, total = Counter(), Counter(), 0
+    rows = db.query(models.Book.category, models.Book.language, func.count()).group_by(models.Book.category, models.Book.language).all()
+    for category, language, count in rows:
+        total += count
+        if category:
+            categories[category] += count
+        if language:
+            languages[language] += count
+    facets = schemas.Facets(
+        total=total,
+        categories=[schemas.FacetValue(value=v, count=c) for v, c in sorted(categories.items())],
+        languages=[schemas.FacetValue(value=v, count=c) for v, c in sorted(languages.items())],
+    )
+    etag = f'"{hashlib.sha256(facets.model_dump_json().encode()).hexdigest()[:32]}"'
+
+    with _facets_lock:
+        # Si hubo una escritura mientras se consultaba, el resultado puede estar desfasado: no se guarda
+        if version == _facets_version:
+            _facets_cache = (facets, etag)
+    return facets, etag
+
 def get_categories(db: Session) -> list[str]:
     """Obtiene una lista de todas las categorías de libros únicas."""
-    return [c[0] for c in db.query(models.Book.category).distinct().order_by(models.Book.category).all()]
+    return [f.value for f in get_facets(db)[0].categories]
 
-def create_book(db: Session, title: str, author: str, category: str, language: str, cover_image_url: str, file_path: str, description: str | None = None, rating: float | None = None, is_read: bool = False):
+def create_book(db: Session, title: str, author: str, category: str, language: str, cover_image_url: str, file_path: str, description: str | None = None, rating: float | None = None, is_read: bool = False, file_hash: str | None = None, cover_hash: str | None = None):
     """Crea un nuevo libro en la base de datos."""
     db_book = models.Book(
         title=title,
@@ -56,10 +190,13 @@ def create_book(db: Session, title: str, author: str, category: str, language: s
         file_path=file_path,
         description=description,
         rating=rating,
-        is_read=is_read
+        is_read=is_read,
+        file_hash=file_hash,
+        cover_hash=cover_hash
     )
     db.add(db_book)
     db.commit()
+    invalidate_facets()
     db.refresh(db_book)
     return db_book
 
@@ -71,9 +208,80 @@ def update_book(db: Session, book_id: int, book_update: schemas.BookUpdate):
             setattr(db_book, key, value)
         db.add(db_book)
         db.commit()
+        invalidate_facets()
         db.refresh(db_book)
     return db_book
 
+def set_cover_hash(db: Session, book_id: int, cover_hash: str):
+    """Guarda el hash de la portada de un libro tras generar sus miniaturas."""
+    db.query(models.Book).filter(models.Book.id == book_id).update({models.Book.cover_hash: cover_hash})
+    db.commit()
+
+def remove_unused_thumbnails(db: Session, cover_hashes: set[str]):
+    """Elimina las miniaturas que ya no usa ningún libro (varios libros pueden compartir portada)."""
+    if not cover_hashes:
+        return
+    in_use = {h for (h,) in db.query(models.Book.cover_hash).filter(models.Book.cover_hash.in_(cover_hashes)).distinct()}
+    for cover_hash in cover_hashes - in_use:
+        thumbnails.remove_thumbnails(cover_hash)
+
+def remove_files(paths: list[str]):
+    """Elimina del disco los archivos indicados que existan."""
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+def remove_deleted_book_files(db: Session, deleted: list):
+    """Elimina archivos, portadas y miniaturas de libros ya borrados con delete_books."""
+    remove_files([path for book in deleted for path in (book.file_path, book.cover_image_url)])
+    remove_unused_thumbnails(db, {book.cover_hash for book in deleted if book.cover_hash})
+
+def _bulk_conditions(ids: list[int] | None, category: str | None, author: str | None, language: str | None) -> list:
+    """Condiciones WHERE de una operación en bloque; lanza ValueError si no hay ninguna."""
+    conditions = []
+    if ids is not None:
+        conditions.append(models.Book.id.in_(ids))
+    if category is not None:
+        conditions.append(models.Book.category == category)
+    if author is not None:
+        conditions.append(models.Book.author == author)
+    if language is not None:
+        conditions.append(models.Book.language == language)
+    if not conditions:
+        raise ValueError("Hay que indicar ids o al menos un filtro.")
+    return conditions
+
+def delete_books(db: Session, ids: list[int] | None = None, category: str | None = None, author: str | None = None, language: str | None = None) -> list:
+    """Borra en una sola sentencia DELETE los libros que cumplen todos los criterios.
+
+    No toca el disco: devuelve las filas borradas (file_path, cover_image_url, cover_hash)
+    para que el llamante elimine los archivos con remove_deleted_book_files, fuera de la transacción.
+    """
+    statement = (
+        delete(models.Book)
+        .where(*_bulk_conditions(ids, category, author, language))
+        .returning(models.Book.file_path, models.Book.cover_image_url, models.Book.cover_hash)
+    )
+    deleted = db.execute(statement).all()
+    db.commit()
+    if deleted:
+        invalidate_facets()
+    return deleted
+
+def update_books(db: Session, changes: schemas.BookUpdate, ids: list[int] | None = None, category: str | None = None, author: str | None = None, language: str | None = None) -> int:
+    """Aplica los mismos cambios a todos los libros que cumplen los criterios con una sola sentencia UPDATE."""
+    values = changes.model_dump(exclude_unset=True)
+    if not values:
+        raise ValueError("No hay ningún campo que actualizar.")
+    result = db.execute(
+        update(models.Book).where(*_bulk_conditions(ids, category, author, language)).values(**values),
+        execution_options={"synchronize_session": False},
+    )
+    db.commit()
+    if result.rowcount:
+        invalidate_facets()
+    return result.rowcount
+
 def delete_book(db: Session, book_id: int):
     """Elimina un libro de la base de datos por su ID, incluyendo sus archivos asociados."""
     book = db.query(models.Book).filter(models.Book.id == book_id).first()
@@ -84,32 +292,24 @@ def delete_book(db: Session, book_id: int):
         if book.cover_image_url and os.path.exists(book.cover_image_url):
             os.remove(book.cover_image_url)
         
+        cover_hash = book.cover_hash
         db.delete(book)
         db.commit()
+        invalidate_facets()
+        if cover_hash:
+            remove_unused_thumbnails(db, {cover_hash})
     return book
 
 def delete_books_by_category(db: Session, category: str):
     """Elimina todos los libros de una categoría específica, incluyendo sus archivos asociados."""
-    books_to_delete = db.query(models.Book).filter(models.Book.category == category).all()
-    if not books_to_delete:
-        return 0
-    
-    for book in books_to_delete:
-        # Eliminar archivos asociados
-        if book.file_path and os.path.exists(book.file_path):
-            os.remove(book.file_path)
-        if book.cover_image_url and os.path.exists(book.cover_image_url):
-            os.remove(book.cover_image_url)
-        db.delete(book)
-        
-    count = len(books_to_delete)
-    db.commit()
-    return count
+    deleted = delete_books(db, category=category)
+    remove_deleted_book_files(db, deleted)
+    return len(deleted)
 
 def get_books_count(db: Session) -> int:
     """Obtiene el número total de libros en la base de datos."""
-    return db.query(models.Book).count()
+    return get_facets(db)[0].total
 
 def get_languages(db: Session) -> list[str]:
     """Obtiene una lista de todos los idiomas de libros únicos."""
-    return [l[0] for l in db.query(models.Book.language).distinct().order_by(models.Book.language).all() if l[0]]
\ No newline at end of file
+    return [f.value for f in get_facets(db)[0].languages]
\ No newline at end of file
@@ -1,13 +1,55 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 # Usamos una base de datos SQLite que se guardará en la raíz del proyecto
 SQLALCHEMY_DATABASE_URL = "sqlite:///../library.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///../library.db"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# Tiempo que una conexión espera a que se libere un bloqueo de escritura antes de fallar con "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+def configure_sqlite_connection(dbapi_connection, read_only: bool = False):
+    """PRAGMAs de cada conexión nueva.
+
+    En modo WAL los lectores no se bloquean mientras hay una escritura en curso (y viceversa);
+    synchronous=NORMAL es seguro con WAL y evita un fsync por commit.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+def make_engine(url: str, read_only: bool = False) -> Engine:
+    """Motor síncrono de SQLite con WAL y busy_timeout configurados al conectar."""
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", lambda conn, _: configure_sqlite_connection(conn, read_only))
+    return engine
+
+def make_async_engine(url: str, read_only: bool = False) -> AsyncEngine:
+    """Motor asíncrono (aiosqlite) con la misma configuración de conexión."""
+    engine = create_async_engine(url)
+    event.listen(engine.sync_engine, "connect", lambda conn, _: configure_sqlite_connection(conn, read_only))
+    return engine
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Sesiones de solo lectura para las rutas GET: conexiones propias con query_only,
+# que en WAL leen la última versión confirmada sin esperar a las escrituras
+read_engine = make_engine(SQLALCHEMY_DATABASE_URL, read_only=True)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Opción asíncrona: no ocupa un hilo del threadpool por petición mientras espera a la base de datos
+async_engine = make_async_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+async_read_engine = make_async_engine(ASYNC_DATABASE_URL, read_only=True)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
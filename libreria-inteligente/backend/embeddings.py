@@ -0,0 +1,164 @@
+"""Embedding providers for RAG, selected with EMBEDDING_PROVIDER.
+
+- gemini: text-embedding-004 (or EMBEDDING_MODEL) through the Gemini API, one request per batch.
+- local: a sentence-transformers model exported to ONNX (all-MiniLM-L6-v2 by default), run
+  in-process on the CPU with onnxruntime. No network round-trip or API quota, and it works offline
+  once the model files are on disk.
+
+Every provider has a key, "provider:model". rag stores it with each vector, because vectors from
+different models are not comparable even when they have the same dimension.
+"""
+import os
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+import google.generativeai as genai
+import numpy as np
+
+import metrics, workers
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "gemini").lower()
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL") # Defaults to the provider's DEFAULT_MODEL
+# Folder with model.onnx and tokenizer.json; the default model is downloaded by ChromaDB if it is not set
+LOCAL_MODEL_DIR = os.getenv("EMBEDDING_LOCAL_MODEL_DIR")
+# Token windows per onnxruntime call
+LOCAL_BATCH_SIZE = int(os.getenv("EMBEDDING_LOCAL_BATCH_SIZE", "32"))
+LOCAL_THREADS = int(os.getenv("EMBEDDING_LOCAL_THREADS", "0")) # 0 = let onnxruntime decide
+# Longer texts are split into overlapping windows of this many tokens and their embeddings averaged
+LOCAL_MAX_TOKENS = 256
+LOCAL_WINDOW_STRIDE = 32
+
+class EmbeddingProvider:
+    name = ""
+    DEFAULT_MODEL = ""
+
+    def __init__(self, model: str | None = None):
+        self.model = model or self.DEFAULT_MODEL
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}:{self.model}"
+
+    async def embed(self, texts: list[str], task_type: str = "RETRIEVAL_DOCUMENT") -> list[list[float]]:
+        """Returns one embedding per text. task_type is RETRIEVAL_DOCUMENT or RETRIEVAL_QUERY."""
+        raise NotImplementedError
+
+class GeminiEmbeddings(EmbeddingProvider):
+    name = "gemini"
+    DEFAULT_MODEL = "models/text-embedding-004"
+
+    async def embed(self, texts: list[str], task_type: str = "RETRIEVAL_DOCUMENT") -> list[list[float]]:
+        with metrics.model_call(self.model, "embed"):
+            result = await genai.embed_content_async(model=self.model, content=texts, task_type=task_type)
+        return result["embedding"]
+
+class LocalEmbeddings(EmbeddingProvider):
+    name = "local"
+    DEFAULT_MODEL = "all-MiniLM-L6-v2"
+
+    def __init__(self, model: str | None = None, model_dir: str | None = None, batch_size: int = LOCAL_BATCH_SIZE):
+        super().__init__(model)
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self._tokenizer = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _resolve_model_dir(self) -> Path:
+        if self.model_dir:
+            return Path(self.model_dir)
+        if self.model != self.DEFAULT_MODEL:
+            raise ValueError(f"EMBEDDING_LOCAL_MODEL_DIR must point to the ONNX export of {self.model}.")
+        # ChromaDB ships a download of the default model (the same one its own embedding function uses)
+        from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+        model_dir = ONNXMiniLM_L6_V2.DOWNLOAD_PATH / ONNXMiniLM_L6_V2.EXTRACTED_FOLDER_NAME
+        if not (model_dir / "model.onnx").exists():
+            ONNXMiniLM_L6_V2()(["download"])
+        return model_dir
+
+    def load(self):
+        """Loads the tokenizer and the ONNX session on first use; returns both."""
+        with self._lock:
+            if self._session is None:
+                import onnxruntime
+                from tokenizers import Tokenizer
+
+                model_dir = self._resolve_model_dir()
+                tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+                tokenizer.enable_truncation(max_length=LOCAL_MAX_TOKENS, stride=LOCAL_WINDOW_STRIDE)
+                tokenizer.no_padding() # Batches are padded to their own longest window below
+                options = onnxruntime.SessionOptions()
+                options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                if LOCAL_THREADS:
+                    options.intra_op_num_threads = LOCAL_THREADS
+                self._session = onnxruntime.InferenceSession(str(model_dir / "model.onnx"), sess_options=options,
+                                                             providers=["CPUExecutionProvider"])
+                self._tokenizer = tokenizer
+            return self._tokenizer, self._session
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Embeds a batch of texts; returns an array of L2-normalised rows, one per text.
+
+        Texts longer than LOCAL_MAX_TOKENS become several overlapping windows. All windows are
+        sorted by length and run in batches padded to their longest member, and each text's
+        embedding is the mean of its token embeddings over all its windows (mean pooling, as
+        sentence-transformers does for a single window).
+        """
+        tokenizer, session = self.load()
+        windows, owners = [], []
+        for i, encoding in enumerate(tokenizer.encode_batch(texts)):
+            for window in (encoding, *encoding.overflowing):
+                windows.append(window.ids)
+                owners.append(i)
+        owners = np.asarray(owners)
+        lengths = np.fromiter((len(ids) for ids in windows), dtype=np.int64, count=len(windows))
+        order = np.argsort(lengths, kind="stable")
+        input_names = {model_input.name for model_input in session.get_inputs()}
+
+        sums, token_counts = None, np.zeros(len(texts), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            width = int(lengths[batch].max())
+            input_ids = np.zeros((len(batch), width), dtype=np.int64)
+            for row, window in enumerate(batch):
+                input_ids[row, :lengths[window]] = windows[window]
+            attention_mask = (np.arange(width) < lengths[batch][:, None]).astype(np.int64)
+            inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in input_names:
+                inputs["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = session.run(None, inputs)[0] # (windows, tokens, dimensions)
+            window_sums = np.einsum("wtd,wt->wd", hidden, attention_mask.astype(hidden.dtype))
+            if sums is None:
+                sums = np.zeros((len(texts), hidden.shape[-1]), dtype=np.float32)
+            np.add.at(sums, owners[batch], window_sums)
+            np.add.at(token_counts, owners[batch], attention_mask.sum(axis=1))
+
+        embeddings = sums / np.maximum(token_counts, 1)[:, None]
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1, norms)
+
+    async def embed(self, texts: list[str], task_type: str = "RETRIEVAL_DOCUMENT") -> list[list[float]]:
+        # onnxruntime releases the GIL, so the thread pool keeps the event loop free
+        with metrics.model_call(self.model, "embed"):
+            embeddings = await workers.run_io_bound(self.encode, texts)
+        return embeddings.tolist()
+
+PROVIDERS: dict[str, type[EmbeddingProvider]] = {
+    "gemini": GeminiEmbeddings,
+    "local": LocalEmbeddings,
+}
+
+def create_provider(name: str, model: str | None = None) -> EmbeddingProvider:
+    try:
+        provider_class = PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown EMBEDDING_PROVIDER '{name}'. Available: {', '.join(PROVIDERS)}.")
+    if provider_class is LocalEmbeddings:
+        return LocalEmbeddings(model, model_dir=LOCAL_MODEL_DIR)
+    return provider_class(model)
+
+@lru_cache(maxsize=1)
+def get_provider() -> EmbeddingProvider:
+    """The provider configured in the environment, shared by the whole process."""
+    return create_provider(EMBEDDING_PROVIDER, EMBEDDING_MODEL)
@@ -0,0 +1,271 @@
+"""Lectura de EPUBs por capítulos, directamente desde el zip y sin extraerlo a disco.
+
+El manifiesto (.opf), el orden de lectura (spine) y el índice (nav de EPUB 3 o NCX de EPUB 2)
+se analizan una vez por libro y se guardan en un LRU en memoria, invalidado si cambia la fecha
+de modificación del archivo. Cada capítulo se sirve como HTML saneado (sin scripts, formularios
+ni manejadores de eventos) con los enlaces reescritos a las rutas de capítulos y recursos de la API.
+"""
+import os
+import posixpath
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Iterator
+from urllib.parse import quote, unquote, urlsplit
+
+from bs4 import BeautifulSoup
+
+MANIFEST_CACHE_SIZE = int(os.getenv("EPUB_MANIFEST_CACHE_SIZE", "64"))
+ASSET_CHUNK_SIZE = 64 * 1024
+HTML_MEDIA_TYPES = {"application/xhtml+xml", "text/html"}
+
+# Se eliminan con su contenido; el resto del marcado se conserva
+UNSAFE_TAGS = ["script", "iframe", "frame", "frameset", "object", "embed", "applet", "form", "base", "noscript"]
+URL_ATTRIBUTES = ["href", "src", "xlink:href", "poster"]
+# Solo los enlaces pueden apuntar fuera del libro; imágenes, fuentes y hojas de estilo remotas se quitan
+LINK_TAGS = ["a", "area"]
+# url('...'), url("...") o url(...): las formas entre comillas terminan en la comilla, aunque contengan ")"
+CSS_URL_PATTERN = re.compile(r"""url\(\s*(?:'([^']*)'|"([^"]*)"|([^'")\s]+))\s*\)""")
+
+def _resolve(base_dir: str, href: str) -> str:
+    """Ruta dentro del zip de un href relativo (sin fragmento) a un documento en base_dir."""
+    return posixpath.normpath(posixpath.join(base_dir, unquote(urlsplit(href).path)))
+
+def _read_opf_path(zf: zipfile.ZipFile) -> str:
+    try:
+        container = BeautifulSoup(zf.read("META-INF/container.xml"), "lxml-xml")
+        rootfile = container.find("rootfile")
+        if rootfile and rootfile.get("full-path"):
+            return rootfile["full-path"]
+    except KeyError:
+        pass
+    opf_path = next((name for name in zf.namelist() if name.endswith(".opf")), None)
+    if not opf_path:
+        raise ValueError("No se pudo encontrar el archivo .opf en el EPUB.")
+    return opf_path
+
+def _nav_toc(zf: zipfile.ZipFile, nav_path: str) -> list[tuple[str, str, int]]:
+    """Entradas (título, ruta con fragmento, nivel) del documento nav de EPUB 3."""
+    soup = BeautifulSoup(zf.read(nav_path), "lxml-xml")
+    nav = next((n for n in soup.find_all("nav") if "toc" in (n.get("epub:type") or n.get("type") or "")), None) or soup.find("nav")
+    if not nav:
+        return []
+    base_dir = posixpath.dirname(nav_path)
+    entries = []
+    def walk(ol, level: int):
+        for li in ol.find_all("li", recursive=False):
+            link = li.find(["a", "span"], recursive=False)
+            if link is not None and link.get("href"):
+                entries.append((link.get_text(" ", strip=True), _resolve(base_dir, link["href"]) + _fragment(link["href"]), level))
+            child = li.find("ol", recursive=False)
+            if child:
+                walk(child, level + 1)
+    top = nav.find("ol")
+    if top:
+        walk(top, 0)
+    return entries
+
+def _ncx_toc(zf: zipfile.ZipFile, ncx_path: str) -> list[tuple[str, str, int]]:
+    """Entradas (título, ruta con fragmento, nivel) del NCX de EPUB 2."""
+    soup = BeautifulSoup(zf.read(ncx_path), "lxml-xml")
+    base_dir = posixpath.dirname(ncx_path)
+    entries = []
+    def walk(parent, level: int):
+        for point in parent.find_all("navPoint", recursive=False):
+            label, content = point.find("navLabel"), point.find("content")
+            if content is not None and content.get("src"):
+                title = label.get_text(" ", strip=True) if label else ""
+                entries.append((title, _resolve(base_dir, content["src"]) + _fragment(content["src"]), level))
+            walk(point, level + 1)
+    nav_map = soup.find("navMap")
+    if nav_map:
+        walk(nav_map, 0)
+    return entries
+
+def _fragment(href: str) -> str:
+    fragment = urlsplit(href).fragment
+    return f"#{fragment}" if fragment else ""
+
+def parse_manifest(epub_path: str) -> dict:
+    """Analiza el .opf del EPUB: recursos del manifiesto, spine e índice."""
+    with zipfile.ZipFile(epub_path) as zf:
+        opf_path = _read_opf_path(zf)
+        opf = BeautifulSoup(zf.read(opf_path), "lxml-xml")
+        opf_dir = posixpath.dirname(opf_path)
+        names = set(zf.namelist())
+
+        items, ids, nav_path = {}, {}, None
+        for item in opf.find_all("item"):
+            if not item.get("href") or not item.get("id"):
+                continue
+            path = _resolve(opf_dir, item["href"])
+            if path not in names:
+                continue
+            items[path] = item.get("media-type", "application/octet-stream")
+            ids[item["id"]] = path
+            if "nav" in (item.get("properties") or "").split():
+                nav_path = path
+
+        spine_tag = opf.find("spine")
+        spine = [ids[ref["idref"]] for ref in (spine_tag.find_all("itemref") if spine_tag else [])
+                 if ids.get(ref.get("idref")) and items[ids[ref["idref"]]] in HTML_MEDIA_TYPES]
+        if not spine:
+            raise ValueError("El EPUB no tiene capítulos en el spine.")
+        spine_index = {path: i for i, path in enumerate(spine)}
+
+        toc_entries = _nav_toc(zf, nav_path) if nav_path else []
+        ncx_path = ids.get(spine_tag.get("toc")) if spine_tag else None
+        if not toc_entries and ncx_path:
+            toc_entries = _ncx_toc(zf, ncx_path)
+
+        title_tag = opf.find("dc:title") or opf.find("title")
+
+    toc, chapter_titles = [], {}
+    for title, target, level in toc_entries:
+        path, _, fragment = target.partition("#")
+        if path in spine_index:
+            toc.append({"title": title, "chapter": spine_index[path], "fragment": fragment or None, "level": level})
+            chapter_titles.setdefault(spine_index[path], title)
+
+    return {
+        "title": title_tag.get_text(strip=True) if title_tag else None,
+        "items": items,
+        "spine": spine,
+        "spine_index": spine_index,
+        "chapter_titles": chapter_titles,
+        "toc": toc,
+    }
+
+class ManifestCache:
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._manifests: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, epub_path: str) -> dict:
+        """Manifiesto analizado del EPUB; solo se vuelve a leer el .opf si el archivo ha cambiado."""
+        mtime = os.stat(epub_path).st_mtime
+        with self._lock:
+            cached = self._manifests.get(epub_path)
+            if cached and cached[0] == mtime:
+                self._manifests.move_to_end(epub_path)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        manifest = parse_manifest(epub_path)
+        with self._lock:
+            self._manifests[epub_path] = (mtime, manifest)
+            while len(self._manifests) > self.max_items:
+                self._manifests.popitem(last=False)
+        return manifest
+
+    def forget(self, epub_path: str):
+        with self._lock:
+            self._manifests.pop(epub_path, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "cached_books": len(self._manifests),
+        }
+
+manifests = ManifestCache(MANIFEST_CACHE_SIZE)
+
+def _rewrite_url(url: str, base_dir: str, manifest: dict, base_url: str, external: bool = False) -> str | None:
+    """URL de la API para un enlace o recurso del capítulo; None si hay que quitarlo.
+
+    Las URLs absolutas (http, https, mailto) solo se conservan con external=True, en los enlaces.
+    """
+    url = url.strip()
+    scheme = urlsplit(url).scheme.lower()
+    if url.startswith("#"):
+        return url
+    if scheme in ("http", "https", "mailto"):
+        return url if external else None
+    if scheme:
+        return None # javascript:, data:, file:...
+    path = _resolve(base_dir, url)
+    if path in manifest["spine_index"]:
+        return f"{base_url}/chapters/{manifest['spine_index'][path]}{_fragment(url)}"
+    if path in manifest["items"] and manifest["items"][path] not in HTML_MEDIA_TYPES:
+        return f"{base_url}/assets/{quote(path)}"
+    return None
+
+def _rewrite_css(css: str, base_dir: str, manifest: dict, base_url: str) -> str:
+    def replace(match):
+        url = next(group for group in match.groups() if group is not None)
+        rewritten = _rewrite_url(url, base_dir, manifest, base_url)
+        return f"url('{rewritten}')" if rewritten else "none"
+    return CSS_URL_PATTERN.sub(replace, css)
+
+def _rewrite_srcset(srcset: str, base_dir: str, manifest: dict, base_url: str) -> str | None:
+    """srcset con cada candidato ("url descriptor") reescrito; None si no queda ninguno."""
+    candidates = []
+    for candidate in srcset.split(","):
+        url, _, descriptor = candidate.strip().partition(" ")
+        rewritten = _rewrite_url(url, base_dir, manifest, base_url) if url else None
+        if rewritten:
+            candidates.append(f"{rewritten} {descriptor.strip()}".strip())
+    return ", ".join(candidates) or None
+
+def render_chapter(epub_path: str, manifest: dict, index: int, base_url: str) -> str:
+    """HTML saneado del capítulo `index` del spine, con enlaces a `base_url` (/books/{id}/epub).
+
+    Lanza IndexError si el capítulo no existe.
+    """
+    if not 0 <= index < len(manifest["spine"]):
+        raise IndexError(index)
+    chapter_path = manifest["spine"][index]
+    base_dir = posixpath.dirname(chapter_path)
+    with zipfile.ZipFile(epub_path) as zf:
+        soup = BeautifulSoup(zf.read(chapter_path), "html.parser")
+
+    for tag in soup.find_all(UNSAFE_TAGS):
+        tag.decompose()
+    for tag in soup.find_all("meta", attrs={"http-equiv": True}):
+        tag.decompose()
+    for tag in soup.find_all(True):
+        for attribute in list(tag.attrs):
+            if attribute.lower().startswith("on"):
+                del tag[attribute]
+            elif attribute.lower() in URL_ATTRIBUTES or attribute.lower() == "srcset":
+                if attribute.lower() == "srcset":
+                    rewritten = _rewrite_srcset(tag[attribute], base_dir, manifest, base_url)
+                else:
+                    external = tag.name in LINK_TAGS and attribute.lower() in ("href", "xlink:href")
+                    rewritten = _rewrite_url(tag[attribute], base_dir, manifest, base_url, external)
+                if rewritten is None:
+                    del tag[attribute]
+                else:
+                    tag[attribute] = rewritten
+                    if urlsplit(rewritten).scheme in ("http", "https"):
+                        tag["target"] = "_blank"
+                        tag["rel"] = "noopener noreferrer"
+            elif attribute.lower() == "style":
+                tag[attribute] = _rewrite_css(tag[attribute], base_dir, manifest, base_url)
+        if tag.name == "style" and tag.string:
+            tag.string = _rewrite_css(tag.string, base_dir, manifest, base_url)
+    return str(soup)
+
+def asset_media_type(manifest: dict, asset_path: str) -> str:
+    """Tipo MIME de un recurso del manifiesto; KeyError si no se puede servir como recurso."""
+    media_type = manifest["items"][asset_path]
+    if media_type in HTML_MEDIA_TYPES:
+        raise KeyError(asset_path) # Los documentos solo se sirven saneados, como capítulos
+    return media_type
+
+def asset_size(epub_path: str, asset_path: str) -> int:
+    with zipfile.ZipFile(epub_path) as zf:
+        return zf.getinfo(asset_path).file_size
+
+def iter_asset(epub_path: str, asset_path: str) -> Iterator[bytes]:
+    """Lee un recurso del zip por trozos, descomprimiéndolo sobre la marcha."""
+    with zipfile.ZipFile(epub_path) as zf, zf.open(asset_path) as member:
+        while chunk := member.read(ASSET_CHUNK_SIZE):
+            yield chunk
@@ -0,0 +1,73 @@
+"""Cola acotada de trabajos en segundo plano atendida por un número fijo de workers asyncio.
+
+El servidor, y no el número de pestañas del navegador, decide cuántos trabajos se procesan a la vez:
+si la cola está llena, submit() lanza asyncio.QueueFull y la ruta puede responder 503.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+import metrics
+
+class JobQueue:
+    def __init__(self, handler: Callable[[Any, dict], Awaitable[None]], n_workers: int, max_queued: int, max_history: int = 1000):
+        """`handler(job, payload)` procesa un trabajo y actualiza su estado en `job`."""
+        self.handler = handler
+        self.n_workers = n_workers
+        self.max_history = max_history
+        self.jobs: OrderedDict[str, Any] = OrderedDict()
+        self._queue: asyncio.Queue | None = None
+        self._max_queued = max_queued
+        self._workers: list[asyncio.Task] = []
+        self._active_keys: dict[str, str] = {}
+
+    def _ensure_started(self):
+        # Se arranca en el primer uso para crear la cola y las tareas dentro del bucle de eventos del servidor
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self._max_queued)
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.n_workers)]
+
+    def submit(self, job_id: str, job: Any, payload: dict, key: str | None = None):
+        """Encola un trabajo. `key` identifica trabajos equivalentes mientras están activos."""
+        self._ensure_started()
+        self._queue.put_nowait((job_id, key, payload))
+        self.jobs[job_id] = job
+        if key:
+            self._active_keys[key] = job_id
+        while len(self.jobs) > self.max_history:
+            oldest_id = next(iter(self.jobs))
+            if oldest_id in self._active_keys.values():
+                break
+            self.jobs.popitem(last=False)
+
+    def get(self, job_id: str) -> Any | None:
+        return self.jobs.get(job_id)
+
+    def find_active(self, key: str) -> Any | None:
+        """Devuelve el trabajo en cola o en curso con esa clave, si lo hay."""
+        job_id = self._active_keys.get(key)
+        return self.jobs.get(job_id) if job_id else None
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _worker(self):
+        while True:
+            job_id, key, payload = await self._queue.get()
+            try:
+                await self.handler(self.jobs[job_id], payload)
+            except Exception as e:
+                metrics.log_event("job.error", logging.ERROR, job_id=job_id, error=str(e))
+            finally:
+                if key:
+                    self._active_keys.pop(key, None)
+                self._queue.task_done()
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
@@ -0,0 +1,266 @@
+"""Importación masiva de una biblioteca desde un árbol de directorios.
+
+La extracción (process_pdf/process_epub) se reparte en el pool de procesos, las llamadas
+a la IA se solapan con un límite de concurrencia y los libros se insertan por lotes.
+
+Uso desde la línea de comandos (desde la carpeta backend):
+    python -m library_import /ruta/al/archivo --ai-concurrency 8 --batch-size 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import time
+from typing import Awaitable, Callable
+
+from sqlalchemy.exc import IntegrityError
+
+import chunked_upload, crud, database, metrics, models, processing, schemas, search_index, thumbnails, workers
+
+SUPPORTED_EXTENSIONS = (".pdf", ".epub")
+
+def find_books(root: str) -> list[str]:
+    """Devuelve las rutas de todos los PDF y EPUB bajo root, en orden estable."""
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                paths.append(os.path.join(dirpath, filename))
+    return sorted(paths)
+
+def is_unhashed_copy(db, file_path: str, file_hash: str) -> bool:
+    """True si file_path es un libro sin file_hash (añadido antes de guardarlo) con este mismo contenido.
+
+    Mientras backfill_file_hashes no lo complete, get_book_by_hash no lo encuentra: se compara el archivo en disco.
+    """
+    book = crud.get_book_by_path(db, file_path)
+    if not book or book.file_hash or not os.path.exists(file_path):
+        return False
+    return chunked_upload.hash_file(file_path) == file_hash
+
+# Prefijo del file_hash de una copia repetida de otro libro (file_hash es único): así queda marcada
+# como revisada y no se vuelve a leer entera en cada arranque
+DUPLICATE_HASH_PREFIX = "duplicado:"
+
+def backfill_file_hashes(db) -> int:
+    """Calcula el file_hash de los libros que no lo tienen y devuelve cuántos se completaron.
+
+    Los libros cuyo archivo falta se dejan sin hash. Una copia repetida de otro libro recibe
+    DUPLICATE_HASH_PREFIX + su id + el hash y se registra en el log una sola vez.
+    """
+    filled = 0
+    for book in crud.get_books_without_hash(db):
+        if not os.path.exists(book.file_path):
+            continue
+        file_hash = chunked_upload.hash_file(book.file_path)
+        try:
+            crud.set_file_hash(db, book.id, file_hash)
+            filled += 1
+        except IntegrityError:
+            db.rollback()
+            original = crud.get_book_by_hash(db, file_hash)
+            metrics.log_event("books.file_hash_duplicate", logging.WARNING, book_id=book.id,
+                              file_path=book.file_path, duplicate_of=original.id if original else None)
+            crud.set_file_hash(db, book.id, f"{DUPLICATE_HASH_PREFIX}{book.id}:{file_hash}")
+    return filled
+
+def save_batch(db, batch: list[models.Book]) -> tuple[list[tuple[int, str]], int]:
+    """Inserta un lote de libros; devuelve (id, file_hash) de los guardados y cuántos estaban repetidos."""
+    try:
+        db.add_all(batch)
+        db.commit()
+        saved = batch
+    except IntegrityError:
+        # Algún libro del lote se añadió por otra vía mientras tanto: insertar uno a uno
+        db.rollback()
+        saved = []
+        for book in batch:
+            try:
+                book = models.Book(**{c.name: getattr(book, c.name) for c in models.Book.__table__.columns if c.name != "id"})
+                db.add(book)
+                db.commit()
+                saved.append(book)
+            except IntegrityError:
+                db.rollback()
+    return [(book.id, book.file_hash) for book in saved], len(batch) - len(saved)
+
+def is_known_book(db, file_hash: str, file_path: str) -> tuple[bool, bool]:
+    """(hay un libro con este contenido, hay un libro con esta ruta)."""
+    return crud.get_book_by_hash(db, file_hash) is not None, crud.get_book_by_path(db, file_path) is not None
+
+async def import_directory(
+    root: str,
+    analyze: Callable[[str], Awaitable[dict]],
+    books_dir: str = "books",
+    covers_dir: str = "static/covers",
+    ai_concurrency: int = 4,
+    batch_size: int = 50,
+    summary: schemas.ImportSummary | None = None,
+) -> schemas.ImportSummary:
+    """Importa todos los libros de root y devuelve el resumen de la ejecución.
+
+    `analyze` recibe el texto extraído y devuelve los metadatos (normalmente analyze_with_gemini).
+    Si se pasa `summary`, se va actualizando durante la importación para poder consultar el progreso.
+    """
+    summary = summary or schemas.ImportSummary()
+    os.makedirs(books_dir, exist_ok=True)
+    paths = await workers.run_io_bound(find_books, root)
+    summary.found = len(paths)
+    start = time.perf_counter()
+
+    db = database.SessionLocal()
+    queue: asyncio.Queue[str] = asyncio.Queue()
+    for path in paths:
+        queue.put_nowait(path)
+    ai_semaphore = asyncio.Semaphore(ai_concurrency)
+    seen_hashes: set[str] = set()
+    claimed_paths: set[str] = set()
+    pending: list[models.Book] = []
+    body_texts: dict[str, str] = {} # file_hash -> texto extraído, para el índice de búsqueda
+    # La sesión es síncrona: cada acceso va al pool de I/O, de uno en uno, para no bloquear el bucle de eventos
+    db_lock = asyncio.Lock()
+
+    async def run_db(func, *args):
+        async with db_lock:
+            return await workers.run_io_bound(func, db, *args)
+
+    async def commit_batch():
+        if not pending:
+            return
+        batch = pending[:]
+        pending.clear()
+        saved, duplicates = await run_db(save_batch, batch)
+        summary.imported += len(saved)
+        summary.duplicates += duplicates
+        crud.invalidate_facets()
+        texts = {book_id: body_texts.pop(file_hash) for book_id, file_hash in saved if file_hash in body_texts}
+        await run_db(search_index.set_body_texts, texts)
+
+    async def import_one(source_path: str):
+        file_hash = await workers.run_io_bound(chunked_upload.hash_file, source_path)
+        if file_hash in seen_hashes:
+            summary.duplicates += 1
+            return
+        seen_hashes.add(file_hash)
+        filename = os.path.basename(source_path)
+        file_path = os.path.abspath(os.path.join(books_dir, filename))
+        hash_known, path_known = await run_db(is_known_book, file_hash, file_path)
+        if hash_known:
+            summary.duplicates += 1
+            return
+
+        if file_path in claimed_paths or os.path.exists(file_path) or path_known:
+            if await run_db(is_unhashed_copy, file_path, file_hash):
+                summary.duplicates += 1
+                return
+            stem, ext = os.path.splitext(filename)
+            file_path = os.path.abspath(os.path.join(books_dir, f"{stem}_{file_hash[:8]}{ext}"))
+        claimed_paths.add(file_path)
+        await workers.run_io_bound(shutil.copyfile, source_path, file_path)
+
+        try:
+            with metrics.stage("import.extract"):
+                if file_path.lower().endswith(".pdf"):
+                    book_data = await workers.run_cpu_bound(processing.process_pdf, file_path, covers_dir)
+                else:
+                    book_data = await workers.run_cpu_bound(processing.process_epub, file_path, covers_dir)
+            async with ai_semaphore:
+                with metrics.stage("import.analyze"):
+                    ai_result = await analyze(book_data["text"])
+        except Exception as e:
+            os.remove(file_path)
+            summary.failed += 1
+            summary.errors.append(f"{source_path}: {e}")
+            return
+
+        # --- Puerta de Calidad (la misma que en /upload-book/) ---
+        title = ai_result.get("title", "Desconocido")
+        author = ai_result.get("author", "Desconocido")
+        if title == "Desconocido" and author == "Desconocido":
+            os.remove(file_path)
+            summary.failed += 1
+            summary.errors.append(f"{source_path}: la IA no pudo identificar el título ni el autor.")
+            return
+
+        cover_hash = None
+        if book_data.get("cover_image_url"):
+            try:
+                cover_hash = await workers.run_cpu_bound(thumbnails.generate_thumbnails, book_data["cover_image_url"])
+            except Exception as e:
+                metrics.log_event("thumbnails.error", logging.WARNING, source_path=source_path, error=str(e))
+
+        if search_index.INDEX_BODY_TEXT:
+            body_texts[file_hash] = book_data["text"]
+        summary.bytes_processed += os.path.getsize(file_path)
+        pending.append(models.Book(
+            title=title,
+            author=author,
+            category=ai_result.get("category", "Desconocido"),
+            language=ai_result.get("language", "Desconocido"),
+            cover_image_url=book_data.get("cover_image_url"),
+            file_path=file_path,
+            is_read=False,
+            file_hash=file_hash,
+            cover_hash=cover_hash,
+        ))
+        if len(pending) >= batch_size:
+            await commit_batch()
+
+    async def worker():
+        while not queue.empty():
+            source_path = queue.get_nowait()
+            try:
+                await import_one(source_path)
+            except Exception as e:
+                summary.failed += 1
+                summary.errors.append(f"{source_path}: {e}")
+            summary.processed += 1
+            summary.elapsed_seconds = time.perf_counter() - start
+
+    # Suficientes corrutinas para mantener ocupados el pool de procesos y las llamadas a la IA
+    n_workers = max(1, min(len(paths), workers.CPU_WORKERS + ai_concurrency))
+    try:
+        await asyncio.gather(*(worker() for _ in range(n_workers)))
+        await commit_batch()
+    finally:
+        db.close()
+
+    summary.elapsed_seconds = time.perf_counter() - start
+    summary.finished = True
+    return summary
+
+def format_summary(summary: schemas.ImportSummary) -> str:
+    """Resumen de rendimiento legible de una importación."""
+    elapsed = max(summary.elapsed_seconds, 1e-9)
+    return (
+        f"Encontrados: {summary.found}  Importados: {summary.imported}  "
+        f"Duplicados: {summary.duplicates}  Fallidos: {summary.failed}\n"
+        f"Tiempo: {summary.elapsed_seconds:.1f} s  "
+        f"{summary.processed / elapsed:.2f} libros/s  "
+        f"{summary.bytes_processed / (1024 * 1024) / elapsed:.2f} MB/s"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa todos los PDF y EPUB de un directorio a la biblioteca.")
+    parser.add_argument("directory", help="Directorio raíz con los libros a importar")
+    parser.add_argument("--ai-concurrency", type=int, default=4, help="Llamadas simultáneas a la IA")
+    parser.add_argument("--batch-size", type=int, default=50, help="Libros insertados por commit")
+    args = parser.parse_args()
+
+    import main as app_main # Configura Gemini, la base de datos y las carpetas igual que el servidor
+
+    summary = asyncio.run(import_directory(
+        args.directory,
+        analyze=app_main.analyze_with_gemini,
+        covers_dir=app_main.STATIC_COVERS_DIR,
+        ai_concurrency=args.ai_concurrency,
+        batch_size=args.batch_size,
+    ))
+    workers.shutdown()
+    for error in summary.errors:
+        print(f"ERROR {error}")
+    print(format_summary(summary))
+
+if __name__ == "__main__":
+    main()
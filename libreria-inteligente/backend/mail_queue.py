@@ -0,0 +1,304 @@
+"""Cola persistente de envíos a Kindle por email.
+
+Los trabajos se guardan en su propio fichero SQLite, así que los pendientes sobreviven a un
+reinicio del servidor. Un único worker asyncio los envía en orden reutilizando una conexión SMTP
+ya autenticada (se cierra tras MAIL_IDLE_SECONDS sin envíos) y agrupa varios libros para el mismo
+destinatario en un mensaje mientras no supere MAIL_MAX_MESSAGE_MB. Los errores temporales se
+reintentan con espera exponencial; los permanentes (autenticación, destinatario rechazado, 5xx)
+marcan el trabajo como fallido.
+
+Estados: queued -> sending -> sent | failed (un error temporal vuelve a queued).
+"""
+import asyncio
+import logging
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+import uuid
+from email.message import EmailMessage
+
+import metrics, workers
+
+MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", "30"))
+RETRY_MAX_SECONDS = float(os.getenv("MAIL_RETRY_MAX_SECONDS", "1800"))
+MAX_MESSAGE_BYTES = int(os.getenv("MAIL_MAX_MESSAGE_MB", "25")) * 1024 * 1024
+MAX_ATTACHMENTS = int(os.getenv("MAIL_MAX_ATTACHMENTS", "10"))
+IDLE_SECONDS = float(os.getenv("MAIL_IDLE_SECONDS", "60"))
+MAX_HISTORY = 1000
+ERROR_BACKOFF_SECONDS = 5.0
+
+class MailConfigError(ValueError):
+    pass
+
+def smtp_settings_from_env() -> dict:
+    """Configuración SMTP del .env; SMTP_SECURITY es ssl (por defecto), starttls o none."""
+    settings = {
+        "recipient": os.getenv("KINDLE_EMAIL"),
+        "sender": os.getenv("SENDER_EMAIL"),
+        "password": os.getenv("SENDER_PASSWORD"),
+        "host": os.getenv("SMTP_SERVER"),
+        "port": os.getenv("SMTP_PORT"),
+        "security": os.getenv("SMTP_SECURITY", "ssl").lower(),
+        "timeout": float(os.getenv("SMTP_TIMEOUT", "60")),
+    }
+    if not all([settings["recipient"], settings["sender"], settings["host"], settings["port"]]) or \
+            (settings["security"] != "none" and not settings["password"]):
+        raise MailConfigError("La configuración para el envío de email está incompleta en el archivo .env")
+    settings["port"] = int(settings["port"])
+    return settings
+
+def is_permanent(error: Exception) -> bool:
+    """Errores que no se arreglan reintentando: credenciales, direcciones rechazadas o respuestas 5xx."""
+    if isinstance(error, (smtplib.SMTPAuthenticationError, smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                          smtplib.SMTPNotSupportedError, FileNotFoundError)):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+def describe_error(error: Exception) -> str:
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return "Error de autenticación SMTP. Revisa tu SENDER_EMAIL y SENDER_PASSWORD (¿contraseña de aplicación?)."
+    return f"{type(error).__name__}: {error}"
+
+class MailQueue:
+    def __init__(self, db_path: str, settings_loader=smtp_settings_from_env):
+        """`settings_loader()` devuelve la configuración SMTP; se llama al encolar y al conectar."""
+        self.settings_loader = settings_loader
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.connections = 0
+        self._smtp: smtplib.SMTP | None = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS mail_jobs ("
+            "job_id TEXT PRIMARY KEY, book_id INTEGER NOT NULL, title TEXT NOT NULL, file_path TEXT NOT NULL, "
+            "recipient TEXT NOT NULL, size INTEGER NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT, next_attempt REAL NOT NULL, created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_mail_jobs_status ON mail_jobs (status, next_attempt)")
+        self._conn.commit()
+
+    # --- Trabajos ---
+    # Las consultas son síncronas (sqlite3): las corrutinas las ejecutan en el pool de hilos con
+    # workers.run_io_bound y el cerrojo serializa el acceso a la conexión compartida
+    def _execute(self, sql: str, params=(), many: bool = False) -> list[sqlite3.Row]:
+        with self._lock:
+            if many:
+                self._conn.executemany(sql, params)
+                rows = []
+            else:
+                rows = self._conn.execute(sql, params).fetchall()
+            self._conn.commit()
+            return rows
+
+    def _get(self, job_id: str) -> dict | None:
+        rows = self._execute("SELECT * FROM mail_jobs WHERE job_id = ?", (job_id,))
+        return dict(rows[0]) if rows else None
+
+    async def get(self, job_id: str) -> dict | None:
+        return await workers.run_io_bound(self._get, job_id)
+
+    def _insert(self, book_id: int, title: str, file_path: str) -> dict:
+        settings = self.settings_loader()
+        active = self._execute("SELECT job_id FROM mail_jobs WHERE book_id = ? AND status IN ('queued', 'sending')", (book_id,))
+        if active:
+            return self._get(active[0]["job_id"])
+        now = time.time()
+        job_id = str(uuid.uuid4())
+        self._execute(
+            "INSERT INTO mail_jobs (job_id, book_id, title, file_path, recipient, size, status, next_attempt, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, book_id, title, file_path, settings["recipient"], os.path.getsize(file_path), now, now, now),
+        )
+        self._execute(
+            "DELETE FROM mail_jobs WHERE status IN ('sent', 'failed') AND job_id NOT IN "
+            "(SELECT job_id FROM mail_jobs WHERE status IN ('sent', 'failed') ORDER BY updated DESC LIMIT ?)",
+            (MAX_HISTORY,),
+        )
+        return self._get(job_id)
+
+    async def submit(self, book_id: int, title: str, file_path: str) -> dict:
+        """Encola el envío de un libro y devuelve el trabajo. Si ya hay uno pendiente para ese libro, devuelve ese."""
+        job = await workers.run_io_bound(self._insert, book_id, title, file_path)
+        if self._wakeup:
+            self._wakeup.set()
+        return job
+
+    async def _next_batch(self) -> list[dict]:
+        """Trabajos pendientes ya vencidos para el mismo destinatario que caben en un mensaje."""
+        due = [dict(row) for row in await workers.run_io_bound(
+            self._execute,
+            "SELECT * FROM mail_jobs WHERE status = 'queued' AND next_attempt <= ? ORDER BY created LIMIT ?",
+            (time.time(), MAX_ATTACHMENTS * 4),
+        )]
+        batch, encoded_size = [], 0
+        for job in due:
+            job_size = job["size"] * 4 // 3 # Los adjuntos van en base64
+            if batch and (job["recipient"] != batch[0]["recipient"] or encoded_size + job_size > MAX_MESSAGE_BYTES
+                          or len(batch) >= MAX_ATTACHMENTS):
+                continue
+            batch.append(job)
+            encoded_size += job_size
+        return batch
+
+    async def _seconds_until_due(self) -> float | None:
+        rows = await workers.run_io_bound(
+            self._execute, "SELECT MIN(next_attempt) AS next_attempt FROM mail_jobs WHERE status = 'queued'")
+        next_attempt = rows[0]["next_attempt"]
+        return None if next_attempt is None else max(0.0, next_attempt - time.time())
+
+    async def _save(self, jobs: list[dict]):
+        """Guarda el estado de los trabajos del lote en una sola transacción."""
+        now = time.time()
+        await workers.run_io_bound(
+            self._execute,
+            "UPDATE mail_jobs SET status = ?, attempts = ?, error = ?, next_attempt = ?, updated = ? WHERE job_id = ?",
+            [(job["status"], job["attempts"], job["error"], job["next_attempt"], now, job["job_id"]) for job in jobs],
+            many=True,
+        )
+
+    async def _set_status(self, jobs: list[dict], status: str, error: str | None = None, attempt: bool = False):
+        for job in jobs:
+            job["attempts"] += 1 if attempt else 0
+            job["status"], job["error"] = status, error
+        await self._save(jobs)
+
+    # --- SMTP ---
+    def _connection(self) -> smtplib.SMTP:
+        """Conexión autenticada abierta, reutilizada entre envíos."""
+        if self._smtp is None:
+            settings = self.settings_loader()
+            if settings["security"] == "ssl":
+                smtp = smtplib.SMTP_SSL(settings["host"], settings["port"], timeout=settings["timeout"])
+            else:
+                smtp = smtplib.SMTP(settings["host"], settings["port"], timeout=settings["timeout"])
+                if settings["security"] == "starttls":
+                    smtp.starttls()
+            if settings["password"]:
+                smtp.login(settings["sender"], settings["password"])
+            self._smtp = smtp
+            self.connections += 1
+        return self._smtp
+
+    def close_connection(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self._smtp.close()
+            self._smtp = None
+
+    def _build_message(self, jobs: list[dict]) -> EmailMessage:
+        settings = self.settings_loader()
+        msg = EmailMessage()
+        msg["From"] = settings["sender"]
+        msg["To"] = jobs[0]["recipient"]
+        titles = ", ".join(f"'{job['title']}'" for job in jobs)
+        msg["Subject"] = f"Conversión de libro: {jobs[0]['title']}" if len(jobs) == 1 else f"Conversión de {len(jobs)} libros"
+        # Kindle no necesita cuerpo, pero es buena práctica incluirlo
+        msg.set_content(f"Adjunto encontrarás {'el libro' if len(jobs) == 1 else 'los libros'} {titles}.")
+        for job in jobs:
+            with open(job["file_path"], "rb") as f:
+                msg.add_attachment(f.read(), maintype="application", subtype="epub+zip",
+                                   filename=os.path.basename(job["file_path"]))
+        return msg
+
+    def _send(self, jobs: list[dict]):
+        """Envía un mensaje con los libros del lote. Se ejecuta en el pool de hilos."""
+        msg = self._build_message(jobs)
+        self._last_used = time.monotonic()
+        try:
+            self._connection().send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # El servidor cerró la conexión reutilizada mientras estaba inactiva: se reconecta una vez
+            self._smtp = None
+            self._connection().send_message(msg)
+        self._last_used = time.monotonic()
+
+    # --- Worker ---
+    async def _run(self):
+        """Bucle del worker: un error inesperado (SQLite, disco...) se registra y no detiene la cola."""
+        while True:
+            try:
+                await self._process_next()
+            except Exception as e:
+                metrics.log_event("kindle.queue_error", logging.ERROR, error=f"{type(e).__name__}: {e}")
+                await asyncio.sleep(ERROR_BACKOFF_SECONDS)
+
+    async def _process_next(self):
+        """Envía el siguiente lote vencido o espera hasta que haya uno (o hasta cerrar la conexión inactiva)."""
+        batch = await self._next_batch()
+        if not batch:
+            timeout = await self._seconds_until_due()
+            if self._smtp is not None:
+                idle_left = max(0.0, IDLE_SECONDS - (time.monotonic() - self._last_used))
+                if idle_left == 0:
+                    await workers.run_io_bound(self.close_connection)
+                else:
+                    timeout = idle_left if timeout is None else min(timeout, idle_left)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            return
+
+        missing = [job for job in batch if not os.path.exists(job["file_path"])]
+        if missing:
+            await self._set_status(missing, "failed", error="El archivo del libro no se encuentra en el servidor.")
+            self.failed += len(missing)
+            return
+        await self._set_status(batch, "sending", error=batch[0]["error"], attempt=True)
+        try:
+            with metrics.stage("mail.send"):
+                await workers.run_io_bound(self._send, batch)
+        except Exception as e:
+            # Tras una respuesta de error del servidor la sesión sigue siendo válida; si se cayó la conexión, no
+            if not isinstance(e, smtplib.SMTPResponseException) or isinstance(e, smtplib.SMTPAuthenticationError):
+                await workers.run_io_bound(self.close_connection)
+            await self._handle_failure(batch, e)
+        else:
+            await self._set_status(batch, "sent")
+            self.sent += len(batch)
+            metrics.log_event("kindle.sent", jobs=[job["job_id"] for job in batch], recipient=batch[0]["recipient"])
+
+    async def _handle_failure(self, jobs: list[dict], error: Exception):
+        message = describe_error(error)
+        metrics.log_event("kindle.send_error", logging.WARNING, jobs=[job["job_id"] for job in jobs], error=message)
+        now = time.time()
+        for job in jobs:
+            job["error"] = message
+            if is_permanent(error) or job["attempts"] >= MAX_ATTEMPTS:
+                job["status"] = "failed"
+                self.failed += 1
+            else:
+                job["status"] = "queued"
+                job["next_attempt"] = now + min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1))
+                self.retried += 1
+        await self._save(jobs)
+
+    def start(self):
+        """Arranca el worker; los envíos que quedaron a medias en un reinicio vuelven a la cola."""
+        self._execute("UPDATE mail_jobs SET status = 'queued' WHERE status = 'sending'")
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await workers.run_io_bound(self.close_connection)
+
+    def stats(self) -> dict:
+        pending = self._execute("SELECT COUNT(*) AS n FROM mail_jobs WHERE status IN ('queued', 'sending')")[0]["n"]
+        return {"sent": self.sent, "failed": self.failed, "retried": self.retried,
+                "connections": self.connections, "pending": pending}
@@ -1,41 +1,51 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Response
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Response, Query, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, RedirectResponse
 from sqlalchemy.orm import Session
-import shutil
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
 import os
-import io
-import fitz
-import ebooklib
-from ebooklib import epub
-from bs4 import BeautifulSoup
 import google.generativeai as genai
 from dotenv import load_dotenv
 import json
+import hashlib
+import asyncio
+import importlib.metadata
+import logging
+import zipfile
 from typing import List
 
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
 
-import crud, models, database, schemas
+import crud, async_crud, models, database, schemas
+import processing, workers, ai_cache, library_import, job_queue, thumbnails, search_index, chunked_upload, pdf_pages, epub_reader, mail_queue
+import conversion_cache as conversion_cache_module
+import metrics
 import rag # Import the new RAG module
 import uuid # For generating unique book IDs
 
 # --- Configuración Inicial ---
 load_dotenv(dotenv_path='../.env')
+metrics.configure_logging(os.getenv("LOG_LEVEL", "INFO"))
 API_KEY = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
 if not API_KEY:
     raise Exception("No se encontró la variable de entorno GOOGLE_API_KEY ni GEMINI_API_KEY.")
 genai.configure(api_key=API_KEY)
 models.Base.metadata.create_all(bind=database.engine)
+search_index.ensure_search_index(database.engine)
+
+# --- Caché de metadatos de la IA ---
+# Un texto ya analizado (subida reintentada, reimportación tras borrar la BD) no vuelve a llamar al modelo
+METADATA_MODEL = 'gemini-1.5-flash-latest'
+metadata_cache = ai_cache.ResultCache(
+    db_path=os.getenv("AI_CACHE_PATH", "../ai_cache.db"),
+    max_disk_bytes=int(os.getenv("AI_CACHE_MAX_MB", "50")) * 1024 * 1024,
+    max_memory_items=int(os.getenv("AI_CACHE_MEMORY_ITEMS", "1024")),
+)
 
 # --- Funciones de IA y Procesamiento ---
-async def analyze_with_gemini(text: str) -> dict:
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
+async def analyze_with_gemini(text: str, use_cache: bool = True) -> dict:
+    model = genai.GenerativeModel(METADATA_MODEL)
     prompt = f"""
     Eres un bibliotecario experto. Analiza el siguiente texto extraído de las primeras páginas de un libro.
     Tu tarea es identificar el título, el autor, la categoría principal y el idioma del libro.
@@ -45,81 +55,74 @@ async def analyze_with_gemini(text: str) -> dict:
     Ejemplo: {{'title': 'El nombre del viento', 'author': 'Patrick Rothfuss', 'category': 'Fantasía', 'language': 'Español'}}
     Texto a analizar: --- {text[:4000]} ---
     """
+    cache_key = ai_cache.make_key(METADATA_MODEL, prompt)
+    if use_cache:
+        cached = await workers.run_io_bound(metadata_cache.get, cache_key)
+        if cached is not None:
+            return cached
+    response = None
     try:
-        response = await model.generate_content_async(prompt)
-        print(f"DEBUG: Gemini raw response: {response.text}")
+        with metrics.model_call(METADATA_MODEL, "metadata"):
+            response = await model.generate_content_async(prompt)
+        metrics.log_event("gemini.response", logging.DEBUG, model=METADATA_MODEL, text=response.text)
         match = response.text.strip()
         if match.startswith("```json"):
             match = match[7:]
         if match.endswith("```"):
             match = match[:-3]
-        return json.loads(match.strip())
+        result = json.loads(match.strip())
+        await workers.run_io_bound(metadata_cache.set, cache_key, result)
+        return result
     except Exception as e:
-        print(f"Error al analizar con Gemini: {e}")
-        if 'response' in locals():
-            print(f"DEBUG: Gemini raw response on error: {response.text}")
+        metrics.log_event("gemini.error", logging.WARNING, model=METADATA_MODEL, error=str(e),
+                          text=response.text if response is not None else None)
         return {"title": "Error de IA", "author": "Error de IA", "category": "Error de IA", "language": "Desconocido"}
 
-def process_pdf(file_path: str, static_dir: str) -> dict:
-    doc = fitz.open(file_path)
-    text = ""
-    for i in range(min(len(doc), 5)): text += doc.load_page(i).get_text("text", sort=True)
-    cover_path = None
-    for i in range(len(doc)):
-        for img in doc.get_page_images(i):
-            xref = img[0]
-            pix = fitz.Pixmap(doc, xref)
-            if pix.width > 300 and pix.height > 300:
-                cover_filename = f"cover_{os.path.basename(file_path)}.png"
-                cover_full_path = os.path.join(static_dir, cover_filename)
-                pix.save(cover_full_path)
-                cover_path = f"{static_dir}/{cover_filename}"
-                break
-        if cover_path: break
-    return {"text": text, "cover_image_url": cover_path}
-
-def process_epub(file_path: str, static_dir: str) -> dict:
-    """ Lógica de procesamiento de EPUB muy mejorada con fallbacks para la portada. """
-    book = epub.read_epub(file_path)
-    text = ""
-    for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
-        soup = BeautifulSoup(item.get_content(), 'html.parser')
-        text += soup.get_text(separator=' ') + "\n"
-        if len(text) > 4500: break
-    
-    if len(text.strip()) < 100:
-        raise HTTPException(status_code=422, detail="No se pudo extraer suficiente texto del EPUB para su análisis.")
-
-    cover_path = None
-    cover_item = None
-
-    # Intento 1: Buscar la portada oficial en metadatos
-    cover_items = list(book.get_items_of_type(ebooklib.ITEM_COVER))
-    if cover_items:
-        cover_item = cover_items[0]
-    
-    # Intento 2: Si no hay portada oficial, buscar por nombre de archivo "cover"
-    if not cover_item:
-        for item in book.get_items_of_type(ebooklib.ITEM_IMAGE):
-            if 'cover' in item.get_name().lower():
-                cover_item = item
-                break
-
-    # Si encontramos una portada por cualquiera de los métodos
-    if cover_item:
-        cover_filename = f"cover_{os.path.basename(file_path)}_{cover_item.get_name()}".replace('/', '_').replace('\\', '_')
-        cover_full_path = os.path.join(static_dir, cover_filename)
-        with open(cover_full_path, 'wb') as f: f.write(cover_item.get_content())
-        cover_path = f"{static_dir}/{cover_filename}"
-
-    return {"text": text, "cover_image_url": cover_path}
-
 # --- Configuración de la App FastAPI ---
 app = FastAPI()
 STATIC_COVERS_DIR = "static/covers"
 os.makedirs(STATIC_COVERS_DIR, exist_ok=True)
 STATIC_TEMP_DIR = "temp_books"
 os.makedirs(STATIC_TEMP_DIR, exist_ok=True)
+app.on_event("shutdown")(workers.shutdown)
+
+# --- Caché de conversiones EPUB -> PDF y limpieza de temp_books/ ---
+def epub_converter_settings() -> str:
+    try:
+        weasyprint_version = importlib.metadata.version("weasyprint")
+    except importlib.metadata.PackageNotFoundError:
+        weasyprint_version = "desconocida"
+    return f"renderer={processing.EPUB_PDF_RENDERER_VERSION};weasyprint={weasyprint_version}"
+
+conversion_cache = conversion_cache_module.ConversionCache(
+    STATIC_TEMP_DIR,
+    settings=epub_converter_settings(),
+    max_bytes=int(os.getenv("TEMP_BOOKS_MAX_MB", "2048")) * 1024 * 1024,
+    ttl_seconds=float(os.getenv("TEMP_BOOKS_TTL_HOURS", "72")) * 3600,
+)
+TEMP_CLEANUP_INTERVAL_SECONDS = int(os.getenv("TEMP_CLEANUP_INTERVAL_MINUTES", "30")) * 60
+_temp_cleanup_task: asyncio.Task | None = None
+
+async def clean_temp_books_periodically():
+    while True:
+        try:
+            removed = await workers.run_io_bound(conversion_cache.evict)
+            if removed:
+                metrics.log_event("temp_books.cleanup", directory=STATIC_TEMP_DIR, removed=removed)
+        except Exception as e:
+            metrics.log_event("temp_books.cleanup_error", logging.ERROR, directory=STATIC_TEMP_DIR, error=str(e))
+        await asyncio.sleep(TEMP_CLEANUP_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_temp_cleanup():
+    global _temp_cleanup_task
+    _temp_cleanup_task = asyncio.create_task(clean_temp_books_periodically())
+
+@app.on_event("shutdown")
+async def stop_temp_cleanup():
+    if _temp_cleanup_task:
+        _temp_cleanup_task.cancel()
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/temp_books", StaticFiles(directory=STATIC_TEMP_DIR), name="temp_books")
 app.add_middleware(
@@ -128,56 +131,312 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "Upload-Offset"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 def get_db():
     db = database.SessionLocal()
     try: yield db
     finally: db.close()
 
+async def get_async_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+async def get_read_db():
+    """Sesión asíncrona de solo lectura para las rutas GET."""
+    async with database.AsyncReadSessionLocal() as db:
+        yield db
+
+# --- Subidas por partes reanudables (ver chunked_upload.py) ---
+# Las tres rutas de subida aceptan, en lugar del archivo, el upload_id de una subida por partes finalizada
+
+@app.post("/uploads/", response_model=schemas.ChunkedUploadStatus, status_code=201)
+def init_chunked_upload(request: schemas.ChunkedUploadInit):
+    """Inicia una subida por partes."""
+    try:
+        return chunked_upload.init(request.filename, request.size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/uploads/{upload_id}", response_model=schemas.ChunkedUploadStatus)
+def get_chunked_upload(upload_id: str):
+    """Estado de una subida; tras un corte, el cliente continúa desde `offset`."""
+    try:
+        return chunked_upload.status(upload_id)
+    except chunked_upload.UploadNotFound:
+        raise HTTPException(status_code=404, detail="Subida no encontrada.")
+
+@app.put("/uploads/{upload_id}", response_model=schemas.ChunkedUploadStatus)
+async def append_chunked_upload(upload_id: str, offset: int, request: Request):
+    """Añade al archivo la parte enviada en el cuerpo de la petición, que empieza en `offset`."""
+    try:
+        return await chunked_upload.append(upload_id, offset, request.stream())
+    except chunked_upload.UploadNotFound:
+        raise HTTPException(status_code=404, detail="Subida no encontrada.")
+    except chunked_upload.OffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/uploads/{upload_id}/finalize", response_model=schemas.ChunkedUploadStatus)
+async def finalize_chunked_upload(upload_id: str, request: schemas.ChunkedUploadFinalize):
+    """Comprueba que la subida está completa y que su checksum coincide."""
+    try:
+        return await chunked_upload.finalize(upload_id, request.sha256)
+    except chunked_upload.UploadNotFound:
+        raise HTTPException(status_code=404, detail="Subida no encontrada.")
+    except chunked_upload.OffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=f"La subida está incompleta. {e}", headers={"Upload-Offset": str(e.offset)})
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.delete("/uploads/{upload_id}")
+def cancel_chunked_upload(upload_id: str):
+    """Cancela una subida por partes y borra lo recibido."""
+    try:
+        chunked_upload.status(upload_id)
+    except chunked_upload.UploadNotFound:
+        raise HTTPException(status_code=404, detail="Subida no encontrada.")
+    chunked_upload.remove(upload_id)
+    return {"message": "Subida cancelada."}
+
+def upload_filename(upload: UploadFile | None, upload_id: str | None) -> str:
+    """Nombre original del archivo de una subida normal o por partes."""
+    if upload_id:
+        try:
+            return chunked_upload.status(upload_id)["filename"]
+        except chunked_upload.UploadNotFound:
+            raise HTTPException(status_code=404, detail="Subida no encontrada.")
+    if upload is None:
+        raise HTTPException(status_code=400, detail="Falta el archivo o el upload_id de una subida por partes.")
+    return upload.filename
+
+async def receive_upload(upload: UploadFile | None, upload_id: str | None, dest_path: str) -> str:
+    """Guarda en dest_path el archivo subido (normal o por partes) y devuelve su SHA-256."""
+    if upload_id:
+        try:
+            _, file_hash = await workers.run_io_bound(chunked_upload.consume, upload_id, dest_path)
+            return file_hash
+        except chunked_upload.UploadNotFound:
+            raise HTTPException(status_code=404, detail="Subida no encontrada.")
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    return await workers.run_io_bound(chunked_upload.copy_with_hash, upload.file, dest_path)
+
+# --- Ingesta de libros en segundo plano ---
+# /upload-book/ solo guarda el archivo y encola el trabajo; el pipeline se ejecuta con un número
+# acotado de workers y el cliente consulta el progreso en /upload-book/{job_id}
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "100"))
+
+async def make_thumbnails(cover_path: str | None) -> str | None:
+    """Genera las miniaturas de una portada en el pool de procesos. Un fallo no impide añadir el libro."""
+    if not cover_path:
+        return None
+    try:
+        return await workers.run_cpu_bound(thumbnails.generate_thumbnails, cover_path)
+    except Exception as e:
+        metrics.log_event("thumbnails.error", logging.WARNING, cover_path=cover_path, error=str(e))
+        return None
+
+async def run_ingest_job(job: schemas.IngestJob, payload: dict):
+    """Extrae, analiza y guarda un libro subido, actualizando la etapa del trabajo."""
+    file_path = payload["file_path"]
+    db = database.AsyncSessionLocal()
+    with metrics.tracked("ingest_job", job_id=job.job_id, filename=job.filename) as log_fields:
+        try:
+            job.stage = "extracting"
+            file_ext = os.path.splitext(file_path)[1].lower()
+            try:
+                with metrics.stage("ingest.extract"):
+                    if file_ext == ".pdf": book_data = await workers.run_cpu_bound(processing.process_pdf, file_path, STATIC_COVERS_DIR)
+                    else: book_data = await workers.run_cpu_bound(processing.process_epub, file_path, STATIC_COVERS_DIR)
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+
+            with metrics.stage("ingest.thumbnails"):
+                cover_hash = await make_thumbnails(book_data.get("cover_image_url"))
+
+            job.stage = "analyzing"
+            with metrics.stage("ingest.analyze"):
+                gemini_result = await analyze_with_gemini(book_data["text"], use_cache=not payload["skip_ai_cache"])
+
+            # --- Puerta de Calidad ---
+            title = gemini_result.get("title", "Desconocido")
+            author = gemini_result.get("author", "Desconocido")
+
+            if title == "Desconocido" and author == "Desconocido":
+                raise HTTPException(status_code=422, detail="La IA no pudo identificar el título ni el autor del libro. No se ha añadido.")
+
+            job.stage = "saving"
+            with metrics.stage("ingest.save"):
+                try:
+                    db_book = await async_crud.create_book(
+                        db, 
+                        title=title, 
+                        author=author, 
+                        category=gemini_result.get("category", "Desconocido"), 
+                        language=gemini_result.get("language", "Desconocido"),
+                        cover_image_url=book_data.get("cover_image_url"), 
+                        file_path=file_path,
+                        description=None, 
+                        rating=None,
+                        is_read=False,
+                        file_hash=payload["file_hash"],
+                        cover_hash=cover_hash
+                    )
+                except IntegrityError:
+                    # Otra subida del mismo libro terminó antes que esta
+                    await db.rollback()
+                    raise HTTPException(status_code=409, detail="Este libro ya ha sido añadido.")
+
+                if search_index.INDEX_BODY_TEXT:
+                    await db.run_sync(search_index.set_body_texts, {db_book.id: book_data["text"]})
+
+            job.book = schemas.Book.model_validate(db_book)
+            job.stage = "done"
+            log_fields["book_id"] = db_book.id
+        except Exception as e:
+            if os.path.exists(file_path):
+                os.remove(file_path) # Limpiar el archivo subido si el procesamiento falla
+            job.stage = "failed"
+            job.error_code = e.status_code if isinstance(e, HTTPException) else 500
+            job.error = e.detail if isinstance(e, HTTPException) else f"Error al procesar el libro: {e}"
+            log_fields["error"] = job.error
+        finally:
+            await db.close()
+            log_fields["outcome"] = job.stage
+
+ingest_queue = job_queue.JobQueue(run_ingest_job, n_workers=INGEST_WORKERS, max_queued=INGEST_QUEUE_SIZE)
+
+# --- Hash de los libros añadidos antes de guardar file_hash ---
+# Sin él, una nueva subida de esos libros no se detectaría como repetida
+_file_hash_backfill_task: asyncio.Task | None = None
+
+def backfill_file_hashes():
+    db = database.SessionLocal()
+    try:
+        filled = library_import.backfill_file_hashes(db)
+    finally:
+        db.close()
+    if filled:
+        metrics.log_event("books.file_hash_backfill", filled=filled)
+
+async def run_file_hash_backfill():
+    try:
+        await workers.run_io_bound(backfill_file_hashes)
+    except Exception as e:
+        metrics.log_event("books.file_hash_backfill_error", logging.ERROR, error=str(e))
+
+@app.on_event("startup")
+async def start_file_hash_backfill():
+    global _file_hash_backfill_task
+    _file_hash_backfill_task = asyncio.create_task(run_file_hash_backfill())
+
+@app.on_event("shutdown")
+async def stop_ingest_queue():
+    await ingest_queue.stop()
+
 # --- Rutas de la API ---
-@app.post("/upload-book/", response_model=schemas.Book)
-async def upload_book(db: Session = Depends(get_db), book_file: UploadFile = File(...)):
+@app.post("/upload-book/", response_model=schemas.IngestJob, status_code=202)
+async def upload_book(db: Session = Depends(get_db), book_file: UploadFile | None = File(None), upload_id: str | None = None, skip_ai_cache: bool = False):
+    """Guarda el libro subido y encola su procesamiento. Devuelve el trabajo para consultar su progreso."""
+    filename = upload_filename(book_file, upload_id)
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in (".pdf", ".epub"):
+        raise HTTPException(status_code=400, detail="Tipo de archivo no soportado.")
+
     books_dir = "books"
     os.makedirs(books_dir, exist_ok=True)
-    file_path = os.path.abspath(os.path.join(books_dir, book_file.filename))
 
-    if crud.get_book_by_path(db, file_path):
+    # Guardar la subida calculando su hash: un libro repetido se detecta por su contenido,
+    # antes de cualquier extracción o llamada a la IA, aunque llegue con otro nombre
+    temp_path = os.path.join(books_dir, f".upload_{uuid.uuid4()}")
+    with metrics.stage("upload.receive"):
+        file_hash = await receive_upload(book_file, upload_id, temp_path)
+
+    # Un reintento del navegador mientras el libro sigue en proceso recibe el mismo trabajo
+    active_job = ingest_queue.find_active(file_hash)
+    if active_job:
+        os.remove(temp_path)
+        return active_job
+    # La sesión es síncrona: las consultas van al pool de I/O para no bloquear el bucle de eventos
+    if await workers.run_io_bound(crud.get_book_by_hash, db, file_hash):
+        os.remove(temp_path)
         raise HTTPException(status_code=409, detail="Este libro ya ha sido añadido.")
 
-    with open(file_path, "wb") as buffer: shutil.copyfileobj(book_file.file, buffer)
-
-    file_ext = os.path.splitext(book_file.filename)[1].lower()
+    # Un libro distinto con el mismo nombre de archivo se guarda con un sufijo del hash
+    file_path = os.path.abspath(os.path.join(books_dir, filename))
+    if os.path.exists(file_path) or await workers.run_io_bound(crud.get_book_by_path, db, file_path):
+        if await workers.run_io_bound(library_import.is_unhashed_copy, db, file_path, file_hash):
+            os.remove(temp_path)
+            raise HTTPException(status_code=409, detail="Este libro ya ha sido añadido.")
+        stem, ext = os.path.splitext(filename)
+        file_path = os.path.abspath(os.path.join(books_dir, f"{stem}_{file_hash[:8]}{ext}"))
+    os.replace(temp_path, file_path)
+
+    job = schemas.IngestJob(job_id=str(uuid.uuid4()), filename=filename)
     try:
-        if file_ext == ".pdf": book_data = process_pdf(file_path, STATIC_COVERS_DIR)
-        elif file_ext == ".epub": book_data = process_epub(file_path, STATIC_COVERS_DIR)
-        else: raise HTTPException(status_code=400, detail="Tipo de archivo no soportado.")
-    except HTTPException as e:
-        os.remove(file_path) # Limpiar el archivo subido si el procesamiento falla
-        raise e
-
-    gemini_result = await analyze_with_gemini(book_data["text"])
-    
-    # --- Puerta de Calidad ---
-    title = gemini_result.get("title", "Desconocido")
-    author = gemini_result.get("author", "Desconocido")
-
-    if title == "Desconocido" and author == "Desconocido":
-        os.remove(file_path) # Borrar el archivo que no se pudo analizar
-        raise HTTPException(status_code=422, detail="La IA no pudo identificar el título ni el autor del libro. No se ha añadido.")
-
-    return crud.create_book(
-        db=db, 
-        title=title, 
-        author=author, 
-        category=gemini_result.get("category", "Desconocido"), 
-        language=gemini_result.get("language", "Desconocido"),
-        cover_image_url=book_data.get("cover_image_url"), 
-        file_path=file_path,
-        description=None, 
-        rating=None,
-        is_read=False
-    )
+        ingest_queue.submit(
+            job.job_id, job,
+            payload={"file_path": file_path, "file_hash": file_hash, "skip_ai_cache": skip_ai_cache},
+            key=file_hash,
+        )
+    except asyncio.QueueFull:
+        os.remove(file_path)
+        raise HTTPException(status_code=503, detail="Hay demasiados libros en cola. Inténtalo de nuevo en unos minutos.", headers={"Retry-After": "30"})
+    return job
+
+@app.get("/upload-book/{job_id}", response_model=schemas.IngestJob)
+def get_upload_status(job_id: str):
+    """Devuelve la etapa de un trabajo de ingesta y, al terminar, el libro creado o el error."""
+    job = ingest_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo de ingesta no encontrado.")
+    return job
+
+# Importaciones masivas en curso o terminadas, por id de trabajo
+import_jobs: dict[str, schemas.ImportSummary] = {}
+_import_tasks: set[asyncio.Task] = set()
+
+@app.post("/import-library/", response_model=schemas.ImportSummary, status_code=202)
+async def import_library(request: schemas.LibraryImportRequest):
+    """Inicia la importación de todos los libros de un directorio del servidor y devuelve su id de trabajo."""
+    if not os.path.isdir(request.directory):
+        raise HTTPException(status_code=400, detail="El directorio indicado no existe en el servidor.")
+
+    summary = schemas.ImportSummary(job_id=str(uuid.uuid4()))
+    import_jobs[summary.job_id] = summary
+
+    async def run_import():
+        try:
+            await library_import.import_directory(
+                request.directory,
+                analyze=analyze_with_gemini,
+                covers_dir=STATIC_COVERS_DIR,
+                ai_concurrency=request.ai_concurrency,
+                batch_size=request.batch_size,
+                summary=summary,
+            )
+        except Exception as e:
+            summary.errors.append(f"Error en la importación: {e}")
+            summary.finished = True
+        metrics.log_event("import_library", **summary.model_dump(exclude={"errors"}), errors=len(summary.errors))
+
+    task = asyncio.create_task(run_import())
+    _import_tasks.add(task)
+    task.add_done_callback(_import_tasks.discard)
+    return summary
+
+@app.get("/import-library/{job_id}", response_model=schemas.ImportSummary)
+def get_import_status(job_id: str):
+    """Devuelve el progreso de una importación masiva."""
+    summary = import_jobs.get(job_id)
+    if not summary:
+        raise HTTPException(status_code=404, detail="Importación no encontrada.")
+    return summary
 
 @app.put("/books/{book_id}", response_model=schemas.Book)
 def update_single_book(book_id: int, book: schemas.BookUpdate, db: Session = Depends(get_db)):
@@ -186,46 +445,275 @@ def update_single_book(book_id: int, book: schemas.BookUpdate, db: Session = Dep
         raise HTTPException(status_code=404, detail="Libro no encontrado.")
     return db_book
 
+BOOKS_PAGE_SIZE = int(os.getenv("BOOKS_PAGE_SIZE", "60"))
+BOOKS_MAX_PAGE_SIZE = int(os.getenv("BOOKS_MAX_PAGE_SIZE", "500"))
+
+def serialize_book_row(row, fields: list[str]) -> dict:
+    """Convierte una fila proyectada de crud.get_books_page en el diccionario de la respuesta."""
+    book = {"id": row.id}
+    for field in fields:
+        if field == "cover_thumbnails":
+            book[field] = thumbnails.thumbnail_urls(row.cover_hash) if row.cover_hash else None
+        else:
+            book[field] = getattr(row, field)
+    return book
+
 @app.get("/books/", response_model=List[schemas.Book])
-def read_books(category: str | None = None, search: str | None = None, author: str | None = None, language: str | None = None, db: Session = Depends(get_db)):
-    return crud.get_books(db, category=category, search=search, author=author, language=language)
+async def read_books(category: str | None = None, search: str | None = None, author: str | None = None, language: str | None = None,
+                     limit: int = Query(BOOKS_PAGE_SIZE, ge=1, le=BOOKS_MAX_PAGE_SIZE), cursor: str | None = None, fields: str | None = None,
+                     db: AsyncSession = Depends(get_read_db)):
+    """Una página de libros. La siguiente se pide con el cursor de la cabecera X-Next-Cursor.
+
+    `fields` (por ejemplo "title,author,cover_thumbnails") limita las columnas que se leen y se devuelven.
+    La primera página (sin cursor) incluye el total de resultados en X-Total-Count.
+    """
+    filters = dict(category=category, search=search, author=author, language=language)
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    try:
+        rows, next_cursor = await async_crud.get_books_page(db, limit=limit, cursor=cursor, fields=field_list, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Parámetros de paginación no válidos: {e}")
+
+    if field_list:
+        content = [serialize_book_row(row, field_list) for row in rows]
+    else:
+        content = [schemas.Book.model_validate(book).model_dump(mode="json") for book in rows]
+    headers = {}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if not cursor:
+        headers["X-Total-Count"] = str(await async_crud.count_books(db, **filters))
+    return JSONResponse(content=content, headers=headers)
 
 @app.get("/books/count", response_model=int)
-def get_books_count(db: Session = Depends(get_db)):
+async def get_books_count(db: AsyncSession = Depends(get_read_db)):
     """Obtiene el número total de libros en la biblioteca."""
-    return crud.get_books_count(db)
+    return await async_crud.get_books_count(db)
 
 @app.get("/books/search/", response_model=List[schemas.Book])
-def search_books(title: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+async def search_books(title: str, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_read_db)):
     """Busca libros por un título parcial, con opciones de paginación."""
-    books = crud.get_books_by_partial_title(db, title=title, skip=skip, limit=limit)
+    books = await async_crud.get_books_by_partial_title(db, title=title, skip=skip, limit=limit)
     return books
 
+def etag_matches(request: Request, etag: str) -> bool:
+    """Indica si la cabecera If-None-Match de la petición incluye el ETag actual."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+def file_etag(path: str, *parts) -> str:
+    """ETag de algo derivado de un archivo (una página, un capítulo): cambia si el archivo cambia."""
+    stat = os.stat(path)
+    key = "\0".join(str(part) for part in (path, stat.st_mtime_ns, stat.st_size, *parts))
+    return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+@app.get("/facets/", response_model=schemas.Facets)
+async def read_facets(request: Request, db: AsyncSession = Depends(get_read_db)):
+    """Categorías e idiomas con su número de libros, y el total. Responde 304 si no han cambiado."""
+    facets, etag = await async_crud.get_facets(db)
+    # no-cache: el navegador guarda la respuesta pero la revalida siempre con If-None-Match
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=facets.model_dump(), headers=headers)
+
 @app.get("/categories/", response_model=List[str])
-def read_categories(db: Session = Depends(get_db)):
-    return crud.get_categories(db)
+async def read_categories(db: AsyncSession = Depends(get_read_db)):
+    return await async_crud.get_categories(db)
 
 @app.get("/languages/", response_model=List[str])
-def read_languages(db: Session = Depends(get_db)):
-    return crud.get_languages(db)
+async def read_languages(db: AsyncSession = Depends(get_read_db)):
+    return await async_crud.get_languages(db)
 
 @app.delete("/books/{book_id}")
 def delete_single_book(book_id: int, db: Session = Depends(get_db)):
     book = crud.delete_book(db, book_id=book_id)
     if not book:
         raise HTTPException(status_code=404, detail="Libro no encontrado.")
+    pdf_pages.renderer.forget(book.file_path)
+    epub_reader.manifests.forget(book.file_path)
     return {"message": f"Libro '{book.title}' eliminado con éxito."}
 
 @app.delete("/categories/{category_name}")
-def delete_category_and_books(category_name: str, db: Session = Depends(get_db)):
-    deleted_count = crud.delete_books_by_category(db, category=category_name)
-    if deleted_count == 0:
+async def delete_category_and_books(category_name: str, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+    deleted = await async_crud.delete_books(db, category=category_name)
+    if not deleted:
         raise HTTPException(status_code=404, detail=f"Categoría '{category_name}' no encontrada o ya está vacía.")
-    return {"message": f"Categoría '{category_name}' y sus {deleted_count} libros han sido eliminados."}
+    background_tasks.add_task(cleanup_deleted_books, deleted)
+    return {"message": f"Categoría '{category_name}' y sus {len(deleted)} libros han sido eliminados."}
+
+# --- Operaciones en bloque ---
+FILE_CLEANUP_BATCH_SIZE = int(os.getenv("FILE_CLEANUP_BATCH_SIZE", "200"))
+
+def remove_deleted_files_batch(deleted: list):
+    for book in deleted:
+        pdf_pages.renderer.forget(book.file_path)
+        epub_reader.manifests.forget(book.file_path)
+    db = database.SessionLocal()
+    try:
+        crud.remove_deleted_book_files(db, deleted)
+    finally:
+        db.close()
+
+async def cleanup_deleted_books(deleted: list):
+    """Elimina por lotes, después de responder, los archivos de los libros ya borrados de la base de datos."""
+    for i in range(0, len(deleted), FILE_CLEANUP_BATCH_SIZE):
+        try:
+            await workers.run_io_bound(remove_deleted_files_batch, deleted[i:i + FILE_CLEANUP_BATCH_SIZE])
+        except Exception as e:
+            metrics.log_event("cleanup_deleted_books.error", logging.ERROR, error=str(e))
+
+@app.post("/books/bulk-delete", response_model=schemas.BulkResult)
+async def bulk_delete_books(selection: schemas.BulkBooksSelection, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+    """Elimina con una sola sentencia los libros indicados por ids y/o filtros; los archivos se borran después."""
+    try:
+        deleted = await async_crud.delete_books(db, **selection.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    background_tasks.add_task(cleanup_deleted_books, deleted)
+    return schemas.BulkResult(count=len(deleted))
+
+@app.patch("/books/", response_model=schemas.BulkResult)
+async def bulk_update_books(request: schemas.BulkUpdateRequest, db: AsyncSession = Depends(get_async_db)):
+    """Aplica los mismos cambios a varios libros (por ids y/o filtros) con una sola sentencia."""
+    try:
+        count = await async_crud.update_books(db, request.changes, **request.model_dump(exclude={"changes"}))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return schemas.BulkResult(count=count)
+
+THUMBNAIL_CACHE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+@app.get("/thumbnails/{filename}")
+def get_thumbnail(filename: str):
+    """Sirve una miniatura. El nombre incluye el hash de la portada, así que se cachea como inmutable."""
+    if os.path.basename(filename) != filename or not filename.endswith(".webp"):
+        raise HTTPException(status_code=404, detail="Miniatura no encontrada.")
+    path = os.path.join(thumbnails.THUMBNAILS_DIR, filename)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Miniatura no encontrada.")
+    return FileResponse(path, media_type="image/webp", headers=THUMBNAIL_CACHE_HEADERS)
+
+@app.get("/books/{book_id}/thumbnail")
+async def get_book_thumbnail(book_id: int, width: int = 320, db: AsyncSession = Depends(get_async_db)):
+    """Redirige a la miniatura de la portada; la genera si el libro es anterior a las miniaturas."""
+    book = await async_crud.get_book(db, book_id=book_id)
+    if not book or not book.cover_image_url or not os.path.exists(book.cover_image_url):
+        raise HTTPException(status_code=404, detail="Portada no encontrada.")
+    width = thumbnails.closest_width(width)
+    if not book.cover_hash or not os.path.exists(thumbnails.thumbnail_path(book.cover_hash, width)):
+        cover_hash = await make_thumbnails(book.cover_image_url)
+        if not cover_hash:
+            raise HTTPException(status_code=500, detail="No se pudo generar la miniatura.")
+        await async_crud.set_cover_hash(db, book_id, cover_hash)
+    else:
+        cover_hash = book.cover_hash
+    return RedirectResponse(f"/thumbnails/{thumbnails.thumbnail_filename(cover_hash, width)}", status_code=307)
+
+# --- Lectura de PDFs por páginas ---
+PAGE_CACHE_HEADERS = {"Cache-Control": "public, max-age=86400"}
+
+async def get_pdf_path(db: AsyncSession, book_id: int) -> str:
+    book = await async_crud.get_book(db, book_id=book_id)
+    if not book:
+        raise HTTPException(status_code=404, detail="Libro no encontrado.")
+    if not book.file_path.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="El libro no es un PDF.")
+    if not os.path.exists(book.file_path):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado en el disco.")
+    return book.file_path
+
+@app.get("/books/{book_id}/pages", response_model=schemas.PdfPages)
+async def get_book_pages(book_id: int, db: AsyncSession = Depends(get_read_db)):
+    """Número de páginas de un PDF, para que el lector pida solo las que muestra."""
+    path = await get_pdf_path(db, book_id)
+    page_count = await pdf_pages.renderer.page_count(path)
+    return schemas.PdfPages(page_count=page_count, widths=list(pdf_pages.PAGE_WIDTHS))
+
+@app.get("/books/{book_id}/pages/{page_number}")
+async def get_book_page(book_id: int, page_number: int, request: Request, width: int = 960, format: str = "jpeg",
+                        db: AsyncSession = Depends(get_read_db)):
+    """Renderiza una página del PDF como imagen sin descargar el archivo completo."""
+    if format not in pdf_pages.PAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato no válido. Opciones: {', '.join(pdf_pages.PAGE_FORMATS)}.")
+    path = await get_pdf_path(db, book_id)
+    width = thumbnails.closest_width(width, pdf_pages.PAGE_WIDTHS)
+    etag = file_etag(path, page_number, width, format)
+    headers = {**PAGE_CACHE_HEADERS, "ETag": etag}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    try:
+        image = await pdf_pages.renderer.render(path, page_number, width, format)
+    except IndexError:
+        raise HTTPException(status_code=404, detail="Página no encontrada.")
+    return Response(content=image, media_type=pdf_pages.PAGE_FORMATS[format], headers=headers)
+
+# --- Lectura de EPUBs por capítulos ---
+EPUB_CACHE_HEADERS = {"Cache-Control": "public, max-age=86400"}
+# Los capítulos y recursos vienen de archivos subidos por el usuario: nada de scripts aunque se abran directamente
+EPUB_CONTENT_SECURITY_POLICY = "default-src 'self' data:; script-src 'none'; object-src 'none'; style-src 'self' 'unsafe-inline'"
+
+async def get_epub_manifest(db: AsyncSession, book_id: int) -> tuple[str, dict]:
+    book = await async_crud.get_book(db, book_id=book_id)
+    if not book:
+        raise HTTPException(status_code=404, detail="Libro no encontrado.")
+    if not book.file_path.lower().endswith(".epub"):
+        raise HTTPException(status_code=400, detail="El libro no es un EPUB.")
+    if not os.path.exists(book.file_path):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado en el disco.")
+    try:
+        manifest = await workers.run_io_bound(epub_reader.manifests.get, book.file_path)
+    except (ValueError, KeyError, zipfile.BadZipFile) as e:
+        raise HTTPException(status_code=422, detail=f"No se pudo leer el EPUB: {e}")
+    return book.file_path, manifest
+
+@app.get("/books/{book_id}/epub", response_model=schemas.EpubContents)
+async def get_epub_contents(book_id: int, db: AsyncSession = Depends(get_read_db)):
+    """Capítulos en orden de lectura e índice del EPUB, sin descargar el archivo."""
+    _, manifest = await get_epub_manifest(db, book_id)
+    chapters = [
+        schemas.EpubChapter(index=i, title=manifest["chapter_titles"].get(i), url=f"/books/{book_id}/epub/chapters/{i}")
+        for i in range(len(manifest["spine"]))
+    ]
+    return schemas.EpubContents(title=manifest["title"], chapters=chapters, toc=manifest["toc"])
+
+@app.get("/books/{book_id}/epub/chapters/{index}")
+async def get_epub_chapter(book_id: int, index: int, request: Request, db: AsyncSession = Depends(get_read_db)):
+    """Un capítulo como HTML saneado; sus imágenes, estilos y enlaces apuntan a esta API."""
+    path, manifest = await get_epub_manifest(db, book_id)
+    etag = file_etag(path, "chapter", index)
+    headers = {**EPUB_CACHE_HEADERS, "ETag": etag, "Content-Security-Policy": EPUB_CONTENT_SECURITY_POLICY}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    try:
+        html = await workers.run_io_bound(epub_reader.render_chapter, path, manifest, index, f"/books/{book_id}/epub")
+    except IndexError:
+        raise HTTPException(status_code=404, detail="Capítulo no encontrado.")
+    return Response(content=html, media_type="text/html", headers=headers)
+
+@app.get("/books/{book_id}/epub/assets/{asset_path:path}")
+async def get_epub_asset(book_id: int, asset_path: str, request: Request, db: AsyncSession = Depends(get_read_db)):
+    """Sirve una imagen, hoja de estilos o fuente del manifiesto leyéndola directamente del zip."""
+    path, manifest = await get_epub_manifest(db, book_id)
+    try:
+        media_type = epub_reader.asset_media_type(manifest, asset_path)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Recurso no encontrado.")
+    etag = file_etag(path, "asset", asset_path)
+    headers = {**EPUB_CACHE_HEADERS, "ETag": etag, "Content-Security-Policy": EPUB_CONTENT_SECURITY_POLICY,
+               "X-Content-Type-Options": "nosniff"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    headers["Content-Length"] = str(await workers.run_io_bound(epub_reader.asset_size, path, asset_path))
+    return StreamingResponse(epub_reader.iter_asset(path, asset_path), media_type=media_type, headers=headers)
 
 @app.get("/books/download/{book_id}")
-def download_book(book_id: int, db: Session = Depends(get_db)):
-    book = db.query(models.Book).filter(models.Book.id == book_id).first()
+async def download_book(book_id: int, db: AsyncSession = Depends(get_read_db)):
+    """Sirve el archivo; FileResponse atiende Range e If-Range (206), así los visores piden solo los bytes que necesitan."""
+    book = await async_crud.get_book(db, book_id=book_id)
     if not book:
         raise HTTPException(status_code=404, detail="Libro no encontrado.")
     if not os.path.exists(book.file_path):
@@ -249,168 +737,90 @@ def download_book(book_id: int, db: Session = Depends(get_db)):
             content_disposition_type='attachment'
         )
 
-@app.post("/books/{book_id}/send-to-kindle")
-def send_book_to_kindle(book_id: int, db: Session = Depends(get_db)):
-    # 1. Get all configuration from environment variables
-    kindle_email = os.getenv("KINDLE_EMAIL")
-    sender_email = os.getenv("SENDER_EMAIL")
-    sender_password = os.getenv("SENDER_PASSWORD")
-    smtp_server = os.getenv("SMTP_SERVER")
-    smtp_port = os.getenv("SMTP_PORT")
-
-    if not all([kindle_email, sender_email, sender_password, smtp_server, smtp_port]):
-        raise HTTPException(
-            status_code=500, 
-            detail="La configuración para el envío de email está incompleta en el archivo .env"
-        )
+# --- Envío a Kindle ---
+kindle_queue = mail_queue.MailQueue(db_path=os.getenv("MAIL_QUEUE_PATH", "../mail_queue.db"))
+
+@app.on_event("startup")
+async def start_kindle_queue():
+    kindle_queue.start()
 
-    # 2. Get book details from the database
-    book = crud.get_book(db, book_id=book_id)
+@app.on_event("shutdown")
+async def stop_kindle_queue():
+    await kindle_queue.stop()
+
+@app.post("/books/{book_id}/send-to-kindle", response_model=schemas.KindleJob, status_code=202)
+async def send_book_to_kindle(book_id: int, db: AsyncSession = Depends(get_read_db)):
+    """Encola el envío del libro a Kindle; el correo sale en segundo plano y se consulta con el job_id."""
+    book = await async_crud.get_book(db, book_id=book_id)
     if not book:
         raise HTTPException(status_code=404, detail="Libro no encontrado.")
-    
-    # 3. Check if the book file exists and is an EPUB
+
     if not book.file_path or not os.path.exists(book.file_path):
         raise HTTPException(status_code=404, detail="El archivo del libro no se encuentra en el servidor.")
-        
+
     file_ext = os.path.splitext(book.file_path)[1].lower()
     if file_ext != ".epub":
         raise HTTPException(status_code=400, detail="La función 'Enviar a Kindle' solo está disponible para archivos EPUB.")
 
-    # 4. Construct and send the email
     try:
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = kindle_email
-        msg['Subject'] = f"Conversión de libro: {book.title}"
-        
-        # Kindle services do not require a body, but it's good practice
-        body = f"Adjunto encontrarás el libro '{book.title}'."
-        msg.attach(MIMEText(body, 'plain'))
-
-        # Attach the file
-        filename = os.path.basename(book.file_path)
-        with open(book.file_path, "rb") as attachment:
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(attachment.read())
-        
-        encoders.encode_base64(part)
-        part.add_header(
-            'Content-Disposition',
-            f"attachment; filename= {filename}",
-        )
-        msg.attach(part)
-
-        # Connect and send
-        server = smtplib.SMTP_SSL(smtp_server, int(smtp_port))
-        server.login(sender_email, sender_password)
-        server.send_message(msg)
-        server.quit()
-
-        return {"message": f"El libro '{book.title}' ha sido enviado a tu Kindle. Puede tardar unos minutos en aparecer."}
-    except smtplib.SMTPAuthenticationError:
-        raise HTTPException(status_code=500, detail="Error de autenticación SMTP. Revisa tu SENDER_EMAIL y SENDER_PASSWORD (¿contraseña de aplicación?).")
-    except Exception as e:
-        print(f"Error al enviar a Kindle: {e}")
-        raise HTTPException(status_code=500, detail=f"Error al enviar el libro a Kindle: {str(e)}")
+        return await kindle_queue.submit(book.id, book.title, book.file_path)
+    except mail_queue.MailConfigError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/send-to-kindle/{job_id}", response_model=schemas.KindleJob)
+async def get_kindle_job(job_id: str):
+    """Estado de un envío a Kindle: queued, sending, sent o failed (con el error)."""
+    job = await kindle_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Envío no encontrado.")
+    return job
 
 @app.post("/tools/convert-epub-to-pdf", response_model=schemas.ConversionResponse)
-async def convert_epub_to_pdf(file: UploadFile = File(...)):
+async def convert_epub_to_pdf(file: UploadFile | None = File(None), upload_id: str | None = None):
 
-    if not file.filename.lower().endswith('.epub'):
+    if not upload_filename(file, upload_id).lower().endswith('.epub'):
         raise HTTPException(status_code=400, detail="El archivo debe ser un EPUB.")
 
-    epub_content = await file.read()
+    epub_path = os.path.join(STATIC_TEMP_DIR, f"{uuid.uuid4()}.epub")
+
+    async def render(output_path: str):
+        # Los capítulos se renderizan con WeasyPrint en paralelo en el pool de procesos
+        await processing.render_epub_to_pdf(epub_path, output_path)
 
     try:
-        import tempfile
-        import zipfile
-        import pathlib
-        from weasyprint import HTML, CSS
-        from bs4 import BeautifulSoup
-        import uuid
-
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # 1. Extraer el EPUB a una carpeta temporal
-            with zipfile.ZipFile(io.BytesIO(epub_content), 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-
-            # 2. Encontrar el archivo .opf (el "manifiesto" del libro)
-            opf_path = next(pathlib.Path(temp_dir).rglob('*.opf'), None)
-            if not opf_path:
-                raise Exception("No se pudo encontrar el archivo .opf en el EPUB.")
-            content_root = opf_path.parent
-
-            # 3. Leer y analizar el manifiesto .opf en modo binario para autodetectar codificación
-            with open(opf_path, 'rb') as f:
-                opf_soup = BeautifulSoup(f, 'lxml-xml')
-
-            # 4. Crear una página de portada si se encuentra
-            html_docs = []
-            cover_meta = opf_soup.find('meta', {'name': 'cover'})
-            if cover_meta:
-                cover_id = cover_meta.get('content')
-                cover_item = opf_soup.find('item', {'id': cover_id})
-                if cover_item:
-                    cover_href = cover_item.get('href')
-                    cover_path = content_root / cover_href
-                    if cover_path.exists():
-                        cover_html_string = f"<html><body style='text-align: center; margin: 0; padding: 0;'><img src='{cover_path.as_uri()}' style='width: 100%; height: 100%; object-fit: contain;'/></body></html>"
-                        html_docs.append(HTML(string=cover_html_string))
-
-            # 5. Encontrar y leer todos los archivos CSS
-            stylesheets = []
-            css_items = opf_soup.find_all('item', {'media-type': 'text/css'})
-            for css_item in css_items:
-                css_href = css_item.get('href')
-                if css_href:
-                    css_path = content_root / css_href
-                    if css_path.exists():
-                        stylesheets.append(CSS(filename=css_path))
-
-            # 6. Encontrar el orden de lectura (spine) y añadir los capítulos
-            spine_ids = [item.get('idref') for item in opf_soup.find('spine').find_all('itemref')]
-            html_paths_map = {item['id']: item['href'] for item in opf_soup.find_all('item', {'media-type': 'application/xhtml+xml'})}
-            
-            for chapter_id in spine_ids:
-                href = html_paths_map.get(chapter_id)
-                if href:
-                    chapter_path = content_root / href
-                    if chapter_path.exists():
-                        # LA SOLUCIÓN: Pasar filename y encoding directamente a WeasyPrint
-                        html_docs.append(HTML(filename=chapter_path, encoding='utf-8'))
-
-            if not html_docs:
-                raise Exception("No se encontró contenido HTML en el EPUB.")
-
-            # 7. Renderizar y unir todos los documentos
-            first_doc = html_docs[0].render(stylesheets= stylesheets)
-            all_pages = [p for doc in html_docs[1:] for p in doc.render(stylesheets= stylesheets).pages]
-            
-            pdf_bytes_io = io.BytesIO()
-            first_doc.copy(all_pages).write_pdf(target=pdf_bytes_io)
-            pdf_bytes = pdf_bytes_io.getvalue()
-
-        # Guardar el PDF en la carpeta temporal pública
-        pdf_filename = f"{uuid.uuid4()}.pdf"
-        public_pdf_path = os.path.join(STATIC_TEMP_DIR, pdf_filename)
-        with open(public_pdf_path, "wb") as f:
-            f.write(pdf_bytes)
-        
+        epub_hash = await receive_upload(file, upload_id, epub_path)
+        # Un EPUB ya convertido con los mismos ajustes se sirve directamente desde la caché
+        pdf_filename, cached = await conversion_cache.get_or_convert(epub_hash, render)
+        if not cached:
+            await workers.run_io_bound(conversion_cache.evict)
+
         # Devolver la URL de descarga en un JSON
-        return {"download_url": f"/temp_books/{pdf_filename}"}
+        return {"download_url": f"/temp_books/{pdf_filename}", "cached": cached}
+    except HTTPException:
+        raise
     except Exception as e:
         error_message = f"Error durante la conversión: {type(e).__name__}: {e}"
-        print(error_message)
+        metrics.log_event("convert_epub_to_pdf.error", logging.ERROR, error=error_message)
         raise HTTPException(status_code=500, detail=error_message)
+    finally:
+        if os.path.exists(epub_path):
+            os.remove(epub_path)
+
+@app.get("/tools/convert-epub-to-pdf/stats")
+def get_conversion_cache_stats():
+    """Aciertos, fallos y expulsiones de la caché de conversiones."""
+    return conversion_cache.stats()
 
 @app.post("/rag/upload-book/", response_model=schemas.RagUploadResponse)
-async def upload_book_for_rag(file: UploadFile = File(...)):
-    book_id = str(uuid.uuid4())
-    file_location = os.path.join(STATIC_TEMP_DIR, f"{book_id}_{file.filename}")
-    with open(file_location, "wb") as f:
-        f.write(await file.read())
-    
+async def upload_book_for_rag(file: UploadFile | None = File(None), upload_id: str | None = None):
+    # El ID del libro es el hash de su contenido: un libro ya indexado se reutiliza
+    # desde el almacén persistente sin volver a generar los embeddings.
+    filename = os.path.basename(upload_filename(file, upload_id))
+    upload_location = os.path.join(STATIC_TEMP_DIR, f"{uuid.uuid4()}_{filename}")
+    book_id = await receive_upload(file, upload_id, upload_location)
+    file_location = os.path.join(STATIC_TEMP_DIR, f"{book_id}_{filename}")
+    os.replace(upload_location, file_location)
+
     try:
         await rag.process_book_for_rag(file_location, book_id)
         return {"book_id": book_id, "message": "Libro procesado para RAG exitosamente."}
@@ -423,91 +833,33 @@ async def query_rag_endpoint(query_data: schemas.RagQuery):
     try:
         response_text = await rag.query_rag(query_data.query, query_data.book_id)
         return {"response": response_text}
+    except rag.MixedIndexError as e:
+        raise HTTPException(status_code=409, detail=f"El índice del libro no corresponde al modelo de embeddings actual. {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al consultar RAG: {e}")
-    if not file.filename.lower().endswith('.epub'):
-        raise HTTPException(status_code=400, detail="El archivo debe ser un EPUB.")
-
-    epub_content = await file.read()
 
-    try:
-        import tempfile
-        import zipfile
-        import pathlib
-        from weasyprint import HTML, CSS
-        from bs4 import BeautifulSoup
-        import uuid
-
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # 1. Extraer el EPUB a una carpeta temporal
-            with zipfile.ZipFile(io.BytesIO(epub_content), 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-
-            # 2. Encontrar el archivo .opf (el "manifiesto" del libro)
-            opf_path = next(pathlib.Path(temp_dir).rglob('*.opf'), None)
-            if not opf_path:
-                raise Exception("No se pudo encontrar el archivo .opf en el EPUB.")
-            content_root = opf_path.parent
-
-            # 3. Leer y analizar el manifiesto .opf en modo binario para autodetectar codificación
-            with open(opf_path, 'rb') as f:
-                opf_soup = BeautifulSoup(f, 'lxml-xml')
-
-            # 4. Crear una página de portada si se encuentra
-            html_docs = []
-            cover_meta = opf_soup.find('meta', {'name': 'cover'})
-            if cover_meta:
-                cover_id = cover_meta.get('content')
-                cover_item = opf_soup.find('item', {'id': cover_id})
-                if cover_item:
-                    cover_href = cover_item.get('href')
-                    cover_path = content_root / cover_href
-                    if cover_path.exists():
-                        cover_html_string = f"<html><body style='text-align: center; margin: 0; padding: 0;'><img src='{cover_path.as_uri()}' style='width: 100%; height: 100%; object-fit: contain;'/></body></html>"
-                        html_docs.append(HTML(string=cover_html_string))
-
-            # 5. Encontrar y leer todos los archivos CSS
-            stylesheets = []
-            css_items = opf_soup.find_all('item', {'media-type': 'text/css'})
-            for css_item in css_items:
-                css_href = css_item.get('href')
-                if css_href:
-                    css_path = content_root / css_href
-                    if css_path.exists():
-                        stylesheets.append(CSS(filename=css_path))
-
-            # 6. Encontrar el orden de lectura (spine) y añadir los capítulos
-            spine_ids = [item.get('idref') for item in opf_soup.find('spine').find_all('itemref')]
-            html_paths_map = {item['id']: item['href'] for item in opf_soup.find_all('item', {'media-type': 'application/xhtml+xml'})}
-            
-            for chapter_id in spine_ids:
-                href = html_paths_map.get(chapter_id)
-                if href:
-                    chapter_path = content_root / href
-                    if chapter_path.exists():
-                        # LA SOLUCIÓN: Pasar filename y encoding directamente a WeasyPrint
-                        html_docs.append(HTML(filename=chapter_path, encoding='utf-8'))
-
-            if not html_docs:
-                raise Exception("No se encontró contenido HTML en el EPUB.")
-
-            # 7. Renderizar y unir todos los documentos
-            first_doc = html_docs[0].render(stylesheets= stylesheets)
-            all_pages = [p for doc in html_docs[1:] for p in doc.render(stylesheets= stylesheets).pages]
-            
-            pdf_bytes_io = io.BytesIO()
-            first_doc.copy(all_pages).write_pdf(target=pdf_bytes_io)
-            pdf_bytes = pdf_bytes_io.getvalue()
-
-        # Guardar el PDF en la carpeta temporal pública
-        pdf_filename = f"{uuid.uuid4()}.pdf"
-        public_pdf_path = os.path.join(STATIC_TEMP_DIR, pdf_filename)
-        with open(public_pdf_path, "wb") as f:
-            f.write(pdf_bytes)
-        
-        # Devolver la URL de descarga en un JSON
-        return {"download_url": f"/temp_books/{pdf_filename}"}
-    except Exception as e:
-        error_message = f"Error durante la conversión: {type(e).__name__}: {e}"
-        print(error_message)
-        raise HTTPException(status_code=500, detail=error_message)
+@app.post("/rag/query/stream/")
+async def query_rag_stream_endpoint(query_data: schemas.RagQuery):
+    """Igual que /rag/query/, pero envía la respuesta a medida que se genera (NDJSON, una línea por fragmento)."""
+    async def event_stream():
+        try:
+            async for text in rag.stream_query_rag(query_data.query, query_data.book_id):
+                yield schemas.RagStreamEvent(delta=text).model_dump_json(exclude_defaults=True) + "\n"
+            yield schemas.RagStreamEvent(done=True).model_dump_json(exclude_defaults=True) + "\n"
+        except Exception as e:
+            yield schemas.RagStreamEvent(error=f"Error al consultar RAG: {e}").model_dump_json(exclude_defaults=True) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+# --- Métricas ---
+metrics.register_cache("ai_metadata", metadata_cache.stats)
+metrics.register_cache("epub_pdf_conversion", conversion_cache.stats)
+metrics.register_cache("pdf_pages", pdf_pages.renderer.stats)
+metrics.register_cache("epub_manifests", epub_reader.manifests.stats)
+metrics.register_queue("ingest", lambda: ingest_queue.queued)
+metrics.register_queue("kindle", lambda: kindle_queue.stats()["pending"])
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Métricas en el formato de texto de Prometheus."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,184 @@
+"""Métricas en formato Prometheus y logs estructurados.
+
+Histogramas de duración por etapa del pipeline, por ruta HTTP y por llamada al modelo, contadores
+de llamadas al modelo y aciertos/fallos de las cachés, registrados en el registro por defecto de
+prometheus_client y expuestos en /metrics. Cada petición (y cada trabajo en segundo plano) escribe una línea JSON en
+el log con sus etapas y lo que ha tardado cada una.
+
+Las métricas viven en memoria de cada proceso: con varios workers de uvicorn cada uno expone las suyas.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import time
+from typing import Callable
+
+from prometheus_client import CONTENT_TYPE_LATEST as CONTENT_TYPE, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# --- Logs estructurados ---
+logger = logging.getLogger("libreria")
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro: hora, nivel, evento y los campos pasados con log_event."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def configure_logging(level: str = "INFO"):
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    logger.handlers = [handler]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    logger.log(level, event, extra={"fields": fields})
+
+# --- Métricas de la aplicación ---
+STAGE_SECONDS = Histogram("libreria_stage_duration_seconds", "Duración de cada etapa del pipeline.", ("stage",),
+                          buckets=DEFAULT_BUCKETS)
+REQUEST_SECONDS = Histogram("libreria_http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta.",
+                            ("method", "route", "status"), buckets=DEFAULT_BUCKETS)
+MODEL_CALLS = Counter("libreria_model_calls", "Llamadas a los modelos de IA.", ("model", "operation", "outcome"))
+MODEL_SECONDS = Histogram("libreria_model_call_duration_seconds", "Latencia de las llamadas a los modelos de IA.",
+                          ("model", "operation"), buckets=DEFAULT_BUCKETS)
+
+_caches: dict[str, Callable[[], dict]] = {}
+_queues: dict[str, Callable[[], int]] = {}
+
+def register_cache(name: str, stats: Callable[[], dict]):
+    """Exporta los aciertos y fallos de una caché; `stats()` devuelve un dict con hits y misses."""
+    _caches[name] = stats
+
+def register_queue(name: str, depth: Callable[[], int]):
+    _queues[name] = depth
+
+class StatsCollector:
+    """Valores leídos en el momento de exportar: los contadores que ya lleva cada caché y la profundidad de las colas."""
+    def collect(self):
+        hits = CounterMetricFamily("libreria_cache_hits", "Aciertos de cada caché.", labels=("cache",))
+        misses = CounterMetricFamily("libreria_cache_misses", "Fallos de cada caché.", labels=("cache",))
+        ratio = GaugeMetricFamily("libreria_cache_hit_ratio", "Proporción de aciertos de cada caché desde el arranque.",
+                                  labels=("cache",))
+        for name, stats in _caches.items():
+            current = stats()
+            lookups = current["hits"] + current["misses"]
+            hits.add_metric((name,), current["hits"])
+            misses.add_metric((name,), current["misses"])
+            ratio.add_metric((name,), current["hits"] / lookups if lookups else 0.0)
+        depth = GaugeMetricFamily("libreria_queue_depth", "Trabajos pendientes en cada cola.", labels=("queue",))
+        for name, queue_depth in _queues.items():
+            depth.add_metric((name,), queue_depth())
+        return [hits, misses, ratio, depth]
+
+REGISTRY.register(StatsCollector())
+
+def render() -> bytes:
+    """Todas las métricas registradas en el formato de texto de Prometheus (ver CONTENT_TYPE)."""
+    return generate_latest(REGISTRY)
+
+# --- Etapas ---
+# Etapas de la petición o trabajo en curso (nombre -> ms acumulados), para su línea de log
+_current_stages: contextvars.ContextVar[dict | None] = contextvars.ContextVar("current_stages", default=None)
+
+def _record(name: str, elapsed: float):
+    STAGE_SECONDS.labels(stage=name).observe(elapsed)
+    stages = _current_stages.get()
+    if stages is not None:
+        stages[name] = round(stages.get(name, 0.0) + elapsed * 1000, 1)
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Mide un bloque como etapa `name`. Si se repite (p. ej. por lotes), en el log se suma."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+@contextlib.contextmanager
+def model_call(model: str, operation: str):
+    """Mide una llamada a un modelo y la cuenta como ok o error."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        MODEL_CALLS.labels(model=model, operation=operation, outcome=outcome).inc()
+        MODEL_SECONDS.labels(model=model, operation=operation).observe(elapsed)
+        _record(f"model.{operation}", elapsed)
+
+@contextlib.contextmanager
+def tracked(event: str, **fields):
+    """Recoge las etapas medidas dentro del bloque y al terminar escribe una línea de log con ellas.
+
+    Devuelve el dict de campos del log, para añadir datos que solo se conocen al final.
+    """
+    stages: dict[str, float] = {}
+    token = _current_stages.set(stages)
+    start = time.perf_counter()
+    try:
+        yield fields
+    except Exception as e:
+        fields.setdefault("error", f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_stages.reset(token)
+        log_event(event, duration_ms=round((time.perf_counter() - start) * 1000, 1), stages=stages, **fields)
+
+# --- Middleware ASGI ---
+def _route_label(scope: dict, root_path: str) -> str:
+    """Plantilla de la ruta que atendió la petición (el router la deja en el scope)."""
+    route = scope.get("route")
+    if getattr(route, "path", None):
+        return route.path
+    if scope.get("root_path", "") != root_path: # Montaje de archivos estáticos
+        return scope["root_path"][len(root_path):] + "/{path}"
+    return "sin_ruta" # 404 sin ruta: no se etiqueta con la URL para no crear series sin límite
+
+class MetricsMiddleware:
+    """Mide cada petición HTTP hasta el último byte de la respuesta (incluidas las de streaming)
+    y escribe su línea de log. La ruta se etiqueta con su plantilla (/books/{book_id}), no con la URL."""
+    def __init__(self, app, skip_log_paths: tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.skip_log_paths = skip_log_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stages: dict[str, float] = {}
+        token = _current_stages.set(stages)
+        root_path = scope.get("root_path", "")
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current_stages.reset(token)
+            elapsed = time.perf_counter() - start
+            route_path = _route_label(scope, root_path)
+            REQUEST_SECONDS.labels(method=scope["method"], route=route_path, status=str(status)).observe(elapsed)
+            if scope["path"] not in self.skip_log_paths:
+                log_event("request", method=scope["method"], route=route_path, path=scope["path"], status=status,
+                          duration_ms=round(elapsed * 1000, 1), stages=stages)
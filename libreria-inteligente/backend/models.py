@@ -1,5 +1,6 @@
 from sqlalchemy import Column, Integer, String, Float, Boolean
 from database import Base
+import thumbnails
 
 class Book(Base):
     __tablename__ = "books"
@@ -14,3 +15,10 @@ class Book(Base):
     description = Column(String, nullable=True)
     rating = Column(Float, nullable=True)
     is_read = Column(Boolean, default=False, nullable=False)
+    file_hash = Column(String, unique=True, index=True, nullable=True) # SHA-256 del contenido del archivo
+    cover_hash = Column(String, nullable=True) # Hash de la portada; da nombre a sus miniaturas
+
+    @property
+    def cover_thumbnails(self) -> dict[str, str] | None:
+        """URLs de las miniaturas de la portada por ancho, si ya se han generado."""
+        return thumbnails.thumbnail_urls(self.cover_hash) if self.cover_hash else None
@@ -0,0 +1,118 @@
+"""Renderizado de páginas sueltas de los PDFs de la biblioteca, para el lector.
+
+Renderizar es CPU-bound y retiene el GIL, así que se hace en el pool de renderizado de workers
+(separado del de ingesta y conversiones, para que abrir una página no espere detrás de ellas): cada proceso
+mantiene abiertos sus últimos documentos usados (abrir un PDF grande cuesta más que renderizar una
+página) y atiende una tarea a la vez, así que no necesita locks. El servidor guarda un LRU en
+memoria de páginas ya renderizadas, limitado por tamaño en bytes. Las claves incluyen la fecha de
+modificación del archivo, así que un PDF reemplazado no sirve páginas antiguas.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import fitz
+
+import workers
+
+PAGE_WIDTHS = (480, 960, 1440, 1920)
+PAGE_FORMATS = {"jpeg": "image/jpeg", "png": "image/png"}
+PAGE_JPEG_QUALITY = 80
+MAX_OPEN_DOCUMENTS = int(os.getenv("PDF_MAX_OPEN_DOCUMENTS", "8")) # Por proceso del pool de renderizado
+PAGE_CACHE_BYTES = int(os.getenv("PDF_PAGE_CACHE_MB", "128")) * 1024 * 1024
+
+# --- En los procesos del pool ---
+_documents: OrderedDict[str, tuple[float, fitz.Document]] = OrderedDict()
+
+def _open(path: str) -> fitz.Document:
+    """Documento abierto desde la caché del proceso; se reabre si el archivo ha cambiado en disco."""
+    cached = _documents.get(path)
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        if cached:
+            del _documents[path]
+            cached[1].close()
+        raise
+    if cached and cached[0] == mtime:
+        _documents.move_to_end(path)
+        return cached[1]
+    if cached:
+        cached[1].close()
+    doc = fitz.open(path)
+    _documents[path] = (mtime, doc)
+    while len(_documents) > MAX_OPEN_DOCUMENTS:
+        _, (_, old_doc) = _documents.popitem(last=False)
+        old_doc.close()
+    return doc
+
+def page_count(path: str) -> int:
+    return len(_open(path))
+
+def render_page(path: str, page_number: int, width: int, image_format: str = "jpeg") -> bytes:
+    """Imagen de la página `page_number` (empezando en 1) escalada a `width` píxeles de ancho.
+
+    Lanza IndexError si la página no existe y FileNotFoundError si el archivo no está.
+    """
+    doc = _open(path)
+    if not 1 <= page_number <= len(doc):
+        raise IndexError(page_number)
+    page = doc.load_page(page_number - 1)
+    zoom = width / page.rect.width
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return pix.tobytes("jpeg", jpg_quality=PAGE_JPEG_QUALITY) if image_format == "jpeg" else pix.tobytes("png")
+
+# --- En el servidor ---
+class PageRenderer:
+    def __init__(self, max_cache_bytes: int):
+        self.max_cache_bytes = max_cache_bytes
+        self.hits = 0
+        self.misses = 0
+        self._pages: OrderedDict[tuple, bytes] = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock() # Solo protege el LRU; forget se llama desde el pool de hilos
+
+    async def page_count(self, path: str) -> int:
+        return await workers.run_render(page_count, path)
+
+    async def render(self, path: str, page_number: int, width: int, image_format: str = "jpeg") -> bytes:
+        """Página renderizada desde el LRU o, si no está, en el pool de renderizado (ver render_page)."""
+        key = (path, os.stat(path).st_mtime, page_number, width, image_format)
+        with self._lock:
+            if key in self._pages:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return self._pages[key]
+            self.misses += 1
+        data = await workers.run_render(render_page, path, page_number, width, image_format)
+        with self._lock:
+            self._remember(key, data)
+        return data
+
+    def _remember(self, key: tuple, data: bytes):
+        if len(data) > self.max_cache_bytes or key in self._pages:
+            return
+        self._pages[key] = data
+        self._cache_bytes += len(data)
+        while self._cache_bytes > self.max_cache_bytes:
+            _, old = self._pages.popitem(last=False)
+            self._cache_bytes -= len(old)
+
+    def forget(self, path: str):
+        """Descarta las páginas de un libro (p. ej. al borrarlo). Los procesos del pool cierran el
+        documento al ver que el archivo ya no está, o al expulsarlo de su caché."""
+        with self._lock:
+            for key in [key for key in self._pages if key[0] == path]:
+                self._cache_bytes -= len(self._pages.pop(key))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "cached_pages": len(self._pages),
+            "cached_bytes": self._cache_bytes,
+        }
+
+renderer = PageRenderer(PAGE_CACHE_BYTES)
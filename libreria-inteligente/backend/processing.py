@@ -0,0 +1,211 @@
+"""Extracción de texto y portadas, y conversión de EPUB a PDF.
+
+Estas funciones son CPU-bound y se ejecutan en el pool de procesos (ver workers.py),
+por lo que deben ser funciones de módulo que reciben y devuelven datos serializables.
+La excepción es render_epub_to_pdf, que es asíncrona y reparte los capítulos por ese pool.
+"""
+import asyncio
+import os
+import pathlib
+import shutil
+import tempfile
+import zipfile
+import fitz
+import ebooklib
+from ebooklib import epub
+from bs4 import BeautifulSoup
+
+import metrics, workers
+
+# Selección de portada en PDF: solo se miran las primeras páginas y se usan las dimensiones
+# que indica el xref de cada imagen, sin decodificarla; si no hay ninguna grande, se renderiza la página 0
+COVER_SCAN_PAGES = 3
+COVER_MIN_SIZE = 300
+COVER_RENDER_DPI = 100
+
+def find_pdf_cover_image(doc: fitz.Document) -> tuple[int, str] | None:
+    """Devuelve (xref, filtro) de la imagen más grande de las primeras páginas que supere el tamaño mínimo."""
+    best, best_area = None, 0
+    for i in range(min(len(doc), COVER_SCAN_PAGES)):
+        for img in doc.get_page_images(i):
+            xref, width, height, image_filter = img[0], img[2], img[3], img[8]
+            if width > COVER_MIN_SIZE and height > COVER_MIN_SIZE and width * height > best_area:
+                best, best_area = (xref, image_filter), width * height
+        if best:
+            break
+    return best
+
+def save_pdf_cover(doc: fitz.Document, file_path: str, static_dir: str) -> str | None:
+    """Guarda la portada del PDF en static_dir y devuelve su ruta."""
+    if len(doc) == 0:
+        return None
+    cover_base = os.path.join(static_dir, f"cover_{os.path.basename(file_path)}")
+    cover_image = find_pdf_cover_image(doc)
+    if cover_image:
+        xref, image_filter = cover_image
+        if image_filter == "DCTDecode":
+            # Es un JPEG: se copian sus bytes tal cual, sin decodificar ni recomprimir
+            cover_full_path = f"{cover_base}.jpg"
+            with open(cover_full_path, "wb") as f: f.write(doc.xref_stream_raw(xref))
+            return f"{static_dir}/{os.path.basename(cover_full_path)}"
+        pix = fitz.Pixmap(doc, xref)
+        if pix.n - pix.alpha >= 4: # CMYK u otros espacios de color: convertir a RGB
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+    else:
+        pix = doc.load_page(0).get_pixmap(dpi=COVER_RENDER_DPI)
+    cover_full_path = f"{cover_base}.png"
+    pix.save(cover_full_path)
+    return f"{static_dir}/{os.path.basename(cover_full_path)}"
+
+def process_pdf(file_path: str, static_dir: str) -> dict:
+    with fitz.open(file_path) as doc:
+        text = ""
+        for i in range(min(len(doc), 5)): text += doc.load_page(i).get_text("text", sort=True)
+        cover_path = save_pdf_cover(doc, file_path, static_dir)
+    return {"text": text, "cover_image_url": cover_path}
+
+def process_epub(file_path: str, static_dir: str) -> dict:
+    """ Lógica de procesamiento de EPUB muy mejorada con fallbacks para la portada. """
+    book = epub.read_epub(file_path)
+    text = ""
+    for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
+        soup = BeautifulSoup(item.get_content(), 'html.parser')
+        text += soup.get_text(separator=' ') + "\n"
+        if len(text) > 4500: break
+
+    if len(text.strip()) < 100:
+        raise ValueError("No se pudo extraer suficiente texto del EPUB para su análisis.")
+
+    cover_path = None
+    cover_item = None
+
+    # Intento 1: Buscar la portada oficial en metadatos
+    cover_items = list(book.get_items_of_type(ebooklib.ITEM_COVER))
+    if cover_items:
+        cover_item = cover_items[0]
+
+    # Intento 2: Si no hay portada oficial, buscar por nombre de archivo "cover"
+    if not cover_item:
+        for item in book.get_items_of_type(ebooklib.ITEM_IMAGE):
+            if 'cover' in item.get_name().lower():
+                cover_item = item
+                break
+
+    # Si encontramos una portada por cualquiera de los métodos
+    if cover_item:
+        cover_filename = f"cover_{os.path.basename(file_path)}_{cover_item.get_name()}".replace('/', '_').replace('\\', '_')
+        cover_full_path = os.path.join(static_dir, cover_filename)
+        with open(cover_full_path, 'wb') as f: f.write(cover_item.get_content())
+        cover_path = f"{static_dir}/{cover_filename}"
+
+    return {"text": text, "cover_image_url": cover_path}
+
+# Subir al cambiar cómo se genera el PDF: invalida los PDFs ya guardados en la caché de conversiones
+EPUB_PDF_RENDERER_VERSION = "2"
+# Capítulos de una misma conversión renderizándose o en cola en el pool de procesos a la vez
+EPUB_PDF_MAX_CONCURRENT_CHAPTERS = int(os.getenv("EPUB_PDF_MAX_CONCURRENT_CHAPTERS", str(workers.CPU_WORKERS)))
+
+def prepare_epub_for_pdf(epub_path: str, work_dir: str) -> tuple[list[str], list[str]]:
+    """Extrae el EPUB en work_dir y devuelve (documentos HTML en orden de lectura, hojas de estilo).
+
+    Si el EPUB declara portada, el primer documento es una página HTML generada con la imagen.
+    """
+    content_dir = pathlib.Path(work_dir) / "epub"
+
+    # 1. Extraer el EPUB a la carpeta de trabajo
+    with zipfile.ZipFile(epub_path, 'r') as zip_ref:
+        zip_ref.extractall(content_dir)
+
+    # 2. Encontrar el archivo .opf (el "manifiesto" del libro)
+    opf_path = next(content_dir.rglob('*.opf'), None)
+    if not opf_path:
+        raise ValueError("No se pudo encontrar el archivo .opf en el EPUB.")
+    content_root = opf_path.parent
+
+    # 3. Leer y analizar el manifiesto .opf en modo binario para autodetectar codificación
+    with open(opf_path, 'rb') as f:
+        opf_soup = BeautifulSoup(f, 'lxml-xml')
+
+    # 4. Crear una página de portada si se encuentra
+    html_paths = []
+    cover_meta = opf_soup.find('meta', {'name': 'cover'})
+    if cover_meta:
+        cover_item = opf_soup.find('item', {'id': cover_meta.get('content')})
+        if cover_item and cover_item.get('href'):
+            cover_path = content_root / cover_item.get('href')
+            if cover_path.exists():
+                cover_html_path = pathlib.Path(work_dir) / "cover.html"
+                cover_html_path.write_text(f"<html><body style='text-align: center; margin: 0; padding: 0;'><img src='{cover_path.as_uri()}' style='width: 100%; height: 100%; object-fit: contain;'/></body></html>", encoding='utf-8')
+                html_paths.append(str(cover_html_path))
+
+    # 5. Encontrar todos los archivos CSS
+    stylesheet_paths = []
+    for css_item in opf_soup.find_all('item', {'media-type': 'text/css'}):
+        css_href = css_item.get('href')
+        if css_href and (content_root / css_href).exists():
+            stylesheet_paths.append(str(content_root / css_href))
+
+    # 6. Encontrar el orden de lectura (spine) y añadir los capítulos
+    spine = opf_soup.find('spine')
+    spine_ids = [item.get('idref') for item in spine.find_all('itemref')] if spine else []
+    html_paths_map = {item['id']: item['href'] for item in opf_soup.find_all('item', {'media-type': 'application/xhtml+xml'})}
+    for chapter_id in spine_ids:
+        href = html_paths_map.get(chapter_id)
+        if href and (content_root / href).exists():
+            html_paths.append(str(content_root / href))
+
+    if not html_paths:
+        raise ValueError("No se encontró contenido HTML en el EPUB.")
+    return html_paths, stylesheet_paths
+
+def render_html_to_pdf(html_path: str, stylesheet_paths: list[str], output_path: str):
+    """Renderiza un único documento HTML (un capítulo) a PDF con WeasyPrint."""
+    from weasyprint import HTML, CSS
+
+    stylesheets = [CSS(filename=path) for path in stylesheet_paths]
+    HTML(filename=html_path, encoding='utf-8').write_pdf(output_path, stylesheets=stylesheets)
+
+def merge_pdfs(part_paths: list[str], output_path: str):
+    """Une los PDFs en orden abriendo uno cada vez: en memoria solo queda el PDF resultante, no las páginas maquetadas."""
+    merged = fitz.open()
+    try:
+        for path in part_paths:
+            with fitz.open(path) as part:
+                merged.insert_pdf(part)
+        merged.save(output_path, garbage=3, deflate=True)
+    finally:
+        merged.close()
+
+async def render_epub_to_pdf(epub_path: str, output_path: str):
+    """Convierte un EPUB a PDF renderizando los capítulos en paralelo en el pool de procesos.
+
+    Cada capítulo se escribe como un PDF aparte en una carpeta temporal y al final se unen con
+    PyMuPDF. Como mucho EPUB_PDF_MAX_CONCURRENT_CHAPTERS capítulos se envían al pool a la vez,
+    para no acaparar los procesos que comparten las ingestas.
+    """
+    work_dir = tempfile.mkdtemp(prefix="epub_pdf_")
+    try:
+        with metrics.stage("convert.prepare"):
+            html_paths, stylesheet_paths = await workers.run_cpu_bound(prepare_epub_for_pdf, epub_path, work_dir)
+        semaphore = asyncio.Semaphore(EPUB_PDF_MAX_CONCURRENT_CHAPTERS)
+
+        async def render_chapter(index: int, html_path: str) -> str:
+            part_path = os.path.join(work_dir, f"part_{index:05d}.pdf")
+            async with semaphore:
+                await workers.run_cpu_bound(render_html_to_pdf, html_path, stylesheet_paths, part_path)
+            return part_path
+
+        tasks = [asyncio.ensure_future(render_chapter(i, path)) for i, path in enumerate(html_paths)]
+        try:
+            with metrics.stage("convert.chapters"):
+                part_paths = await asyncio.gather(*tasks)
+        except BaseException:
+            # Si falla un capítulo no tiene sentido seguir con los que aún esperan turno
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        with metrics.stage("convert.merge"):
+            await workers.run_cpu_bound(merge_pdfs, part_paths, output_path)
+    finally:
+        await workers.run_io_bound(shutil.rmtree, work_dir, ignore_errors=True)
@@ -1,4 +1,11 @@
 import os
+import re
+import asyncio
+import logging
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Iterable, Iterator
 import google.generativeai as genai
 from dotenv import load_dotenv
 import chromadb
@@ -7,6 +14,7 @@ import ebooklib
 from ebooklib import epub
 from bs4 import BeautifulSoup
 import tiktoken
+import embeddings, metrics, workers
 
 # Load environment variables
 load_dotenv()
@@ -16,118 +24,335 @@ if not API_KEY:
 genai.configure(api_key=API_KEY)
 
 # --- Lazy Initialization for ChromaDB ---
+# The vector store lives on disk (or on a shared Chroma server when CHROMA_HOST is set),
+# so embeddings survive restarts and every uvicorn worker sees the same index.
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "../chroma_db")
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+COLLECTION_NAME = "book_rag_collection"
+# Vectors written before the model was stored with each vector all came from this one
+LEGACY_EMBEDDING_KEY = "gemini:models/text-embedding-004"
+
 client = None
 collection = None
+_chroma_lock = threading.Lock()
+
+class MixedIndexError(ValueError):
+    """The book was indexed with a different embedding model than the configured one."""
+
+def collection_name(embedding_key: str) -> str:
+    """One collection per embedding model: their vectors cannot be compared (or even share a dimension).
+
+    The original Gemini model keeps the original collection, so existing indexes stay valid.
+    """
+    if embedding_key == LEGACY_EMBEDDING_KEY:
+        return COLLECTION_NAME
+    return f"{COLLECTION_NAME}__{re.sub(r'[^a-zA-Z0-9_-]+', '-', embedding_key).strip('-_')}"
 
 def initialize_chroma():
     """Initializes the ChromaDB client and collection on first use."""
     global client, collection
-    if client is None:
-        print("Initializing ChromaDB for the first time. This might take a while...")
-        client = chromadb.Client()
-        collection = client.get_or_create_collection(name="book_rag_collection")
-        print("ChromaDB client initialized successfully.")
+    if collection is not None:
+        return
+    with _chroma_lock:
+        if collection is None:
+            metrics.log_event("chroma.initializing", host=CHROMA_HOST, path=None if CHROMA_HOST else CHROMA_DB_PATH)
+            if CHROMA_HOST:
+                client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+            else:
+                client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+            name = collection_name(embeddings.get_provider().key)
+            collection = client.get_or_create_collection(name=name)
+            metrics.log_event("chroma.initialized", collection=name)
+
+def vector_model(metadata: dict | None) -> str:
+    """Embedding model key stored with a vector."""
+    return (metadata or {}).get("embedding_model", LEGACY_EMBEDDING_KEY)
+
+def is_book_indexed(book_id: str) -> bool:
+    """Returns True if the vector store holds a complete index of this book, embedded with the configured model.
+
+    An index is complete once its first chunk carries the `index_complete` marker, which is only
+    written after every batch has been stored. Chunks embedded with another model are deleted so
+    the book is indexed again.
+    """
+    initialize_chroma()
+    existing = collection.get(where={"$and": [{"book_id": book_id}, {"index_complete": True}]}, limit=1, include=["metadatas"])
+    if not existing["ids"]:
+        return False
+    current = embeddings.get_provider().key
+    if vector_model(existing["metadatas"][0]) != current:
+        metrics.log_event("rag.mixed_index", logging.WARNING, book_id=book_id,
+                          indexed_with=vector_model(existing["metadatas"][0]), provider=current)
+        collection.delete(where={"book_id": book_id})
+        return False
+    return True
+
+def models_indexing_book(book_id: str) -> list[str]:
+    """Embedding models of the other collections that hold chunks for this book."""
+    initialize_chroma()
+    found = []
+    for other in client.list_collections():
+        name = other if isinstance(other, str) else other.name
+        if name == collection.name or not name.startswith(COLLECTION_NAME):
+            continue
+        existing = client.get_collection(name).get(where={"book_id": book_id}, limit=1, include=["metadatas"])
+        if existing["ids"]:
+            found.append(vector_model(existing["metadatas"][0]))
+    return found
 # -----------------------------------------
 
-# Initialize Gemini embedding model
-EMBEDDING_MODEL = "models/text-embedding-004"
 GENERATION_MODEL = "models/gemini-1.5-flash"
+# Chunks are embedded in batches (one request per batch) with a bounded number of batches in flight
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+# Chunk size and overlap between consecutive chunks, in tokens
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "1000"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "100"))
+# Text without blank lines (PDFs usually break lines with a single newline) is cut at a sentence
+# once this many characters are pending, so a book never becomes one huge paragraph
+SEGMENT_MAX_CHARS = int(os.getenv("SEGMENT_MAX_CHARS", "16000"))
 
-def get_embedding(text: str, task_type: str = "RETRIEVAL_DOCUMENT"):
-    """Generates an embedding for the given text."""
-    if not text.strip():
-        return [] # Return empty list for empty text
-    return genai.embed_content(model=EMBEDDING_MODEL, content=text, task_type=task_type)[ "embedding"]
+async def get_embeddings_batch(texts: list[str], task_type: str = "RETRIEVAL_DOCUMENT") -> list[list[float]]:
+    """Generates embeddings for a batch of texts with the configured provider (see embeddings.py)."""
+    return await embeddings.get_provider().embed(texts, task_type=task_type)
 
-def extract_text_from_pdf(file_path: str) -> str:
-    """Extracts text from a PDF file."""
-    text = ""
+def iter_text_from_pdf(file_path: str) -> Iterator[str]:
+    """Yields the text of a PDF file page by page."""
     try:
         with open(file_path, "rb") as f:
             reader = PdfReader(f)
             for page in reader.pages:
-                text += page.extract_text() or ""
+                yield page.extract_text() or ""
     except Exception as e:
-        print(f"Error extracting text from PDF {file_path}: {e}")
-        return ""
-    return text
+        metrics.log_event("rag.extract_error", logging.WARNING, file_path=file_path, error=str(e))
 
-def extract_text_from_epub(file_path: str) -> str:
-    """Extracts text from an EPUB file."""
-    text_content = []
+def extract_text_from_pdf(file_path: str) -> str:
+    """Extracts text from a PDF file."""
+    return "".join(iter_text_from_pdf(file_path))
+
+def iter_text_from_epub(file_path: str) -> Iterator[str]:
+    """Yields the text of an EPUB file document by document."""
     try:
         book = ebooklib.epub.read_epub(file_path)
         for item in book.get_items():
             if item.get_type() == ebooklib.ITEM_DOCUMENT:
                 soup = BeautifulSoup(item.get_content(), 'html.parser')
-                text_content.append(soup.get_text())
+                yield soup.get_text() + "\n"
     except Exception as e:
-        print(f"Error extracting text from EPUB {file_path}: {e}")
-        return ""
-    return "\n".join(text_content)
+        metrics.log_event("rag.extract_error", logging.WARNING, file_path=file_path, error=str(e))
+
+def extract_text_from_epub(file_path: str) -> str:
+    """Extracts text from an EPUB file."""
+    return "".join(iter_text_from_epub(file_path))
+
+@lru_cache(maxsize=1)
+def get_tokenizer() -> tiktoken.Encoding:
+    """Returns the tokenizer used for token counting, built once per process."""
+    return tiktoken.encoding_for_model("gpt-3.5-turbo") # Using a common tokenizer for token counting
+
+# Paragraphs end at a blank line; sentences end at ., !, ? or … followed by whitespace
+PARAGRAPH_BOUNDARY = re.compile(r"\n\s*\n")
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+")
+
+def _fallback_cut(text: str, start: int, end: int) -> int:
+    """Position in text[start:end] to cut a segment that has no boundary: after the last sentence,
+    else after the last whitespace, else at end."""
+    last = None
+    for last in SENTENCE_BOUNDARY.finditer(text, start, end):
+        pass
+    if last is not None and last.end() > start:
+        return last.end()
+    space = max(text.rfind(" ", start, end), text.rfind("\n", start, end))
+    return space + 1 if space >= start else end
+
+def iter_segments(pieces: Iterable[str], boundary: re.Pattern, max_chars: int = SEGMENT_MAX_CHARS) -> Iterator[str]:
+    """Splits a stream of text pieces (pages, documents) at the given boundary.
+
+    Pieces are treated as contiguous text, so a paragraph that spans two pages is kept whole.
+    Text with no boundary is cut (at a sentence if possible) once it passes max_chars, so memory
+    stays bounded by the size of a page. Each segment keeps its trailing separator, so joining
+    them restores the text.
+    """
+    pending = ""
+    for piece in pieces:
+        pending += piece
+        start = 0
+        for match in boundary.finditer(pending):
+            if match.end() == len(pending):
+                break # The separator may continue in the next piece
+            yield pending[start:match.end()]
+            start = match.end()
+        while len(pending) - start > max_chars:
+            cut = _fallback_cut(pending, start, start + max_chars)
+            yield pending[start:cut]
+            start = cut
+        pending = pending[start:]
+    if pending:
+        yield pending
+
+def split_sentences(text: str) -> list[str]:
+    """Splits a paragraph into sentences."""
+    return list(iter_segments([text], SENTENCE_BOUNDARY))
+
+def _overlap_tail(window: deque[tuple[str, int]], limit: int, count_tokens: Callable[[str], int]) -> tuple[deque[tuple[str, int]], int]:
+    """Returns the trailing sentences of the window that fit in `limit` tokens."""
+    tail: deque[tuple[str, int]] = deque()
+    tail_tokens = 0
+    for text, n_tokens in reversed(window):
+        if tail_tokens + n_tokens > limit:
+            if not tail: # The last unit is a whole paragraph that is too long: keep its last sentences
+                for sentence in reversed(split_sentences(text)):
+                    n_sentence = count_tokens(sentence)
+                    if tail_tokens + n_sentence > limit:
+                        break
+                    tail.appendleft((sentence, n_sentence))
+                    tail_tokens += n_sentence
+            break
+        tail.appendleft((text, n_tokens))
+        tail_tokens += n_tokens
+    return tail, tail_tokens
+
+def iter_chunks(pieces: Iterable[str], max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+    """Groups text into chunks of at most max_tokens, cutting only at paragraph or sentence boundaries.
+
+    Whole paragraphs are added while they fit; a paragraph that does not fit is split into
+    sentences, so most text is tokenized only once. Consecutive chunks share up to
+    overlap_tokens of trailing sentences, and a sentence longer than max_tokens is split on
+    token boundaries. Only the current window is held in memory.
+    """
+    tokenizer = get_tokenizer()
+    count_tokens = lambda text: len(tokenizer.encode_ordinary(text))
+    window: deque[tuple[str, int]] = deque()
+    window_tokens = 0
+    has_new_text = False # False when the window only holds overlap already emitted
 
-def chunk_text(text: str, max_tokens: int = 1000) -> list[str]:
+    for paragraph in iter_segments(pieces, PARAGRAPH_BOUNDARY):
+        n_tokens = count_tokens(paragraph)
+        if window_tokens + n_tokens <= max_tokens:
+            units = [(paragraph, n_tokens)]
+        else:
+            units = [(sentence, count_tokens(sentence)) for sentence in split_sentences(paragraph)]
+
+        for unit, n_tokens in units:
+            if n_tokens > max_tokens:
+                if has_new_text:
+                    yield "".join(text for text, _ in window)
+                window.clear()
+                window_tokens = 0
+                has_new_text = False
+                tokens = tokenizer.encode_ordinary(unit)
+                for i in range(0, len(tokens), max_tokens):
+                    yield tokenizer.decode(tokens[i:i + max_tokens])
+                continue
+
+            if window_tokens + n_tokens > max_tokens:
+                if has_new_text:
+                    yield "".join(text for text, _ in window)
+                    has_new_text = False
+                window, window_tokens = _overlap_tail(window, min(overlap_tokens, max_tokens - n_tokens), count_tokens)
+            window.append((unit, n_tokens))
+            window_tokens += n_tokens
+            has_new_text = True
+
+    if has_new_text:
+        yield "".join(text for text, _ in window)
+
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list[str]:
     """Chunks text into smaller pieces based on token count."""
     if not text.strip():
         return []
-    tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo") # Using a common tokenizer for token counting
-    tokens = tokenizer.encode(text)
-    chunks = []
-    current_chunk_tokens = []
-    for token in tokens:
-        current_chunk_tokens.append(token)
-        if len(current_chunk_tokens) >= max_tokens:
-            chunks.append(tokenizer.decode(current_chunk_tokens))
-            current_chunk_tokens = []
-    if current_chunk_tokens:
-        chunks.append(tokenizer.decode(current_chunk_tokens))
-    return chunks
+    return [chunk for chunk in iter_chunks([text], max_tokens, overlap_tokens) if chunk.strip()]
 
-async def process_book_for_rag(file_path: str, book_id: str):
-    """Extracts text, chunks it, generates embeddings, and stores in ChromaDB."""
-    initialize_chroma() # Lazy initialization
+def chunk_book(file_path: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list[str]:
+    """Extracts and chunks a book page by page, without building the full text in memory."""
     if file_path.lower().endswith(".pdf"):
-        text = extract_text_from_pdf(file_path)
+        pieces = iter_text_from_pdf(file_path)
     elif file_path.lower().endswith(".epub"):
-        text = extract_text_from_epub(file_path)
+        pieces = iter_text_from_epub(file_path)
     else:
         raise ValueError("Unsupported file type. Only PDF and EPUB are supported.")
+    return [chunk for chunk in iter_chunks(pieces, max_tokens, overlap_tokens) if chunk.strip()]
 
-    if not text.strip():
+async def process_book_for_rag(file_path: str, book_id: str):
+    """Extracts text, chunks it, generates embeddings, and stores in ChromaDB."""
+    if await workers.run_io_bound(is_book_indexed, book_id):
+        metrics.log_event("rag.already_indexed", book_id=book_id)
+        return
+    # Extraction and chunking are CPU-bound, so they run in the process pool
+    with metrics.stage("rag.extract_chunk"):
+        chunks = await workers.run_cpu_bound(chunk_book, file_path)
+    if not chunks:
         raise ValueError("Could not extract text from the book.")
+    # Leftovers of an interrupted run (no completion marker) would mix with the new chunks
+    await workers.run_io_bound(collection.delete, where={"book_id": book_id})
 
-    chunks = chunk_text(text)
-    if not chunks:
-        raise ValueError("Could not chunk text from the book.")
-
-    for i, chunk in enumerate(chunks):
-        embedding = get_embedding(chunk) # No await here
-        if embedding: # Only add if embedding is not empty
-            collection.add(
-                embeddings=[embedding],
-                documents=[chunk],
-                metadatas=[{"book_id": book_id, "chunk_index": i}],
-                ids=[f"{book_id}_chunk_{i}"]
-            )
-    print(f"Processed {len(chunks)} chunks for book ID: {book_id}")
+    indexed_chunks = list(enumerate(chunks))
+    batches = [indexed_chunks[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(indexed_chunks), EMBEDDING_BATCH_SIZE)]
+    semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+    embedding_key = embeddings.get_provider().key
 
-async def query_rag(query: str, book_id: str):
-    """Queries the RAG system for answers based on the book content."""
-    initialize_chroma() # Lazy initialization
-    query_embedding = get_embedding(query, task_type="RETRIEVAL_QUERY") # No await here
-    if not query_embedding:
-        return "I cannot process an empty query."
+    async def embed_and_store(batch: list[tuple[int, str]]):
+        async with semaphore:
+            vectors = await get_embeddings_batch([chunk for _, chunk in batch])
+        with metrics.stage("rag.store"):
+            await workers.run_io_bound(
+                collection.upsert,
+                embeddings=vectors,
+                documents=[chunk for _, chunk in batch],
+                metadatas=[{"book_id": book_id, "chunk_index": i, "embedding_model": embedding_key} for i, _ in batch],
+                ids=[f"{book_id}_chunk_{i}" for i, _ in batch]
+            )
 
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=5, # Retrieve top 5 relevant chunks
-        where={"book_id": book_id}
+    tasks = [asyncio.ensure_future(embed_and_store(batch)) for batch in batches]
+    try:
+        with metrics.stage("rag.embed_store"):
+            await asyncio.gather(*tasks)
+    except BaseException:
+        # A failed batch leaves a partial index: stop the rest and remove what was stored
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await workers.run_io_bound(collection.delete, where={"book_id": book_id})
+        raise
+    # Only now is the index complete; is_book_indexed looks for this marker
+    await workers.run_io_bound(
+        collection.update,
+        ids=[f"{book_id}_chunk_0"],
+        metadatas=[{"book_id": book_id, "chunk_index": 0, "embedding_model": embedding_key,
+                    "index_complete": True, "chunk_count": len(chunks)}],
     )
+    metrics.log_event("rag.indexed", book_id=book_id, chunks=len(chunks), batches=len(batches), embedding_model=embedding_key)
+
+async def build_rag_prompt(query: str, book_id: str) -> str:
+    """Retrieves the most relevant chunks for the query and builds the generation prompt."""
+    await workers.run_io_bound(initialize_chroma) # Lazy initialization
+    query_embedding = (await get_embeddings_batch([query], task_type="RETRIEVAL_QUERY"))[0]
+
+    with metrics.stage("rag.retrieve"):
+        results = await workers.run_io_bound(
+            collection.query,
+            query_embeddings=[query_embedding],
+            n_results=5, # Retrieve top 5 relevant chunks
+            where={"book_id": book_id},
+            include=["documents", "metadatas"],
+        )
+
+    current = embeddings.get_provider().key
+    if not results["ids"][0]:
+        other_models = await workers.run_io_bound(models_indexing_book, book_id)
+        if other_models:
+            raise MixedIndexError(f"Book {book_id} was indexed with {', '.join(other_models)}, but the embedding "
+                                  f"provider is now {current}. Upload the book again to index it with {current}.")
+    stale = {vector_model(metadata) for metadata in results["metadatas"][0]} - {current}
+    if stale:
+        raise MixedIndexError(f"The index for book {book_id} mixes {', '.join(sorted(stale))} with {current}. "
+                              "Upload the book again to re-index it.")
 
     relevant_chunks = [doc for doc in results['documents'][0]]
     context = "\n\n".join(relevant_chunks)
 
-    prompt = f"""Eres un asistente útil que responde preguntas.
+    return f"""Eres un asistente útil que responde preguntas.
 Prioriza la información del Contexto proporcionado para responder a la pregunta.
 Si la información en el Contexto no es suficiente para responder la pregunta, utiliza tus conocimientos generales.
 Responde siempre en español.
@@ -138,6 +363,36 @@ Contexto:
 Pregunta: {query}
 Respuesta:"""
 
+async def generate_stream(prompt: str) -> AsyncIterator[str]:
+    """Streams the Gemini completion for the prompt as partial text chunks."""
+    model = genai.GenerativeModel(GENERATION_MODEL)
+    # Measured until the last chunk arrives, so the latency covers the whole answer
+    with metrics.model_call(GENERATION_MODEL, "generate"):
+        response = await model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+async def query_rag(query: str, book_id: str):
+    """Queries the RAG system for answers based on the book content."""
+    if not query.strip():
+        return "I cannot process an empty query."
+    prompt = await build_rag_prompt(query, book_id)
+
     model = genai.GenerativeModel(GENERATION_MODEL)
-    response = model.generate_content(prompt) # No await here
+    with metrics.model_call(GENERATION_MODEL, "generate"):
+        response = await model.generate_content_async(prompt)
     return response.text
+
+async def stream_query_rag(query: str, book_id: str, generate: Callable[[str], AsyncIterator[str]] | None = None) -> AsyncIterator[str]:
+    """Like query_rag, but yields the answer as it is generated.
+
+    `generate` turns a prompt into an async iterator of text chunks; it defaults to
+    generate_stream and can be replaced with a local fake generator.
+    """
+    if not query.strip():
+        yield "I cannot process an empty query."
+        return
+    prompt = await build_rag_prompt(query, book_id)
+    async for text in (generate or generate_stream)(prompt):
+        yield text
@@ -25,14 +25,83 @@ class BookUpdate(BaseModel):
     rating: Optional[float] = None
     is_read: Optional[bool] = None
 
+class BulkBooksSelection(BaseModel):
+    """Libros afectados por una operación en bloque: los ids indicados y/o los que cumplen los filtros."""
+    ids: list[int] | None = None
+    category: str | None = None
+    author: str | None = None
+    language: str | None = None
+
+class BulkUpdateRequest(BulkBooksSelection):
+    changes: BookUpdate
+
+class BulkResult(BaseModel):
+    count: int
+
 class Book(BookBase):
     id: int
+    cover_thumbnails: dict[str, str] | None = None
 
     class Config:
         from_attributes = True
 
+class FacetValue(BaseModel):
+    value: str
+    count: int
+
+class Facets(BaseModel):
+    """Categorías e idiomas de la biblioteca con el número de libros de cada uno."""
+    total: int
+    categories: list[FacetValue]
+    languages: list[FacetValue]
+
+class IngestJob(BaseModel):
+    """Estado de un libro subido a /upload-book/.
+
+    stage: queued -> extracting -> analyzing -> saving -> done | failed
+    """
+    job_id: str
+    filename: str
+    stage: str = "queued"
+    book: Book | None = None
+    error: str | None = None
+    error_code: int | None = None
+
+class KindleJob(BaseModel):
+    """Envío a Kindle encolado.
+
+    status: queued -> sending -> sent | failed; un error temporal vuelve a queued hasta agotar los intentos.
+    """
+    job_id: str
+    book_id: int
+    title: str
+    status: str
+    attempts: int = 0
+    error: str | None = None
+
+class PdfPages(BaseModel):
+    page_count: int
+    widths: list[int]
+
+class EpubChapter(BaseModel):
+    index: int
+    title: str | None = None
+    url: str
+
+class EpubTocEntry(BaseModel):
+    title: str
+    chapter: int
+    fragment: str | None = None
+    level: int = 0
+
+class EpubContents(BaseModel):
+    title: str | None = None
+    chapters: list[EpubChapter]
+    toc: list[EpubTocEntry]
+
 class ConversionResponse(BaseModel):
     download_url: str
+    cached: bool = False
 
 class RagUploadResponse(BaseModel):
     book_id: str
@@ -43,4 +112,43 @@ class RagQuery(BaseModel):
     book_id: str
 
 class RagQueryResponse(BaseModel):
-    response: str
\ No newline at end of file
+    response: str
+
+class RagStreamEvent(BaseModel):
+    """Una línea NDJSON de /rag/query/stream/: un fragmento de texto, el final o un error."""
+    delta: str | None = None
+    done: bool = False
+    error: str | None = None
+
+class LibraryImportRequest(BaseModel):
+    directory: str
+    ai_concurrency: int = 4
+    batch_size: int = 50
+
+class ImportSummary(BaseModel):
+    """Progreso y resultado de una importación masiva."""
+    job_id: str | None = None
+    found: int = 0
+    processed: int = 0
+    imported: int = 0
+    duplicates: int = 0
+    failed: int = 0
+    bytes_processed: int = 0
+    elapsed_seconds: float = 0.0
+    finished: bool = False
+    errors: list[str] = []
+
+class ChunkedUploadInit(BaseModel):
+    filename: str
+    size: int
+
+class ChunkedUploadFinalize(BaseModel):
+    sha256: str | None = None
+
+class ChunkedUploadStatus(BaseModel):
+    """Estado de una subida por partes; la siguiente parte debe empezar en `offset`."""
+    upload_id: str
+    filename: str
+    size: int
+    offset: int
+    sha256: str | None = None
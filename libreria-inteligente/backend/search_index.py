@@ -0,0 +1,92 @@
+"""Índice de búsqueda de texto completo (SQLite FTS5) sobre la tabla books.
+
+La tabla virtual books_fts usa el rowid del libro y se mantiene sincronizada con triggers,
+así que cualquier escritura en books (crud, importación masiva, actualizaciones en bloque) la actualiza.
+El tokenizador unicode61 con remove_diacritics ignora mayúsculas y acentos: "garcia" encuentra "García".
+La columna body es opcional y guarda el texto extraído del libro (ver SEARCH_INDEX_BODY_TEXT).
+"""
+import os
+import re
+from sqlalchemy import Column, Integer, MetaData, String, Table, bindparam, func, literal_column, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+FTS_TABLE = "books_fts"
+FTS_COLUMNS = ("title", "author", "category", "language", "description", "body")
+# Pesos de bm25 por columna, en el mismo orden que FTS_COLUMNS: un acierto en el título pesa más que en el texto
+FTS_COLUMN_WEIGHTS = (10.0, 8.0, 4.0, 1.0, 2.0, 1.0)
+# Indexar también el texto extraído al subir un libro (más coincidencias, más espacio en disco)
+INDEX_BODY_TEXT = os.getenv("SEARCH_INDEX_BODY_TEXT", "0") == "1"
+
+# Solo para construir consultas; la tabla se crea con CREATE_STATEMENTS, no con create_all
+books_fts = Table(
+    FTS_TABLE, MetaData(),
+    Column("rowid", Integer, primary_key=True),
+    *(Column(name, String) for name in FTS_COLUMNS),
+)
+
+CREATE_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, author, category, language, description, body,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, author, category, language, description)
+        VALUES (new.id, new.title, new.author, new.category, new.language, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, category, language, description ON books BEGIN
+        UPDATE {FTS_TABLE} SET title = new.title, author = new.author, category = new.category,
+            language = new.language, description = new.description
+        WHERE rowid = old.id;
+    END""",
+]
+
+BACKFILL_STATEMENT = f"""INSERT INTO {FTS_TABLE}(rowid, title, author, category, language, description)
+    SELECT id, title, author, category, language, description FROM books"""
+
+def ensure_search_index(engine: Engine):
+    """Crea el índice y sus triggers si no existen; si se acaba de crear, indexa los libros existentes."""
+    with engine.begin() as conn:
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+        ).first()
+        for statement in CREATE_STATEMENTS:
+            conn.exec_driver_sql(statement)
+        if not exists:
+            conn.exec_driver_sql(BACKFILL_STATEMENT)
+
+def match_expression(term: str, columns: tuple[str, ...] | None = None) -> str | None:
+    """Convierte lo que escribe el usuario en una consulta FTS5 segura.
+
+    Cada palabra se busca como prefijo y todas deben aparecer ("cien años" encuentra
+    "Cien años de soledad"). Devuelve None si el término no contiene ninguna palabra.
+    """
+    words = re.findall(r"\w+", term)
+    if not words:
+        return None
+    expression = " AND ".join(f'"{word}"*' for word in words)
+    if columns:
+        expression = f"{{{' '.join(columns)}}} : ({expression})"
+    return expression
+
+def ranked_matches(expression: str):
+    """Subconsulta (book_id, rank) de los libros que cumplen la expresión; menor rank = más relevante."""
+    rank = func.bm25(literal_column(FTS_TABLE), *FTS_COLUMN_WEIGHTS)
+    return (
+        select(books_fts.c.rowid.label("book_id"), rank.label("rank"))
+        .where(literal_column(FTS_TABLE).op("MATCH")(expression))
+        .subquery()
+    )
+
+def set_body_texts(db: Session, texts: dict[int, str]):
+    """Guarda el texto extraído de varios libros (book_id -> texto) en el índice; no se almacena en books."""
+    if not texts:
+        return
+    db.execute(
+        books_fts.update().where(books_fts.c.rowid == bindparam("book_id")).values(body=bindparam("text")),
+        [{"book_id": book_id, "text": text} for book_id, text in texts.items()],
+    )
+    db.commit()
@@ -0,0 +1,55 @@
+"""Miniaturas WebP de las portadas en varios tamaños fijos.
+
+Los nombres de archivo llevan el hash del contenido de la portada original, así que una URL
+nunca cambia de contenido y se puede servir con caché inmutable de larga duración.
+"""
+import hashlib
+import io
+import os
+from PIL import Image
+
+THUMBNAILS_DIR = "static/thumbnails"
+THUMBNAIL_WIDTHS = (160, 320, 640)
+THUMBNAIL_QUALITY = 80
+
+def thumbnail_filename(cover_hash: str, width: int) -> str:
+    return f"{cover_hash}_{width}.webp"
+
+def thumbnail_path(cover_hash: str, width: int) -> str:
+    return os.path.join(THUMBNAILS_DIR, thumbnail_filename(cover_hash, width))
+
+def thumbnail_urls(cover_hash: str) -> dict[str, str]:
+    """URLs públicas de las miniaturas de una portada, por ancho."""
+    return {str(width): f"/thumbnails/{thumbnail_filename(cover_hash, width)}" for width in THUMBNAIL_WIDTHS}
+
+def closest_width(width: int, widths: tuple[int, ...] = THUMBNAIL_WIDTHS) -> int:
+    """El menor ancho disponible que cubre el pedido (o el mayor si ninguno lo cubre)."""
+    return next((w for w in widths if w >= width), widths[-1])
+
+def generate_thumbnails(cover_path: str) -> str:
+    """Genera las miniaturas WebP de una portada (si no existen ya) y devuelve el hash de su contenido."""
+    with open(cover_path, "rb") as f:
+        data = f.read()
+    cover_hash = hashlib.sha256(data).hexdigest()[:16]
+    missing = [w for w in THUMBNAIL_WIDTHS if not os.path.exists(thumbnail_path(cover_hash, w))]
+    if not missing:
+        return cover_hash
+
+    os.makedirs(THUMBNAILS_DIR, exist_ok=True)
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        for width in missing:
+            thumb = image.copy()
+            thumb.thumbnail((width, width * 2), Image.LANCZOS) # Nunca amplía portadas pequeñas
+            path = thumbnail_path(cover_hash, width)
+            temp_path = f"{path}.tmp"
+            thumb.save(temp_path, "WEBP", quality=THUMBNAIL_QUALITY)
+            os.replace(temp_path, path) # Escritura atómica: una URL nunca sirve un archivo a medias
+    return cover_hash
+
+def remove_thumbnails(cover_hash: str):
+    """Elimina las miniaturas de una portada."""
+    for width in THUMBNAIL_WIDTHS:
+        path = thumbnail_path(cover_hash, width)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,76 @@
+"""Pools de ejecución para sacar el trabajo bloqueante del bucle de eventos de asyncio.
+
+- El trabajo CPU-bound (extracción con fitz/BeautifulSoup, renderizado con WeasyPrint,
+  troceado de texto) va a un pool de procesos.
+- El renderizado de páginas para el lector tiene su propio pool de procesos, pequeño, para que una
+  página no espere detrás de una ingesta o de una conversión EPUB -> PDF.
+- La E/S bloqueante (copias de ficheros, ChromaDB, SDKs síncronos) va a un pool de hilos.
+
+Los tamaños se configuran con CPU_WORKERS, RENDER_WORKERS e IO_WORKERS en el .env.
+"""
+import asyncio
+import contextvars
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 1)))
+IO_WORKERS = int(os.getenv("IO_WORKERS", "16"))
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+
+_process_pool: ProcessPoolExecutor | None = None
+_render_pool: ProcessPoolExecutor | None = None
+_thread_pool: ThreadPoolExecutor | None = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Crea el pool de procesos en el primer uso."""
+    global _process_pool
+    if _process_pool is None:
+        # "spawn" evita heredar hilos y conexiones abiertas del servidor al hacer fork
+        _process_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """Crea el pool de renderizado en el primer uso."""
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _render_pool
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """Crea el pool de hilos en el primer uso."""
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io-worker")
+    return _thread_pool
+
+async def run_cpu_bound(func, *args, **kwargs):
+    """Ejecuta func en el pool de procesos. func y sus argumentos deben ser serializables."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), partial(func, *args, **kwargs))
+
+async def run_render(func, *args, **kwargs):
+    """Como run_cpu_bound, en el pool de renderizado: para trabajo corto que espera una petición."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_render_pool(), partial(func, *args, **kwargs))
+
+async def run_io_bound(func, *args, **kwargs):
+    """Ejecuta func en el pool de hilos, con el contexto de la tarea (las etapas medidas dentro
+    se suman a la petición en curso)."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_thread_pool(), partial(context.run, func, *args, **kwargs))
+
+def shutdown():
+    """Cierra los pools; se llama al apagar la aplicación."""
+    global _process_pool, _render_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+    if _render_pool is not None:
+        _render_pool.shutdown(cancel_futures=True)
+        _render_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(cancel_futures=True)
+        _thread_pool = None
@@ -6,6 +6,7 @@ import UploadView from './UploadView';
 import CategoriesView from './CategoriesView';
 import ToolsView from './ToolsView';
 import ReaderView from './ReaderView';
+import PdfReaderView from './PdfReaderView';
 import RagView from './RagView';
 import './App.css';
 
@@ -22,6 +23,7 @@ function App() {
             <Route path="/herramientas" element={<ToolsView />} />
             <Route path="/rag" element={<RagView />} />
             <Route path="/leer/:bookId" element={<ReaderView />} />
+            <Route path="/leer-pdf/:bookId" element={<PdfReaderView />} />
           </Routes>
         </main>
       </div>
@@ -14,10 +14,10 @@ function CategoriesView() {
 // ... (resto del código)
 
       try {
-        const response = await fetch(`${API_URL}/categories/`);
+        const response = await fetch(`${API_URL}/facets/`);
         if (response.ok) {
-          const data = await response.json();
-          setCategories(data);
+          const facets = await response.json();
+          setCategories(facets.categories);
         } else {
           setError('No se pudieron cargar las categorías.');
         }
@@ -38,9 +38,9 @@ function CategoriesView() {
       {error && <p className="error-message">{error}</p>}
       {!loading && (
         <div className="categories-grid">
-          {categories.map((category) => (
+          {categories.map(({ value: category, count }) => (
             <Link to={`/?category=${encodeURIComponent(category)}`} key={category} className="category-card">
-              {category}
+              {category} <span className="category-count">({count})</span>
             </Link>
           ))}
         </div>
@@ -11,12 +11,13 @@ function Header() {
   useEffect(() => {
     const fetchBookCount = async () => {
       try {
-        const response = await fetch(`${API_URL}/books/count`);
+        // El navegador revalida /facets/ con su ETag: si no ha cambiado, el servidor responde 304 sin consultar la BD
+        const response = await fetch(`${API_URL}/facets/`);
         if (!response.ok) {
           throw new Error(`HTTP error! status: ${response.status}`);
         }
-        const count = await response.json();
-        setBookCount(count);
+        const facets = await response.json();
+        setBookCount(facets.total);
         setErrorMessage(null); // Clear any previous error
       } catch (error) {
         console.error("Error fetching book count:", error);
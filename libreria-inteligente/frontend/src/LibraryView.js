@@ -1,9 +1,11 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { useSearchParams, Link } from 'react-router-dom';
 import API_URL from './config';
 import './LibraryView.css';
 import EditBookModal from './EditBookModal'; 
 
+const PAGE_SIZE = 60; // Libros por página al desplazarse por la biblioteca
+
 // Hook personalizado para debounce
 const useDebounce = (value, delay) => {
   const [debouncedValue, setDebouncedValue] = useState(value);
@@ -18,8 +20,20 @@ const useDebounce = (value, delay) => {
   return debouncedValue;
 };
 
+// Miniaturas WebP de la portada; los libros antiguos las generan bajo demanda en el backend
+const coverSources = (book) => {
+  if (book.cover_thumbnails) {
+    const srcSet = Object.entries(book.cover_thumbnails).map(([width, url]) => `${API_URL}${url} ${width}w`).join(', ');
+    return { src: `${API_URL}${book.cover_thumbnails['320']}`, srcSet };
+  }
+  if (book.cover_image_url) {
+    return { src: `${API_URL}/books/${book.id}/thumbnail?width=320`, srcSet: undefined };
+  }
+  return { src: '', srcSet: undefined };
+};
+
 // Componente para la portada (con fallback a genérica)
-const BookCover = ({ src, alt, title }) => {
+const BookCover = ({ src, srcSet, alt, title }) => {
   const [hasError, setHasError] = useState(false);
   useEffect(() => { setHasError(false); }, [src]);
   const handleError = () => { setHasError(true); };
@@ -32,11 +46,15 @@ const BookCover = ({ src, alt, title }) => {
       </div>
     );
   }
-  return <img src={src} alt={alt} className="book-cover" onError={handleError} />;
+  return <img src={src} srcSet={srcSet} sizes="(max-width: 600px) 160px, 320px" alt={alt} className="book-cover" loading="lazy" decoding="async" onError={handleError} />;
 };
 
 function LibraryView() {
   const [books, setBooks] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [totalCount, setTotalCount] = useState(0);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const loadMoreRef = useRef(null);
   const [searchParams, setSearchParams] = useSearchParams();
   const [searchTerm, setSearchTerm] = useState('');
   const debouncedSearchTerm = useDebounce(searchTerm, 300);
@@ -51,10 +69,10 @@ function LibraryView() {
   useEffect(() => {
     const fetchLanguages = async () => {
       try {
-        const response = await fetch(`${API_URL}/languages/`);
+        const response = await fetch(`${API_URL}/facets/`);
         if (response.ok) {
-          const data = await response.json();
-          setLanguages(data);
+          const facets = await response.json();
+          setLanguages(facets.languages.map((facet) => facet.value));
         }
       } catch (error) {
         console.error("Error fetching languages:", error);
@@ -83,8 +101,13 @@ function LibraryView() {
     setSearchParams({ category: category });
   };
 
-  const fetchBooks = useCallback(async () => {
-    setLoading(true);
+  // Paginación por cursor: cada página trae X-Next-Cursor hasta llegar al final
+  const fetchBooks = useCallback(async (cursor = null) => {
+    if (cursor) {
+      setLoadingMore(true);
+    } else {
+      setLoading(true);
+    }
     setError('');
 
     const params = new URLSearchParams();
@@ -103,6 +126,10 @@ function LibraryView() {
     } else if (debouncedSearchTerm) {
       params.append('search', debouncedSearchTerm);
     }
+    params.append('limit', PAGE_SIZE);
+    if (cursor) {
+      params.append('cursor', cursor);
+    }
 
     const url = `${API_URL}/books/?${params.toString()}`;
 
@@ -110,7 +137,11 @@ function LibraryView() {
       const response = await fetch(url);
       if (response.ok) {
         const data = await response.json();
-        setBooks(data);
+        setBooks(prevBooks => (cursor ? [...prevBooks, ...data] : data));
+        setNextCursor(response.headers.get('X-Next-Cursor'));
+        if (!cursor) {
+          setTotalCount(Number(response.headers.get('X-Total-Count')) || data.length);
+        }
       } else {
         setError('No se pudieron cargar los libros.');
       }
@@ -118,9 +149,23 @@ function LibraryView() {
       setError('Error de conexión al cargar la biblioteca.');
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   }, [debouncedSearchTerm, searchParams]);
 
+  // Cargar la siguiente página cuando el final de la lista entra en pantalla
+  useEffect(() => {
+    const sentinel = loadMoreRef.current;
+    if (!sentinel || !nextCursor || loadingMore) return;
+    const observer = new IntersectionObserver((entries) => {
+      if (entries[0].isIntersecting) {
+        fetchBooks(nextCursor);
+      }
+    }, { rootMargin: '600px' });
+    observer.observe(sentinel);
+    return () => observer.disconnect();
+  }, [nextCursor, loadingMore, fetchBooks]);
+
   useEffect(() => {
     fetchBooks();
   }, [fetchBooks]);
@@ -131,6 +176,7 @@ function LibraryView() {
         const response = await fetch(`${API_URL}/books/${bookId}`, { method: 'DELETE' });
         if (response.ok) {
           setBooks(prevBooks => prevBooks.filter(b => b.id !== bookId));
+          setTotalCount(prevCount => Math.max(prevCount - 1, 0));
         } else {
           alert('No se pudo eliminar el libro.');
         }
@@ -151,11 +197,20 @@ function LibraryView() {
 
     try {
       const response = await fetch(`${API_URL}/books/${bookId}/send-to-kindle`, { method: 'POST' });
-      const result = await response.json();
-      if (response.ok) {
-        setKindleStatus(prev => ({ ...prev, [bookId]: '¡Enviado con éxito!' }));
+      let job = await response.json();
+      if (!response.ok) {
+        setKindleStatus(prev => ({ ...prev, [bookId]: `Error: ${job.detail}` }));
       } else {
-        setKindleStatus(prev => ({ ...prev, [bookId]: `Error: ${result.detail}` }));
+        // El correo sale desde una cola en el servidor: se consulta el estado hasta que termina
+        while (job.status === 'queued' || job.status === 'sending') {
+          await new Promise(resolve => setTimeout(resolve, 2000));
+          job = await (await fetch(`${API_URL}/send-to-kindle/${job.job_id}`)).json();
+        }
+        if (job.status === 'sent') {
+          setKindleStatus(prev => ({ ...prev, [bookId]: '¡Enviado con éxito!' }));
+        } else {
+          setKindleStatus(prev => ({ ...prev, [bookId]: `Error: ${job.error}` }));
+        }
       }
     } catch (err) {
       setKindleStatus(prev => ({ ...prev, [bookId]: 'Error de conexión.' }));
@@ -212,6 +267,7 @@ function LibraryView() {
       {error && <p className="error-message">{error}</p>}
       {loading && <p>Cargando libros...</p>}
       {!loading && books.length === 0 && !error && <p>No se encontraron libros que coincidan con tu búsqueda.</p>}
+      {!loading && books.length > 0 && <p className="books-count">Mostrando {books.length} de {totalCount} libros</p>}
 
       <div className="book-grid">
         {books.map((book) => (
@@ -225,7 +281,7 @@ function LibraryView() {
                 </div>
             </div>
             <BookCover
-              src={book.cover_image_url ? `${API_URL}/${book.cover_image_url}` : ''}
+              {...coverSources(book)}
               alt={`Portada de ${book.title}`}
               title={book.title}
             />
@@ -241,6 +297,7 @@ function LibraryView() {
                 <button onClick={() => handleEditClick(book)} className="card-action-button edit-book-button-bottom">Editar libro</button>
                 {book.file_path.toLowerCase().endsWith('.pdf') ? (
                   <>
+                    <Link to={`/leer-pdf/${book.id}`} className="card-action-button download-button">Leer PDF</Link>
                     <a
                       href={`${API_URL}/books/download/${book.id}`}
                       className="card-action-button download-button"
@@ -284,6 +341,9 @@ function LibraryView() {
         ))}
       </div>
 
+      {nextCursor && <div ref={loadMoreRef} className="load-more-sentinel" />}
+      {loadingMore && <p>Cargando más libros...</p>}
+
       {showEditModal && (
         <EditBookModal
           book={bookToEdit}
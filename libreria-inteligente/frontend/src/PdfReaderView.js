@@ -0,0 +1,72 @@
+import React, { useState, useEffect } from 'react';
+import { useParams } from 'react-router-dom';
+import API_URL from './config';
+import './ReaderView.css';
+
+// El servidor renderiza cada página a imagen: no hace falta descargar el PDF completo para empezar a leer
+function PdfReaderView() {
+  const { bookId } = useParams();
+  const [pageCount, setPageCount] = useState(0);
+  const [page, setPage] = useState(1);
+  const [error, setError] = useState('');
+  const width = Math.min(1920, Math.round(window.innerWidth * (window.devicePixelRatio || 1)));
+
+  const pageUrl = (number) => `${API_URL}/books/${bookId}/pages/${number}?width=${width}`;
+
+  useEffect(() => {
+    const fetchPages = async () => {
+      try {
+        const response = await fetch(`${API_URL}/books/${bookId}/pages`);
+        if (!response.ok) {
+          throw new Error('No se pudo obtener el libro desde el servidor.');
+        }
+        const data = await response.json();
+        setPageCount(data.page_count);
+      } catch (err) {
+        console.error("Error al obtener las páginas del PDF:", err);
+        setError("No se pudo cargar el libro.");
+      }
+    };
+    setPage(1);
+    fetchPages();
+  }, [bookId]);
+
+  useEffect(() => {
+    // Precarga la página siguiente para que pasar de página sea inmediato
+    if (page < pageCount) {
+      new Image().src = pageUrl(page + 1);
+    }
+  }, [page, pageCount]); // eslint-disable-line react-hooks/exhaustive-deps
+
+  useEffect(() => {
+    const handleKeyDown = (event) => {
+      if (event.key === 'ArrowRight') setPage((current) => Math.min(current + 1, pageCount));
+      if (event.key === 'ArrowLeft') setPage((current) => Math.max(current - 1, 1));
+    };
+    window.addEventListener('keydown', handleKeyDown);
+    return () => window.removeEventListener('keydown', handleKeyDown);
+  }, [pageCount]);
+
+  return (
+    <div className="reader-container">
+      <div className="reader-wrapper pdf-reader">
+        {error && <div className="loading-view">{error}</div>}
+        {!error && !pageCount && <div className="loading-view">Cargando Libro...</div>}
+        {!error && pageCount > 0 && (
+          <>
+            <div className="pdf-page">
+              <img src={pageUrl(page)} alt={`Página ${page}`} />
+            </div>
+            <div className="pdf-controls">
+              <button onClick={() => setPage(page - 1)} disabled={page <= 1}>Anterior</button>
+              <span>{page} / {pageCount}</span>
+              <button onClick={() => setPage(page + 1)} disabled={page >= pageCount}>Siguiente</button>
+            </div>
+          </>
+        )}
+      </div>
+    </div>
+  );
+}
+
+export default PdfReaderView;
@@ -76,7 +76,7 @@ function RagView() {
     setIsLoading(true);
 
     try {
-      const response = await fetch(`${API_URL}/rag/query/`, {
+      const response = await fetch(`${API_URL}/rag/query/stream/`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -85,8 +85,26 @@ function RagView() {
       });
 
       if (response.ok) {
-        const result = await response.json();
-        setChatHistory([...newChatHistory, { sender: 'gemini', text: result.response }]);
+        // La respuesta llega como NDJSON: una línea por fragmento de texto generado
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answer = '';
+        let done = false;
+        while (!done) {
+          const { value, done: streamDone } = await reader.read();
+          done = streamDone;
+          buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+          const lines = buffer.split('\n');
+          buffer = lines.pop();
+          for (const line of lines) {
+            if (!line.trim()) continue;
+            const event = JSON.parse(line);
+            if (event.delta) answer += event.delta;
+            if (event.error) answer = `Error: ${event.error}`;
+          }
+          setChatHistory([...newChatHistory, { sender: 'gemini', text: answer }]);
+        }
       } else {
         const result = await response.json();
         setChatHistory([...newChatHistory, { sender: 'gemini', text: `Error: ${result.detail || 'No se pudo obtener respuesta.'}` }]);
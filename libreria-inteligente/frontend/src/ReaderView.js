@@ -1,27 +1,64 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useParams } from 'react-router-dom';
 import { ReactReader } from 'react-reader';
 import API_URL from './config';
 import './ReaderView.css';
 
+const CHAPTER_LINK = /\/epub\/chapters\/(\d+)(#.*)?$/;
+
+// Los capítulos llegan del servidor uno a uno, ya saneados: se muestran en un iframe sin scripts.
+// Con srcDoc la cabecera Content-Security-Policy de la respuesta no llega al documento, así que la
+// política va en una etiqueta meta: solo se cargan recursos del propio libro (servidos por la API)
+const CHAPTER_CSP = `default-src ${API_URL} data:; script-src 'none'; object-src 'none'; style-src ${API_URL} 'unsafe-inline'`;
+
+function withBase(html) {
+  const head = `<meta http-equiv="Content-Security-Policy" content="${CHAPTER_CSP}"><base href="${API_URL}/">`;
+  return /<head(\s[^>]*)?>/i.test(html) ? html.replace(/<head(\s[^>]*)?>/i, `<head$1>${head}`) : head + html;
+}
+
 function ReaderView() {
   const { bookId } = useParams();
+  const [contents, setContents] = useState(null);
+  const [chapter, setChapter] = useState(0);
+  const [fragment, setFragment] = useState('');
+  const [chapterHtml, setChapterHtml] = useState('');
   const [location, setLocation] = useState(null);
   const [epubData, setEpubData] = useState(null);
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState('');
+  const iframeRef = useRef(null);
+  const chapterRef = useRef(chapter);
+  chapterRef.current = chapter;
 
   useEffect(() => {
-    const fetchBookData = async () => {
+    const fetchContents = async () => {
       setIsLoading(true);
       setError('');
+      setContents(null);
+      setEpubData(null);
+      try {
+        const response = await fetch(`${API_URL}/books/${bookId}/epub`);
+        if (!response.ok) {
+          throw new Error('No se pudo obtener el índice del libro.');
+        }
+        const data = await response.json();
+        const saved = Number(localStorage.getItem(`reader-chapter-${bookId}`)) || 0;
+        setChapter(Math.min(saved, data.chapters.length - 1));
+        setContents(data);
+      } catch (err) {
+        // Si el servidor no puede leer el EPUB por capítulos, se descarga completo como antes
+        console.error("Error al obtener el índice del EPUB:", err);
+        await fetchWholeBook();
+      }
+    };
+
+    const fetchWholeBook = async () => {
       try {
         const response = await fetch(`${API_URL}/books/download/${bookId}`);
         if (!response.ok) {
           throw new Error('No se pudo obtener el libro desde el servidor.');
         }
-        const data = await response.arrayBuffer();
-        setEpubData(data);
+        setEpubData(await response.arrayBuffer());
       } catch (err) {
         console.error("Error al obtener los datos del EPUB:", err);
         setError("No se pudo cargar el libro.");
@@ -30,14 +67,109 @@ function ReaderView() {
       }
     };
 
-    fetchBookData();
+    fetchContents();
   }, [bookId]);
 
+  useEffect(() => {
+    if (!contents) return;
+    const fetchChapter = async () => {
+      try {
+        const response = await fetch(`${API_URL}${contents.chapters[chapter].url}`);
+        if (!response.ok) {
+          throw new Error('No se pudo obtener el capítulo.');
+        }
+        setChapterHtml(withBase(await response.text()));
+        localStorage.setItem(`reader-chapter-${bookId}`, chapter);
+        // Precarga el siguiente capítulo en la caché del navegador
+        if (chapter + 1 < contents.chapters.length) {
+          fetch(`${API_URL}${contents.chapters[chapter + 1].url}`).catch(() => {});
+        }
+      } catch (err) {
+        console.error("Error al obtener el capítulo:", err);
+        setError("No se pudo cargar el capítulo.");
+      } finally {
+        setIsLoading(false);
+      }
+    };
+    fetchChapter();
+  }, [bookId, contents, chapter]);
+
+  // Desplaza el capítulo mostrado hasta el ancla `hash` (#id), o al principio si no hay ancla
+  const scrollToFragment = (hash) => {
+    const frame = iframeRef.current;
+    const doc = frame && frame.contentDocument;
+    if (!doc) return;
+    const id = hash ? decodeURIComponent(hash.slice(1)) : '';
+    const target = id && (doc.getElementById(id) || doc.getElementsByName(id)[0]);
+    if (target) target.scrollIntoView();
+    else if (!hash) frame.contentWindow.scrollTo(0, 0);
+  };
+
+  const goTo = (index, hash = '') => {
+    // En el mismo capítulo no hay recarga (ni onLoad): se desplaza directamente
+    if (index === chapterRef.current) {
+      scrollToFragment(hash);
+      return;
+    }
+    setFragment(hash);
+    setChapter(index);
+  };
+
+  const handleChapterLoad = () => {
+    const doc = iframeRef.current && iframeRef.current.contentDocument;
+    if (!doc) return;
+    // Los enlaces entre capítulos cambian de capítulo en el lector y las anclas (#nota) se resuelven
+    // dentro del capítulo, en lugar de navegar el iframe (con <base>, "#nota" apuntaría a la raíz de la API)
+    doc.addEventListener('click', (event) => {
+      const link = event.target.closest && event.target.closest('a[href]');
+      if (!link) return;
+      const href = link.getAttribute('href');
+      if (href.startsWith('#')) {
+        event.preventDefault();
+        scrollToFragment(href);
+        return;
+      }
+      const match = href.match(CHAPTER_LINK);
+      if (match) {
+        event.preventDefault();
+        goTo(Number(match[1]), match[2] || '');
+      }
+    });
+    if (fragment) scrollToFragment(fragment);
+  };
+
+  const entries = contents && (contents.toc.length ? contents.toc : contents.chapters.map((c) => ({ title: c.title || `Capítulo ${c.index + 1}`, chapter: c.index, level: 0 })));
+
   return (
     <div className="reader-container">
       <div className="reader-wrapper">
         {isLoading && <div className="loading-view">Cargando Libro...</div>}
         {error && <div className="loading-view">{error}</div>}
+        {!isLoading && !error && contents && (
+          <div className="chapter-reader">
+            <div className="chapter-controls">
+              <button onClick={() => goTo(chapter - 1)} disabled={chapter <= 0}>Anterior</button>
+              <select
+                value={entries.findIndex((entry) => entry.chapter === chapter)}
+                onChange={(e) => { const entry = entries[e.target.value]; goTo(entry.chapter, entry.fragment ? `#${entry.fragment}` : ''); }}
+              >
+                {entries.findIndex((entry) => entry.chapter === chapter) === -1 && <option value={-1}>Capítulo {chapter + 1}</option>}
+                {entries.map((entry, i) => (
+                  <option key={i} value={i}>{'  '.repeat(entry.level)}{entry.title}</option>
+                ))}
+              </select>
+              <button onClick={() => goTo(chapter + 1)} disabled={chapter >= contents.chapters.length - 1}>Siguiente</button>
+            </div>
+            <iframe
+              ref={iframeRef}
+              className="chapter-frame"
+              title={contents.title || 'Libro'}
+              sandbox="allow-same-origin allow-popups"
+              srcDoc={chapterHtml}
+              onLoad={handleChapterLoad}
+            />
+          </div>
+        )}
         {!isLoading && !error && epubData && (
           <ReactReader
             url={epubData}
@@ -54,4 +186,4 @@ function ReaderView() {
   );
 }
 
-export default ReaderView;
\ No newline at end of file
+export default ReaderView;
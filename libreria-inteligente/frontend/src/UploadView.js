@@ -1,8 +1,12 @@
 import React, { useState, useCallback } from 'react';
 import { useNavigate } from 'react-router-dom';
 import API_URL from './config';
+import { uploadInChunks } from './chunkedUpload';
 import './UploadView.css';
 
+// Los archivos grandes se suben por partes para poder reanudar la subida si se corta la conexión
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+
 function UploadView() {
   const [filesToUpload, setFilesToUpload] = useState([]);
   const [isUploading, setIsUploading] = useState(false);
@@ -46,33 +50,80 @@ function UploadView() {
     });
   };
 
+  const STAGE_MESSAGES = {
+    queued: 'En cola...',
+    extracting: 'Extrayendo texto y portada...',
+    analyzing: 'Analizando con IA...',
+    saving: 'Guardando...',
+  };
+
+  // El servidor procesa los libros en segundo plano: consultar el trabajo hasta que termine
+  const waitForJob = async (index, jobId) => {
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, 1500));
+      try {
+        const response = await fetch(`${API_URL}/upload-book/${jobId}`);
+        const job = await response.json();
+        if (!response.ok) {
+          updateFileStatus(index, 'error', `Error: ${job.detail || 'No se pudo procesar'}`);
+          return;
+        }
+        if (job.stage === 'done') {
+          updateFileStatus(index, 'success', `'${job.book.title}' añadido correctamente.`);
+          return;
+        }
+        if (job.stage === 'failed') {
+          updateFileStatus(index, 'error', `Error: ${job.error || 'No se pudo procesar'}`);
+          return;
+        }
+        updateFileStatus(index, 'uploading', STAGE_MESSAGES[job.stage] || 'Procesando...');
+      } catch (error) {
+        updateFileStatus(index, 'error', 'Error de conexión con el servidor.');
+        return;
+      }
+    }
+  };
+
   const handleUpload = async () => {
     if (filesToUpload.length === 0) return;
 
     setIsUploading(true);
+    const pendingJobs = [];
 
     for (let i = 0; i < filesToUpload.length; i++) {
       if (filesToUpload[i].status !== 'pending') continue;
 
-      updateFileStatus(i, 'uploading', 'Subiendo y analizando...');
-      const formData = new FormData();
-      formData.append('book_file', filesToUpload[i].file);
+      updateFileStatus(i, 'uploading', 'Subiendo...');
+      const file = filesToUpload[i].file;
 
       try {
-        const response = await fetch(`${API_URL}/upload-book/`, {
-          method: 'POST',
-          body: formData,
-        });
+        let response;
+        if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+          const uploadId = await uploadInChunks(file, (progress) => {
+            updateFileStatus(i, 'uploading', `Subiendo... ${Math.round(progress * 100)}%`);
+          });
+          response = await fetch(`${API_URL}/upload-book/?upload_id=${uploadId}`, { method: 'POST' });
+        } else {
+          const formData = new FormData();
+          formData.append('book_file', file);
+          response = await fetch(`${API_URL}/upload-book/`, {
+            method: 'POST',
+            body: formData,
+          });
+        }
         const result = await response.json();
         if (response.ok) {
-          updateFileStatus(i, 'success', `'${result.title}' añadido correctamente.`);
+          updateFileStatus(i, 'uploading', STAGE_MESSAGES[result.stage] || 'En cola...');
+          pendingJobs.push(waitForJob(i, result.job_id));
         } else {
           updateFileStatus(i, 'error', `Error: ${result.detail || 'No se pudo procesar'}`);
         }
       } catch (error) {
-        updateFileStatus(i, 'error', 'Error de conexión con el servidor.');
+        // fetch lanza TypeError cuando no hay conexión; el resto son errores de la API de subidas
+        updateFileStatus(i, 'error', error instanceof TypeError ? 'Error de conexión con el servidor.' : `Error: ${error.message}`);
       }
     }
+    await Promise.all(pendingJobs);
     setIsUploading(false);
   };
   
@@ -0,0 +1,69 @@
+import API_URL from './config';
+
+const CHUNK_SIZE = 4 * 1024 * 1024;
+const MAX_RETRIES = 5;
+
+// Error de la API que no tiene sentido reintentar (tamaño no válido, subida inexistente...)
+class UploadRejected extends Error {}
+
+const readDetail = async (response) => {
+  try {
+    return (await response.json()).detail;
+  } catch (error) {
+    return `HTTP ${response.status}`;
+  }
+};
+
+// Sube un archivo por partes a /uploads/ y devuelve el upload_id de la subida finalizada.
+// Si se corta la conexión, pregunta al servidor cuánto recibió y continúa desde ahí.
+export async function uploadInChunks(file, onProgress) {
+  const initResponse = await fetch(`${API_URL}/uploads/`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: file.name, size: file.size }),
+  });
+  if (!initResponse.ok) {
+    throw new UploadRejected(await readDetail(initResponse));
+  }
+  const { upload_id: uploadId } = await initResponse.json();
+
+  let offset = 0;
+  let retries = 0;
+  while (offset < file.size) {
+    try {
+      const response = await fetch(`${API_URL}/uploads/${uploadId}?offset=${offset}`, {
+        method: 'PUT',
+        body: file.slice(offset, offset + CHUNK_SIZE),
+      });
+      if (response.status === 409) {
+        offset = Number(response.headers.get('Upload-Offset'));
+        continue;
+      }
+      if (!response.ok) {
+        throw new UploadRejected(await readDetail(response));
+      }
+      offset = (await response.json()).offset;
+      retries = 0;
+      if (onProgress) onProgress(offset / file.size);
+    } catch (error) {
+      if (error instanceof UploadRejected || ++retries > MAX_RETRIES) throw error;
+      await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+      try {
+        const statusResponse = await fetch(`${API_URL}/uploads/${uploadId}`);
+        if (statusResponse.ok) offset = (await statusResponse.json()).offset;
+      } catch (statusError) {
+        // Sin conexión todavía: se reintenta en la siguiente vuelta
+      }
+    }
+  }
+
+  const finalizeResponse = await fetch(`${API_URL}/uploads/${uploadId}/finalize`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({}),
+  });
+  if (!finalizeResponse.ok) {
+    throw new UploadRejected(await readDetail(finalizeResponse));
+  }
+  return uploadId;
+}